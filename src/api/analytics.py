@@ -0,0 +1,320 @@
+"""
+analytics.py
+============
+
+Cohort analytics over the full student dataset.
+
+The transformed splits written by the data transformation stage are loaded once per model
+version as column arrays (encoded categories, model features and the observed target) and
+scored with one vectorized call. Cohort statistics are then computed by combining the codes
+of the grouping columns into one integer key per student and aggregating with np.bincount,
+a single O(n) pass per grouping set. Results are cached per grouping set, and everything is
+dropped when the registry swaps in a new model version.
+"""
+
+
+# libraries
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from logger import logger
+from api.utils import TRANSFORMED_DATA_DIR, predict_batch
+
+
+# largest number of (possibly empty) cohorts a grouping set may span
+MAX_COHORTS = 10_000_000
+
+
+class Population:
+    """
+    The transformed student dataset as column arrays, scored with one model version
+    """
+
+    def __init__(self, codes, vocabularies, features, feature_names, risk, predictions, probabilities, version,
+                 bundle=None, split_names=(), splits=None, rows=None):
+        """
+        :param codes: Encoded categorical columns {column: int array}
+        :param vocabularies: Category names per column, indexed by code
+        :param features: Model input matrix (encoded and scaled, in feature_names order)
+        :param risk: Observed academic_risk target
+        :param predictions: Predicted labels
+        :param probabilities: Predicted risk probabilities
+        :param version: The model version the predictions come from
+        :param bundle: The ArtifactBundle (model, scaler, encoders) the population was scored with
+        :param split_names: Names of the splits the students were loaded from
+        :param splits: Index into split_names per student
+        :param rows: Row number of each student within its split
+        """
+        self.codes = codes
+        self.vocabularies = vocabularies
+        self.features = features
+        self.feature_names = list(feature_names)
+        self.risk = risk
+        self.predictions = predictions
+        self.probabilities = probabilities
+        self.version = version
+        self.bundle = bundle
+        self.split_names = list(split_names)
+        self.splits = splits
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.probabilities)
+
+    @classmethod
+    def load(cls, bundle, model_features, data_dir=TRANSFORMED_DATA_DIR, splits=("train", "val", "test")):
+        """
+        Load the transformed splits and score them with the bundle's model
+
+        :param bundle: The active ArtifactBundle
+        :param model_features: Model input columns, in order
+        :param data_dir: Directory with the transformed splits (parquet or csv)
+        :raises FileNotFoundError: If no transformed split is found
+        """
+        # imported here so the API starts without pandas until analytics are first requested
+        import pandas as pd
+
+        frames, split_names = [], []
+        for split in splits:
+            for suffix in (".parquet", ".csv"):
+                path = Path(data_dir) / f"{split}{suffix}"
+                if path.exists():
+                    frames.append(pd.read_parquet(path) if suffix == ".parquet" else pd.read_csv(path))
+                    split_names.append(split)
+                    break
+
+        if not frames:
+            raise FileNotFoundError(f"No transformed datasets found in {data_dir}, run the pipeline first")
+
+        data = pd.concat(frames, ignore_index=True)
+
+        # where every student comes from, so results can point back at the source rows
+        sizes = [len(frame) for frame in frames]
+        split_index = np.repeat(np.arange(len(frames), dtype=np.int8), sizes)
+        rows = np.concatenate([np.arange(size) for size in sizes])
+
+        categorical_columns = [col for col in bundle.metadata["categorical_columns"] if col in data.columns]
+        codes = {col: data[col].to_numpy() for col in categorical_columns}
+        vocabularies = {col: np.asarray(bundle.vocabularies[col]) for col in categorical_columns}
+
+        # the transformed splits are in the space the sklearn model was trained on (scaled, encoded)
+        features = data[list(model_features)].to_numpy(dtype=np.float64)
+        predictions, probabilities = predict_batch(bundle.model, features)
+
+        risk = data[bundle.metadata["target_column"]].to_numpy()
+
+        logger.info(f"Population of {len(data)} students scored with model version {bundle.version}")
+
+        return cls(codes, vocabularies, features, model_features, risk,
+                   np.asarray(predictions), np.asarray(probabilities, dtype=np.float64), bundle.version, bundle,
+                   split_names, split_index, rows)
+
+    def mask(self, filters: dict = None) -> np.ndarray:
+        """
+        Boolean mask of the students matching every filter
+
+        :param filters: {column: category or list of categories}
+        :raises ValueError: On an unknown column or category
+        """
+        selected = np.ones(len(self), dtype=bool)
+
+        for col, values in (filters or {}).items():
+            if col not in self.codes:
+                raise ValueError(f"Unknown cohort column '{col}'. Available columns: {list(self.codes)}")
+
+            values = values if isinstance(values, (list, tuple)) else [values]
+            lookup = {str(value): code for code, value in enumerate(self.vocabularies[col])}
+
+            unknown = [value for value in values if str(value) not in lookup]
+            if unknown:
+                raise ValueError(f"Unknown categories {unknown} for '{col}'. Available: {list(lookup)}")
+
+            selected &= np.isin(self.codes[col], [lookup[str(value)] for value in values])
+
+        return selected
+
+
+def wilson_interval(successes, counts, z):
+    """
+    Wilson score interval of binomial proportions (vectorized)
+    """
+    counts = np.maximum(counts, 1)
+    rate = successes / counts
+    denominator = 1 + z ** 2 / counts
+    centre = (rate + z ** 2 / (2 * counts)) / denominator
+    margin = z * np.sqrt(rate * (1 - rate) / counts + z ** 2 / (4 * counts ** 2)) / denominator
+    return centre - margin, centre + margin
+
+
+CONFIDENCE_Z = {0.9: 1.6448536269514722, 0.95: 1.959963984540054, 0.99: 2.5758293035489004}
+
+
+class CohortAnalytics:
+    def __init__(self, population: Population, max_cached: int = 256):
+        """
+        Initialize the analytics engine
+
+        :param population: The scored population
+        :param max_cached: Number of query results kept in memory
+        """
+        self.population = population
+        self.max_cached = max_cached
+        self._cache = {}
+        # requests are served from a thread pool; lookups, inserts and evictions share this lock
+        self._cache_lock = threading.Lock()
+
+    def cohort_keys(self, group_by):
+        """
+        One integer key per student combining the codes of the grouping columns.
+        Unseen categories (code -1) get their own 'unknown' slot.
+
+        :return: The keys and the size of each grouping dimension
+        """
+        dims = []
+        keys = np.zeros(len(self.population), dtype=np.int64)
+
+        for col in group_by:
+            if col not in self.population.codes:
+                raise ValueError(f"Unknown cohort column '{col}'. Available columns: {list(self.population.codes)}")
+
+            size = len(self.population.vocabularies[col]) + 1
+            dims.append(size)
+            keys = keys * size + (self.population.codes[col].astype(np.int64) + 1)
+
+        if int(np.prod(dims, dtype=np.float64)) > MAX_COHORTS:
+            raise ValueError(f"Grouping by {list(group_by)} spans too many cohorts")
+
+        return keys, dims
+
+    def cohorts(self, group_by, filters: dict = None, confidence: float = 0.95, min_count: int = 1) -> dict:
+        """
+        Risk statistics for every non-empty cohort of the grouping set
+
+        :param group_by: Categorical columns, e.g. ['Race', 'SES_Quartile']
+        :param filters: Restrict to students matching {column: categories} first
+        :param confidence: Confidence level of the intervals (0.9, 0.95 or 0.99)
+        :param min_count: Leave out cohorts smaller than this
+        :return: Overall and per-cohort counts, observed risk rate, predicted risk rate and mean
+            predicted probability, each with a confidence interval
+        :rtype: dict
+        """
+        if confidence not in CONFIDENCE_Z:
+            raise ValueError(f"Unsupported confidence level {confidence}. Expected one of {list(CONFIDENCE_Z)}")
+
+        cache_key = (tuple(group_by), tuple(sorted((k, str(v)) for k, v in (filters or {}).items())), confidence, min_count)
+        with self._cache_lock:
+            cached = self._cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        population = self.population
+        z = CONFIDENCE_Z[confidence]
+
+        keys, dims = self.cohort_keys(group_by)
+        risk = population.risk.astype(np.float64)
+        predicted = (population.predictions == 1).astype(np.float64)
+        probabilities = population.probabilities
+
+        if filters:
+            selected = population.mask(filters)
+            keys, risk, predicted, probabilities = keys[selected], risk[selected], predicted[selected], probabilities[selected]
+
+        n_slots = int(np.prod(dims)) if dims else 1
+
+        # one bincount per statistic over the same keys
+        counts = np.bincount(keys, minlength=n_slots)
+        risk_sum = np.bincount(keys, weights=risk, minlength=n_slots)
+        predicted_sum = np.bincount(keys, weights=predicted, minlength=n_slots)
+        probability_sum = np.bincount(keys, weights=probabilities, minlength=n_slots)
+        probability_sq_sum = np.bincount(keys, weights=probabilities ** 2, minlength=n_slots)
+
+        occupied = np.flatnonzero(counts >= max(min_count, 1))
+        n = counts[occupied].astype(np.float64)
+
+        risk_low, risk_high = wilson_interval(risk_sum[occupied], n, z)
+        predicted_low, predicted_high = wilson_interval(predicted_sum[occupied], n, z)
+
+        mean_probability = probability_sum[occupied] / n
+        variance = np.maximum(probability_sq_sum[occupied] / n - mean_probability ** 2, 0) * n / np.maximum(n - 1, 1)
+        margin = z * np.sqrt(variance / n)
+
+        labels = np.unravel_index(occupied, dims) if dims else []
+        # slot 0 of every dimension holds the unseen categories, slot k + 1 the category with code k
+        names = {col: np.concatenate([["unknown"], population.vocabularies[col].astype(object)]) for col in group_by}
+
+        rows = []
+        for i in range(len(occupied)):
+            rows.append({
+                "cohort": {col: str(names[col][labels[j][i]]) for j, col in enumerate(group_by)},
+                "count": int(n[i]),
+                "risk_rate": float(risk_sum[occupied[i]] / n[i]),
+                "risk_rate_ci": [float(risk_low[i]), float(risk_high[i])],
+                "predicted_risk_rate": float(predicted_sum[occupied[i]] / n[i]),
+                "predicted_risk_rate_ci": [float(predicted_low[i]), float(predicted_high[i])],
+                "mean_probability": float(mean_probability[i]),
+                "mean_probability_ci": [float(mean_probability[i] - margin[i]), float(mean_probability[i] + margin[i])],
+            })
+
+        result = {
+            "model_version": population.version,
+            "group_by": list(group_by),
+            "confidence": confidence,
+            "count": int(len(keys)),
+            "risk_rate": float(risk.mean()) if len(keys) else 0.0,
+            "predicted_risk_rate": float(predicted.mean()) if len(keys) else 0.0,
+            "mean_probability": float(probabilities.mean()) if len(keys) else 0.0,
+            "cohorts": rows,
+        }
+
+        with self._cache_lock:
+            if cache_key not in self._cache and len(self._cache) >= self.max_cached:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[cache_key] = result
+
+        return result
+
+
+class PopulationStore:
+    """
+    Holds the scored population and its analytics engine for the active model version
+    """
+
+    def __init__(self, registry, model_features, data_dir=TRANSFORMED_DATA_DIR):
+        self.registry = registry
+        self.model_features = list(model_features)
+        self.data_dir = data_dir
+
+        self._population = None
+        self._analytics = None
+        self._lock = threading.Lock()
+
+        # everything derived from the previous model's predictions is stale after a swap
+        registry.on_swap(lambda previous, bundle: self.clear())
+
+    def clear(self):
+        with self._lock:
+            self._population = None
+            self._analytics = None
+
+    def population(self) -> Population:
+        bundle = self.registry.get()
+        population = self._population
+        if population is None or population.version != bundle.version:
+            with self._lock:
+                if self._population is None or self._population.version != bundle.version:
+                    self._population = Population.load(bundle, self.model_features, self.data_dir)
+                    self._analytics = CohortAnalytics(self._population)
+                population = self._population
+        return population
+
+    def analytics(self) -> CohortAnalytics:
+        population = self.population()
+        analytics = self._analytics
+        if analytics is None or analytics.population is not population:
+            with self._lock:
+                if self._analytics is None or self._analytics.population is not population:
+                    self._analytics = CohortAnalytics(population)
+                analytics = self._analytics
+        return analytics
@@ -1,6 +1,31 @@
-from fastapi import FastAPI
-from api.schema import StudentFeatures, PredictionResponse
-from api.utils import load_model, load_scaler, load_encoders, prepare_features, predict
+import asyncio
+import os
+import time
+import numpy as np
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from api.analytics import PopulationStore
+from api.batching import MicroBatcher
+from api.cache import PredictionCache, canonical_key
+from api.codec import JSON, binary_formats, decode_columns, encode_predictions, media_type, negotiate
+from api.explain import explain_batch
+from api.interventions import InterventionSimulator
+from api.metrics import MetricsMiddleware
+from api.risk_index import RiskIndexStore
+from api.schema import (
+    StudentFeatures, PredictionResponse, BatchPredictionRequest, BatchPredictionResponse,
+    CohortQuery, CohortResponse, InterventionRequest, InterventionResponse, RiskQuery, RiskQueryResponse
+)
+from api.registry import ArtifactRegistry
+from api.utils import (
+    ARRAY_STORE_DIR, prepare_features, predict, students_to_columns, prepare_features_batch, predict_batch
+)
+from instrumentation import StackSampler, metrics, span, span_duration
 
 # ------------------- Configuration ------------------- #
 # Define which features are used in the model
@@ -17,42 +42,438 @@ MODEL_FEATURES = [
 NUMERICAL_FEATURES = ["GPA", "AttendanceRate", "TestScore_Math", "StudyHours"]
 CATEGORICAL_FEATURES = ["ParentalEducation", "SchoolType", "Gender"]  # any categorical in model_features
 
-# ------------------- Load artifacts ------------------- #
-model = load_model()
-scaler = load_scaler()
-encoders = load_encoders(CATEGORICAL_FEATURES)
+# Fold the scaler and a linear model into one dot product + sigmoid when the model type allows
+USE_INFERENCE_PLAN = os.getenv("RISK_API_INFERENCE_PLAN", "1") != "0"
+# Check the fused plan against the sklearn path at startup
+VERIFY_INFERENCE_PLAN = os.getenv("RISK_API_VERIFY_PLAN", "0") == "1"
 
-# ------------------- FastAPI app ------------------- #
-app = FastAPI(
-    title="Student Academic Risk Prediction API",
-    version="1.0.0"
+# Serve the model, scaler and encoders from memory-mapped arrays shared by all workers on a host
+# ('0' unpickles a private copy in every worker)
+USE_ARRAY_STORE = os.getenv("RISK_API_MMAP_ARTIFACTS", "1") != "0"
+STORE_DIR = os.getenv("RISK_API_ARRAY_STORE_DIR", str(ARRAY_STORE_DIR))
+
+# Seconds between checks for retrained artifacts (0 disables hot reload)
+RELOAD_INTERVAL = float(os.getenv("RISK_API_RELOAD_INTERVAL", "30"))
+
+# Opt-in micro-batching of concurrent /predict requests
+USE_MICRO_BATCHING = os.getenv("RISK_API_MICROBATCH", "0") == "1"
+BATCH_MAX_SIZE = int(os.getenv("RISK_API_BATCH_MAX_SIZE", "64"))
+BATCH_MAX_WAIT_MS = float(os.getenv("RISK_API_BATCH_MAX_WAIT_MS", "2"))
+
+# Background rows used to explain non-linear models, and risk factors listed per student
+EXPLAIN_BACKGROUND = int(os.getenv("RISK_API_EXPLAIN_BACKGROUND", "20"))
+# Model evaluations per student explained for non-linear models (exact Shapley values when they fit)
+EXPLAIN_EVALUATIONS = int(os.getenv("RISK_API_EXPLAIN_EVALUATIONS", "512"))
+TOP_RISK_FACTORS = int(os.getenv("RISK_API_TOP_RISK_FACTORS", "3"))
+
+# Response cache for repeated /predict payloads ('sqlite' shares hits between workers on one host)
+USE_CACHE = os.getenv("RISK_API_CACHE", "1") == "1"
+CACHE_SIZE = int(os.getenv("RISK_API_CACHE_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("RISK_API_CACHE_TTL", "300"))
+CACHE_BACKEND = os.getenv("RISK_API_CACHE_BACKEND", "memory")
+CACHE_PATH = os.getenv("RISK_API_CACHE_PATH", "/tmp/risk_api_cache.sqlite")
+
+# Opt-in profiling: X-Profile: 1 requests, a random sample of requests, and /debug/profile
+PROFILING = os.getenv("RISK_API_PROFILING", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.getenv("RISK_API_PROFILE_SAMPLE_RATE", "0"))
+
+# ------------------- Artifacts ------------------- #
+# loaded lazily as one versioned bundle (at startup, not at import)
+registry = ArtifactRegistry(
+    model_features=MODEL_FEATURES,
+    categorical_columns=CATEGORICAL_FEATURES,
+    numerical_columns=NUMERICAL_FEATURES,
+    use_inference_plan=USE_INFERENCE_PLAN,
+    verify_inference_plan=VERIFY_INFERENCE_PLAN,
+    explain_background=EXPLAIN_BACKGROUND,
+    explain_evaluations=EXPLAIN_EVALUATIONS,
+    store_dir=STORE_DIR if USE_ARRAY_STORE else None
 )
 
+# the transformed dataset scored with the active model, for the analytics endpoints
+population_store = PopulationStore(registry, MODEL_FEATURES)
+# precomputed ranking of the population by predicted risk, rebuilt per model version
+risk_index_store = RiskIndexStore(population_store)
 
-@app.get("/")
-def health_check():
-    return {"status": "API is running"}
+cache = PredictionCache(CACHE_SIZE, CACHE_TTL, CACHE_BACKEND, CACHE_PATH) if USE_CACHE else None
+if cache is not None:
+    def invalidate_cache(previous, bundle):
+        # entries of the previous model version must never be served again. Loading the first
+        # model is not a swap: there is nothing to invalidate yet
+        if previous is not None:
+            cache.invalidate(bundle.version)
 
+    registry.on_swap(invalidate_cache)
 
-@app.post("/predict", response_model=PredictionResponse)
-def predict_academic_risk(data: StudentFeatures):
+batcher = None
+
+
+# ------------------- Scoring ------------------- #
+def score_student(data):
     """
-    Generate prediction for academic risk
+    Score a single student (the direct /predict path)
     """
+    bundle = registry.get()
+
     # Prepare features with proper scaling and encoding
     features_array = prepare_features(
         data=data,
         model_features=MODEL_FEATURES,
         categorical_columns=CATEGORICAL_FEATURES,
         numerical_columns=NUMERICAL_FEATURES,
-        encoders=encoders,
-        scaler=scaler
+        encoders=bundle.encoders,
+        scaler=bundle.scoring_scaler
     )
 
     # Make prediction
-    prediction, probability = predict(model, features_array)
+    with span("predict", "predict"):
+        prediction, probability = predict(bundle.scoring_model, features_array)
+
+    return prediction, probability, bundle.version
+
+
+def prepare_columns(bundle, columns):
+    """
+    Prepare the whole batch with one encoding and scaling pass
+    """
+    return prepare_features_batch(
+        columns=columns,
+        model_features=MODEL_FEATURES,
+        categorical_columns=CATEGORICAL_FEATURES,
+        numerical_columns=NUMERICAL_FEATURES,
+        encoders=bundle.encoders,
+        scaler=bundle.scoring_scaler
+    )
+
+
+def score_columns(columns):
+    """
+    Score a columnar batch {feature: values} in one vectorized pass
+    """
+    bundle = registry.get()
+    features_array = prepare_columns(bundle, columns)
+
+    # Make predictions
+    with span("predict_batch", "predict"):
+        predictions, probabilities = predict_batch(bundle.scoring_model, features_array)
+
+    return predictions, probabilities, bundle.version
+
+
+def score_students(students):
+    """
+    Score a list of students in one vectorized pass (batch endpoint and micro-batches)
+    """
+    return score_columns(students_to_columns(students, MODEL_FEATURES))
+
+
+def explain_students(students):
+    """
+    Score and explain a list of students, reusing the prepared features for the explanations
+    """
+    bundle = registry.get()
+    if bundle.explainer is None:
+        raise HTTPException(status_code=503, detail="Explanations are unavailable: no background sample was found")
+
+    features_array = prepare_columns(bundle, students_to_columns(students, MODEL_FEATURES))
+    predictions, probabilities = predict_batch(bundle.scoring_model, features_array)
+    explanations = explain_batch(bundle.explainer, features_array, MODEL_FEATURES, k=TOP_RISK_FACTORS)
+
+    return predictions, probabilities, bundle.version, explanations
+
+
+def explain_student(data):
+    """
+    Score and explain a single student (the /explain and /predict?explain=true path)
+    """
+    predictions, probabilities, model_version, explanations = explain_students([data])
+
+    return {
+        "academic_risk": int(predictions[0]),
+        "probability": float(probabilities[0]),
+        "model_version": model_version,
+        "explanation": explanations[0],
+    }
+
+
+# ------------------- FastAPI app ------------------- #
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global batcher
+
+    # load and warm up the artifacts before accepting traffic
+    registry.get()
+    if RELOAD_INTERVAL > 0:
+        registry.start_watching(RELOAD_INTERVAL)
+
+    if USE_MICRO_BATCHING:
+        batcher = MicroBatcher(score_students, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+        await batcher.start()
+
+    yield
+
+    if batcher is not None:
+        await batcher.stop()
+        batcher = None
+
+    registry.stop_watching()
+
+
+app = FastAPI(
+    title="Student Academic Risk Prediction API",
+    version="1.0.0",
+    lifespan=lifespan
+)
+app.add_middleware(MetricsMiddleware, profiling=PROFILING, sample_rate=PROFILE_SAMPLE_RATE)
+
+
+@app.exception_handler(RequestValidationError)
+async def validation_error(request: Request, exc: RequestValidationError):
+    """
+    422 response as FastAPI's default, except that rejected NaN and infinite inputs (bare NaN
+    tokens in the JSON body) are not echoed back, since they cannot be serialized to JSON
+    """
+    errors = [
+        {key: value for key, value in error.items()
+         if key != "input" or not isinstance(value, float) or np.isfinite(value)}
+        for error in exc.errors()
+    ]
+    return JSONResponse(status_code=422, content={"detail": jsonable_encoder(errors)})
+
+
+@app.get("/")
+def health_check():
+    return {"status": "API is running", **registry.info()}
+
+
+@app.post("/predict", response_model=PredictionResponse, response_model_exclude_none=True)
+async def predict_academic_risk(data: StudentFeatures, request: Request, explain: bool = False):
+    """
+    Generate prediction for academic risk (with per-feature contributions when explain is set)
+    """
+    # routing and validation of the body, since MetricsMiddleware received the request
+    span_duration.observe(time.perf_counter() - request.state.received, "predict", "parse")
+
+    if explain:
+        return await run_in_threadpool(explain_student, data)
+
+    key = None
+    if cache is not None:
+        key = canonical_key(data, MODEL_FEATURES)
+        # the shared SQLite backend does file I/O, which must not block the event loop
+        if cache.shared is not None:
+            cached = await run_in_threadpool(cache.get, registry.get().version, key)
+        else:
+            cached = cache.get(registry.get().version, key)
+        if cached is not None:
+            prediction, probability, model_version = cached
+            return {"academic_risk": prediction, "probability": probability, "model_version": model_version}
+
+    if batcher is not None:
+        prediction, probability, model_version = await batcher.submit(data)
+    else:
+        prediction, probability, model_version = await run_in_threadpool(score_student, data)
+
+    if key is not None:
+        if cache.shared is not None:
+            await run_in_threadpool(cache.put, model_version, key, (prediction, probability, model_version))
+        else:
+            cache.put(model_version, key, (prediction, probability, model_version))
 
     return {
         "academic_risk": int(prediction),
         "probability": float(probability),
+        "model_version": model_version,
+    }
+
+
+@app.post("/explain", response_model=PredictionResponse)
+def explain_academic_risk(data: StudentFeatures):
+    """
+    Generate prediction for academic risk with per-feature contributions and top risk factors
+    """
+    return explain_student(data)
+
+
+# /predict/batch reads its body itself to negotiate the format, so the schemas are documented here
+BATCH_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            JSON: {"schema": BatchPredictionRequest.model_json_schema(ref_template="#/components/schemas/{model}")},
+            **{content_type: {"schema": {"type": "string", "format": "binary"}} for content_type in binary_formats()},
+        },
     }
+}
+
+
+@app.post("/predict/batch", response_model=BatchPredictionResponse, response_model_exclude_none=True,
+          openapi_extra=BATCH_REQUEST_BODY)
+async def predict_academic_risk_batch(request: Request, explain: bool = False):
+    """
+    Generate predictions for a batch of students in one vectorized pass
+    (with per-feature contributions when explain is set).
+
+    JSON by default; binary clients send and accept application/x-numpy-records or
+    application/vnd.apache.arrow.stream (see api.codec), which are decoded straight into columns.
+    """
+    body = await request.body()
+    content_type = media_type(request.headers.get("content-type"))
+    accept = negotiate(request.headers.get("accept"))
+
+    if explain and accept != JSON:
+        raise HTTPException(status_code=406, detail="Explanations are only available as JSON")
+
+    if content_type == JSON:
+        try:
+            with span("predict_batch", "parse"):
+                students = BatchPredictionRequest.model_validate_json(body).students
+        except ValidationError as e:
+            raise RequestValidationError(e.errors(include_url=False))
+        if not students:
+            predictions, probabilities, model_version = np.empty(0, dtype=int), np.empty(0), registry.get().version
+            explanations = [] if explain else None
+        elif explain:
+            predictions, probabilities, model_version, explanations = await run_in_threadpool(explain_students, students)
+        else:
+            predictions, probabilities, model_version = await run_in_threadpool(score_students, students)
+            explanations = None
+
+    elif content_type in binary_formats():
+        if explain:
+            raise HTTPException(status_code=400, detail="Explanations require a JSON request")
+        try:
+            with span("predict_batch", "parse"):
+                columns = decode_columns(body, content_type, MODEL_FEATURES, CATEGORICAL_FEATURES)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        if len(columns[MODEL_FEATURES[0]]) == 0:
+            predictions, probabilities, model_version = np.empty(0, dtype=int), np.empty(0), registry.get().version
+        else:
+            predictions, probabilities, model_version = await run_in_threadpool(score_columns, columns)
+        explanations = None
+
+    else:
+        raise HTTPException(status_code=415, detail=f"Unsupported content type '{content_type}'. "
+                                                    f"Supported: {[JSON, *binary_formats()]}")
+
+    if accept != JSON:
+        return Response(
+            content=encode_predictions(predictions, probabilities, accept),
+            media_type=accept,
+            headers={"X-Model-Version": model_version}
+        )
+
+    return {
+        "academic_risk": predictions.astype(int).tolist(),
+        "probability": probabilities.astype(float).tolist(),
+        "model_version": model_version,
+        "explanations": explanations,
+    }
+
+
+@app.post("/analytics/cohorts", response_model=CohortResponse)
+def cohort_analytics(query: CohortQuery):
+    """
+    Risk rates and mean predicted probability, with confidence intervals, for every cohort of
+    the grouping columns over the full student dataset
+    """
+    try:
+        analytics = population_store.analytics()
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    try:
+        return analytics.cohorts(query.group_by, filters=query.filters, confidence=query.confidence,
+                                 min_count=query.min_count)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/interventions/simulate", response_model=InterventionResponse)
+def simulate_interventions(request: InterventionRequest):
+    """
+    Rescore a cohort under each intervention scenario in one vectorized pass and report the
+    change in predicted risk rate
+    """
+    try:
+        population = population_store.population()
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    try:
+        return InterventionSimulator(population).simulate(
+            [scenario.dict() for scenario in request.scenarios], filters=request.filters
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/risk/students", response_model=RiskQueryResponse)
+def highest_risk_students(query: RiskQuery):
+    """
+    Paginated highest-risk students of a segment (optionally above a probability threshold),
+    answered from the precomputed risk index
+    """
+    if query.limit < 1 or query.offset < 0:
+        raise HTTPException(status_code=400, detail="limit must be positive and offset non-negative")
+
+    try:
+        index = risk_index_store.get()
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    try:
+        return index.query(query.filters, limit=query.limit, offset=query.offset,
+                           min_probability=query.min_probability)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    Request counters, latency histograms and phase spans of this worker, in the Prometheus text format
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/profile", response_class=PlainTextResponse)
+async def sample_profile(seconds: float = 10.0, interval_ms: float = 5.0):
+    """
+    Sample the stacks of every thread of this worker for a while and return them in the folded
+    flame graph format (only when RISK_API_PROFILING=1)
+    """
+    if not PROFILING:
+        raise HTTPException(status_code=404, detail="Profiling is disabled, set RISK_API_PROFILING=1")
+
+    sampler = StackSampler(interval_ms / 1000).start()
+    try:
+        await asyncio.sleep(min(max(seconds, 0.0), 60.0))
+    finally:
+        sampler.stop()
+
+    return PlainTextResponse(sampler.folded())
+
+
+@app.get("/stats/cache")
+def cache_stats():
+    """
+    Hit/miss counters of this worker's /predict response cache
+    """
+    if cache is None:
+        return {"enabled": False}
+
+    return {"enabled": True, **cache.stats()}
+
+
+@app.get("/stats/batching")
+def batching_stats():
+    """
+    Queue depth and batch-size statistics of this worker's micro-batcher
+    """
+    if batcher is None:
+        return {"enabled": False}
+
+    return {"enabled": True, **batcher.stats()}
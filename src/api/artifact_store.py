@@ -0,0 +1,479 @@
+"""
+artifact_store.py
+==================
+
+Memory-mapped serving artifacts, shared by every API worker on a host.
+
+With joblib.load, every worker process unpickles a private copy of the model, the scaler and the
+label encoders, so memory grows with the number of workers. The artifact store keeps the numeric
+content of those artifacts as plain .npy files next to a small JSON manifest:
+
+- the coefficients of linear models (and the fused inference plan)
+- the node arrays of tree ensembles (random forests, extra trees, histogram gradient boosting)
+- the scaler statistics
+- every encoder vocabulary with its sorted lookup table
+
+Workers open the arrays with np.load(mmap_mode="r"). Nothing is deserialized, and all workers
+read the same page-cache copy. Scoring runs on numpy-only equivalents of the sklearn objects:
+LinearInferencePlan, TreeEnsemblePlan and ArrayScaler.
+
+There is one store directory per model version (the content hash of the source artifacts). It is
+built from the joblib artifacts by the first worker that needs it, while the other workers wait
+on a file lock. It can also be built ahead of time with `python -m api.artifact_store`. Models
+that cannot be expressed as arrays (multiclass, linear models without a sigmoid probability,
+categorical splits) are still unpickled with joblib. The scaler and encoders are memory-mapped
+regardless.
+
+The served objects are array-backed, so the parity check of the fused plan (RISK_API_VERIFY_PLAN)
+runs here, against the sklearn model and scaler unpickled from the joblib artifacts.
+"""
+
+
+# libraries
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+
+import joblib
+import numpy as np
+
+from logger import logger
+from api.utils import LinearInferencePlan, LookupEncoder, is_fusable, verify_inference_plan
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows: concurrent builds are then not serialized
+    fcntl = None
+
+
+STORE_FORMAT = 1
+
+# tree models flattened into a TreeEnsemblePlan
+FOREST_MODELS = ("RandomForestClassifier", "ExtraTreesClassifier", "DecisionTreeClassifier")
+BOOSTING_MODELS = ("HistGradientBoostingClassifier",)
+
+# rows x trees descended at once by TreeEnsemblePlan (bounds the size of its index arrays)
+TREE_BLOCK_SIZE = 1 << 16
+
+
+class ArrayScaler:
+    """
+    StandardScaler.transform on (memory-mapped) mean and scale arrays
+    """
+
+    def __init__(self, mean, scale, with_mean=True, with_std=True):
+        self.mean_ = mean
+        self.scale_ = scale
+        self.with_mean = with_mean
+        self.with_std = with_std
+        self.n_features_in_ = len(mean)
+
+    @classmethod
+    def from_scaler(cls, scaler):
+        n_features = scaler.n_features_in_
+        mean = scaler.mean_ if getattr(scaler, "mean_", None) is not None else np.zeros(n_features)
+        scale = scaler.scale_ if getattr(scaler, "scale_", None) is not None else np.ones(n_features)
+        return cls(np.asarray(mean, dtype=np.float64), np.asarray(scale, dtype=np.float64),
+                   bool(scaler.with_mean), bool(scaler.with_std))
+
+    def transform(self, X):
+        X = np.array(X, dtype=np.float64)
+        if self.with_mean:
+            X -= self.mean_
+        if self.with_std:
+            X /= self.scale_
+        return X
+
+
+class TreeEnsemblePlan:
+    """
+    A binary tree ensemble as flat node arrays.
+
+    The nodes of all trees are concatenated, with the children of node i at children[i]
+    (left, right). Every (row, tree) pair descends one level per vectorized step, and pairs drop
+    out of the computation once they reach their leaf. Forests average the positive-class share
+    of the leaves. Gradient boosting sums the leaf values onto the baseline and applies a sigmoid.
+    Inputs are compared in float32 for forests and float64 for boosting, as sklearn does.
+    """
+
+    # node arrays, as saved in the artifact store
+    ARRAYS = ("feature", "threshold", "children", "missing_left", "is_leaf", "value", "roots")
+
+    def __init__(self, feature_names, feature, threshold, children, missing_left, is_leaf, value, roots,
+                 kind, classes, baseline=0.0):
+        self.feature_names = list(feature_names)
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.missing_left = missing_left
+        self.is_leaf = is_leaf
+        self.value = value
+        self.roots = roots
+        self.kind = kind
+        self.classes_ = np.asarray(classes)
+        self.baseline = float(baseline)
+
+    @classmethod
+    def from_model(cls, model, model_features):
+        """
+        Flatten a fitted binary forest or gradient boosting model
+
+        :return: The plan, or None if the model type is not supported
+        :rtype: TreeEnsemblePlan | None
+        """
+        name = type(model).__name__
+        if len(getattr(model, "classes_", ())) != 2:
+            return None
+
+        trees = []
+        if name in FOREST_MODELS:
+            kind, baseline = "forest", 0.0
+            for estimator in getattr(model, "estimators_", [model]):
+                tree = estimator.tree_
+                counts = tree.value[:, 0, :]
+                trees.append({
+                    "feature": tree.feature, "threshold": tree.threshold,
+                    "left": tree.children_left, "right": tree.children_right, "is_leaf": tree.children_left == -1,
+                    "missing_left": getattr(tree, "missing_go_to_left", np.zeros(tree.node_count, dtype=bool)),
+                    # share of the positive class (sklearn >= 1.4 already stores fractions)
+                    "value": counts[:, 1] / counts.sum(axis=1),
+                })
+        elif name in BOOSTING_MODELS:
+            if getattr(model, "_preprocessor", None) is not None:
+                return None
+            kind, baseline = "boosting", float(np.ravel(model._baseline_prediction)[0])
+            for (predictor,) in model._predictors:
+                nodes = predictor.nodes
+                if nodes["is_categorical"].any():
+                    return None
+                trees.append({
+                    "feature": nodes["feature_idx"], "threshold": nodes["num_threshold"],
+                    "left": nodes["left"], "right": nodes["right"], "is_leaf": nodes["is_leaf"],
+                    "missing_left": nodes["missing_go_to_left"], "value": nodes["value"],
+                })
+        else:
+            return None
+
+        def concat(key, dtype):
+            return np.concatenate([np.asarray(tree[key], dtype=dtype) for tree in trees])
+
+        sizes = [len(tree["value"]) for tree in trees]
+        roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int32)
+        offsets = np.repeat(roots, sizes)
+
+        # leaves are never descended from: their feature and children are placeholders
+        is_leaf = concat("is_leaf", bool)
+        children = np.column_stack([concat("left", np.int32) + offsets, concat("right", np.int32) + offsets])
+        children[is_leaf] = 0
+
+        return cls(
+            model_features,
+            feature=np.where(is_leaf, 0, concat("feature", np.int32)).astype(np.int32),
+            threshold=concat("threshold", np.float64),
+            children=children,
+            missing_left=concat("missing_left", bool),
+            is_leaf=is_leaf,
+            value=concat("value", np.float64),
+            roots=roots,
+            kind=kind, classes=model.classes_, baseline=baseline,
+        )
+
+    def leaves(self, features_array):
+        """
+        Leaf node reached in every tree, per row
+
+        :return: Node indices of shape (rows, trees)
+        :rtype: np.ndarray
+        """
+        features_array = np.asarray(features_array, dtype=np.float32 if self.kind == "forest" else np.float64)
+        n_rows, n_features = features_array.shape
+        values_flat = features_array.ravel()
+        children = self.children.ravel()
+
+        node = np.tile(self.roots, n_rows)
+        row_offsets = np.repeat(np.arange(n_rows, dtype=np.int64) * n_features, len(self.roots))
+
+        # (row, tree) pairs that have not reached a leaf yet
+        active = np.flatnonzero(~self.is_leaf.take(node))
+        while active.size:
+            current = node[active]
+            values = values_flat.take(row_offsets[active] + self.feature.take(current))
+            go_right = ~(values <= self.threshold.take(current))
+            missing = np.isnan(values)
+            if missing.any():
+                go_right[missing] = ~self.missing_left.take(current[missing])
+
+            current = children.take(2 * current + go_right)
+            node[active] = current
+            active = active[~self.is_leaf.take(current)]
+
+        return node.reshape(n_rows, len(self.roots))
+
+    def predict_proba_positive(self, features_array):
+        block = max(1, TREE_BLOCK_SIZE // len(self.roots))
+        scores = np.empty(len(features_array), dtype=np.float64)
+
+        for start in range(0, len(features_array), block):
+            values = self.value[self.leaves(features_array[start:start + block])]
+            scores[start:start + block] = values.mean(axis=1) if self.kind == "forest" else self.baseline + values.sum(axis=1)
+
+        if self.kind == "boosting":
+            scores = np.exp(-np.logaddexp(0.0, -scores))
+        return scores
+
+    def predict(self, features_array):
+        """
+        Generate predictions and positive-class probabilities
+        """
+        probabilities = self.predict_proba_positive(np.asarray(features_array))
+        # argmax over [1 - p, p], ties to the first class
+        predictions = self.classes_[(probabilities > 1 - probabilities).astype(np.intp)]
+
+        return predictions, probabilities
+
+
+# ------------------ Building the store ------------------ #
+def vocabulary_array(classes) -> np.ndarray:
+    """
+    An encoder vocabulary in a dtype np.load can memory-map (numbers stay numbers, the rest
+    becomes fixed-width unicode)
+    """
+    classes = np.asarray(classes)
+    return classes if classes.dtype.kind in "biuf" else classes.astype(str)
+
+
+def verify_plan(plan, paths: dict, model_features, numerical_columns, model=None, scaler=None, encoders=None):
+    """
+    Check the fused plan against the sklearn model and scaler (unpickled from the joblib
+    artifacts unless given), see api.utils.verify_inference_plan
+
+    :return: Maximum absolute probability difference
+    :raises ValueError: If the plan diverges from the sklearn path
+    """
+    model = joblib.load(paths["model"]) if model is None else model
+    scaler = joblib.load(paths["scaler"]) if scaler is None else scaler
+    encoders = joblib.load(paths["encoders"]) if encoders is None else encoders
+
+    max_diff = verify_inference_plan(plan, model, scaler, encoders, model_features, numerical_columns)
+    logger.info(f"Fused inference plan verified against the sklearn path (max abs diff {max_diff:.3e})")
+    return max_diff
+
+
+def build_store(paths: dict, model_features, numerical_columns, verify: bool = False) -> tuple:
+    """
+    Unpickle the joblib artifacts and convert them into the store's arrays
+
+    :param paths: Mapping with model, scaler, encoders and metadata artifact paths
+    :param verify: Check the fused linear plan against the sklearn model before it is stored
+    :return: (manifest, {array name: array})
+    :rtype: tuple
+    :raises ValueError: If verify is set and the fused plan diverges from the sklearn path
+    """
+    model = joblib.load(paths["model"])
+    sklearn_scaler = joblib.load(paths["scaler"])
+    all_encoders = joblib.load(paths["encoders"])
+    metadata = joblib.load(paths["metadata"])
+
+    arrays = {}
+    scaler = ArrayScaler.from_scaler(sklearn_scaler)
+    arrays["scaler/mean"], arrays["scaler/scale"] = scaler.mean_, scaler.scale_
+
+    for col, encoder in all_encoders.items():
+        classes = vocabulary_array(encoder.classes_)
+        lookup = LookupEncoder(classes)
+        arrays[f"encoders/{col}/classes"] = classes
+        arrays[f"encoders/{col}/order"] = lookup._order
+        arrays[f"encoders/{col}/sorted"] = lookup._sorted_classes
+
+    model_entry = {"type": type(model).__name__, "kind": "pickled"}
+    if is_fusable(model):
+        model_entry.update(kind="linear", bias=float(np.ravel(model.intercept_)[0]))
+        arrays["model/weights"] = np.asarray(model.coef_, dtype=np.float64).ravel()
+        arrays["model/classes"] = np.asarray(model.classes_)
+
+        plan = LinearInferencePlan.from_model(model, scaler, model_features, numerical_columns)
+        if verify:
+            verify_plan(plan, paths, model_features, numerical_columns,
+                        model=model, scaler=sklearn_scaler, encoders=all_encoders)
+        model_entry["plan_bias"] = plan.bias
+        arrays["plan/weights"] = plan.weights
+    else:
+        plan = TreeEnsemblePlan.from_model(model, model_features)
+        if plan is not None:
+            model_entry.update(kind=plan.kind, baseline=plan.baseline)
+            for name in TreeEnsemblePlan.ARRAYS:
+                arrays[f"model/{name}"] = getattr(plan, name)
+            arrays["model/classes"] = plan.classes_
+
+    manifest = {
+        "format": STORE_FORMAT,
+        "feature_names": list(model_features),
+        "numerical_columns": list(numerical_columns),
+        "model": model_entry,
+        "scaler": {"with_mean": scaler.with_mean, "with_std": scaler.with_std},
+        "encoders": list(all_encoders),
+        "metadata": {key: list(value) if isinstance(value, (list, tuple)) else value
+                     for key, value in metadata.items()},
+        "arrays": {name: name.replace("/", "__") + ".npy" for name in arrays},
+    }
+    return manifest, arrays
+
+
+def write_store(directory: Path, manifest: dict, arrays: dict):
+    """
+    Write the arrays and the manifest into a temporary directory and rename it into place, so
+    readers never see a partial store
+    """
+    directory = Path(directory)
+    tmp_dir = directory.with_name(f".{directory.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    for name, filename in manifest["arrays"].items():
+        np.save(tmp_dir / filename, np.ascontiguousarray(arrays[name]), allow_pickle=False)
+    (tmp_dir / "manifest.json").write_text(json.dumps(manifest, indent=2, default=str))
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+
+
+def read_manifest(directory: Path, model_features) -> dict:
+    """
+    The manifest of a complete store built for these model features, or None
+    """
+    try:
+        manifest = json.loads((Path(directory) / "manifest.json").read_text())
+    except (OSError, ValueError):
+        return None
+    if manifest.get("format") != STORE_FORMAT or manifest.get("feature_names") != list(model_features):
+        return None
+    return manifest
+
+
+def read_arrays(directory: Path, manifest: dict) -> dict:
+    """
+    Open every array of the store read-only and memory-mapped
+    """
+    return {name: np.load(Path(directory) / filename, mmap_mode="r", allow_pickle=False)
+            for name, filename in manifest["arrays"].items()}
+
+
+@contextmanager
+def store_lock(root: Path):
+    """
+    Exclusive lock over the store root, so only one worker per host builds a version
+    """
+    if fcntl is None:
+        yield
+        return
+
+    with open(Path(root) / ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def prune(root: Path, keep: str):
+    """
+    Remove the stores of other versions (workers still mapping them keep their pages)
+    """
+    for path in Path(root).iterdir():
+        if path.is_dir() and path.name != keep and not path.name.startswith("."):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+# ------------------ Loading ------------------ #
+def assemble(manifest: dict, arrays: dict, paths: dict, memory_mapped: bool) -> dict:
+    """
+    Build the serving objects on top of the store's arrays
+
+    :return: model, plan (fused linear plan or None), scaler, encoders (every encoded column),
+        vocabularies, metadata, model_type and memory_mapped
+    :rtype: dict
+    """
+    feature_names = manifest["feature_names"]
+    entry = manifest["model"]
+
+    plan = None
+    if entry["kind"] == "linear":
+        model = LinearInferencePlan(feature_names, arrays["model/weights"], entry["bias"], arrays["model/classes"])
+        plan = LinearInferencePlan(feature_names, arrays["plan/weights"], entry["plan_bias"], arrays["model/classes"])
+    elif entry["kind"] in ("forest", "boosting"):
+        model = TreeEnsemblePlan(
+            feature_names, *(arrays[f"model/{name}"] for name in TreeEnsemblePlan.ARRAYS),
+            kind=entry["kind"], classes=arrays["model/classes"], baseline=entry["baseline"],
+        )
+    else:
+        model = joblib.load(paths["model"])
+
+    scaler = ArrayScaler(arrays["scaler/mean"], arrays["scaler/scale"], **manifest["scaler"])
+
+    encoders, vocabularies = {}, {}
+    for col in manifest["encoders"]:
+        vocabularies[col] = arrays[f"encoders/{col}/classes"]
+        encoders[col] = LookupEncoder(vocabularies[col], order=arrays[f"encoders/{col}/order"],
+                                      sorted_classes=arrays[f"encoders/{col}/sorted"])
+
+    return {
+        "model": model, "plan": plan, "scaler": scaler, "encoders": encoders, "vocabularies": vocabularies,
+        "metadata": manifest["metadata"], "model_type": entry["type"], "memory_mapped": memory_mapped,
+    }
+
+
+def open_store(root: Path, version: str, paths: dict, model_features, numerical_columns, unchanged=None,
+               verify: bool = False) -> dict:
+    """
+    Open the store of a model version, building it first if no worker has done so yet
+
+    :param root: Directory holding one store per version
+    :param version: Content hash of the source artifacts
+    :param paths: Mapping with model, scaler, encoders and metadata artifact paths
+    :param unchanged: Optional callable telling whether the source artifacts still match the
+        version, checked before a new store is written
+    :param verify: Check the fused linear plan against the sklearn model from the joblib artifacts
+        (before a new store is written, or when an existing one is opened)
+    :return: The serving objects (see assemble)
+    :rtype: dict
+    :raises RuntimeError: If the artifacts changed while the store was being built
+    :raises ValueError: If verify is set and the fused plan diverges from the sklearn path
+    """
+    root = Path(root)
+    directory = root / version
+
+    manifest = read_manifest(directory, model_features)
+    if manifest is None:
+        try:
+            root.mkdir(parents=True, exist_ok=True)
+            with store_lock(root):
+                manifest = read_manifest(directory, model_features)
+                if manifest is None:
+                    manifest, arrays = build_store(paths, model_features, numerical_columns, verify=verify)
+                    verify = False  # checked before the store was written
+                    if unchanged is not None and not unchanged():
+                        raise RuntimeError("Artifacts changed while the store was built, retrying on the next poll")
+                    write_store(directory, manifest, arrays)
+                    prune(root, keep=version)
+                    logger.info(f"Artifact store of version {version} written - {directory}")
+        except OSError as e:
+            # read-only artifact directory: serve private in-memory arrays instead
+            logger.warning(f"Artifact store unavailable ({e}), loading the artifacts into memory")
+            manifest, arrays = build_store(paths, model_features, numerical_columns, verify=verify)
+            return assemble(manifest, arrays, paths, memory_mapped=False)
+
+    artifacts = assemble(manifest, read_arrays(directory, manifest), paths, memory_mapped=True)
+    # a store written by another worker (or without verification) is checked by this one
+    if verify and artifacts["plan"] is not None:
+        verify_plan(artifacts["plan"], paths, model_features, numerical_columns)
+    return artifacts
+
+
+if __name__ == "__main__":
+    # build the store of the current artifacts ahead of time (e.g. while building the image)
+    from api.app import registry
+
+    bundle = registry.load()
+    logger.info(f"Artifact store ready for model version {bundle.version} ({registry.store_dir})")
@@ -0,0 +1,155 @@
+"""
+batching.py
+============
+
+Micro-batching queue for the prediction API.
+
+Concurrent requests are collected into batches bounded by a maximum size and a maximum wait
+window, each batch is scored with one vectorized call in a worker thread, and the results are
+fanned back out to the waiting coroutines.
+"""
+
+
+# libraries
+import asyncio
+import time
+from collections import Counter
+
+
+class MicroBatcher:
+    def __init__(self, score_fn, max_batch_size: int = 64, max_wait_ms: float = 2.0):
+        """
+        Initialize the micro-batcher
+
+        :param score_fn: Callable scoring a list of items, returning (predictions, probabilities, model_version)
+        :param max_batch_size: Maximum number of requests scored together
+        :type max_batch_size: int
+        :param max_wait_ms: Maximum time the first request of a batch waits for company
+        :type max_wait_ms: float
+        """
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self.queue = None
+        self._task = None
+
+        # tuning statistics
+        self.batch_sizes = Counter()
+        self.total_batches = 0
+        self.total_items = 0
+        self.total_queue_wait = 0.0
+        self.total_score_time = 0.0
+
+    async def start(self):
+        """
+        Create the queue on the running event loop and start the batching worker
+        """
+        self.queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the worker and fail any request still waiting in the queue or in the batch
+        being collected or scored when the worker was cancelled
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        while self.queue is not None and not self.queue.empty():
+            _, future, _ = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Micro-batcher stopped"))
+
+    async def submit(self, item):
+        """
+        Queue one item and wait for its (prediction, probability, model_version)
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self, batch: list):
+        """
+        Wait for the first request, then gather more until the batch is full or the window closes.
+        The requests are appended to batch as they are taken off the queue.
+        """
+        batch.append(await self.queue.get())
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            # take whatever is already queued without waiting
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        try:
+            while True:
+                batch = []
+                await self._collect(batch)
+                await self._score(loop, batch)
+        finally:
+            # cancelled mid-batch: nothing will resolve these requests any more
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Micro-batcher stopped"))
+
+    async def _score(self, loop, batch: list):
+        """
+        Score one batch and resolve its futures
+        """
+        items = [item for item, _, _ in batch]
+
+        started = time.perf_counter()
+        try:
+            # score off the event loop so new requests keep queueing meanwhile
+            predictions, probabilities, model_version = await loop.run_in_executor(None, self.score_fn, items)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finished = time.perf_counter()
+
+        for i, (_, future, enqueued) in enumerate(batch):
+            self.total_queue_wait += started - enqueued
+            if not future.done():
+                future.set_result((predictions[i], probabilities[i], model_version))
+
+        self.batch_sizes[len(batch)] += 1
+        self.total_batches += 1
+        self.total_items += len(batch)
+        self.total_score_time += finished - started
+
+    def stats(self) -> dict:
+        """
+        Queue depth and batch-size statistics for tuning the batching window
+        """
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "total_batches": self.total_batches,
+            "total_items": self.total_items,
+            "mean_batch_size": self.total_items / self.total_batches if self.total_batches else 0.0,
+            "max_observed_batch_size": max(self.batch_sizes, default=0),
+            "mean_queue_wait_ms": 1000 * self.total_queue_wait / self.total_items if self.total_items else 0.0,
+            "mean_batch_score_ms": 1000 * self.total_score_time / self.total_batches if self.total_batches else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+        }
@@ -0,0 +1,215 @@
+"""
+cache.py
+============
+
+Response cache for /predict.
+
+Identical student payloads are answered from a bounded in-process LRU cache with a TTL.
+Keys combine the model version and the canonicalized feature values, so a new model version
+never serves stale predictions, and the cache is cleared when the registry swaps versions.
+An optional SQLite file behind the in-process layer lets several uvicorn workers share hits.
+SQLite errors (e.g. "database is locked" under contention between workers) are logged and
+treated as a miss or a skipped write, so the cache never fails a prediction.
+"""
+
+
+# libraries
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from logger import logger
+
+
+def canonical_key(data, feature_names):
+    """
+    Canonical form of a payload: its values in model feature order (floats normalized by
+    pydantic, so 2.4 and 2.40 give the same key)
+    """
+    return tuple(getattr(data, col) for col in feature_names)
+
+
+class SQLiteBackend:
+    """
+    Cache entries in a local SQLite file shared by every worker on the host
+    """
+
+    def __init__(self, path, max_size: int):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self._writes = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+        self.connection = sqlite3.connect(self.path, timeout=1.0, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "key TEXT PRIMARY KEY, version TEXT, prediction INTEGER, probability REAL, expires REAL, accessed REAL)"
+        )
+
+    def _failed(self, operation: str, error: sqlite3.Error):
+        self.errors += 1
+        logger.warning(f"Shared prediction cache {operation} failed, ignored: {error}")
+
+    def get(self, key: str, now: float):
+        """
+        The (prediction, probability, version, expires) row of a live entry, or None
+        """
+        with self._lock:
+            try:
+                row = self.connection.execute(
+                    "SELECT prediction, probability, version, expires FROM predictions WHERE key = ? AND expires > ?",
+                    (key, now)
+                ).fetchone()
+                if row is not None:
+                    # recency for the LRU pruning in put()
+                    self.connection.execute("UPDATE predictions SET accessed = ? WHERE key = ?", (now, key))
+            except sqlite3.Error as e:
+                self._failed("read", e)
+                return None
+        return row
+
+    def put(self, key: str, version: str, prediction: int, probability: float, expires: float, now: float):
+        with self._lock:
+            try:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, version, prediction, probability, expires, now)
+                )
+                self._writes += 1
+
+                # prune occasionally instead of on every write
+                if self._writes % 1000 == 0:
+                    self.connection.execute("DELETE FROM predictions WHERE expires <= ?", (now,))
+                    self.connection.execute(
+                        "DELETE FROM predictions WHERE key IN "
+                        "(SELECT key FROM predictions ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_size,)
+                    )
+            except sqlite3.Error as e:
+                self._failed("write", e)
+
+    def invalidate(self, version: str):
+        """
+        Drop every entry of other model versions
+        """
+        with self._lock:
+            try:
+                self.connection.execute("DELETE FROM predictions WHERE version != ?", (version,))
+            except sqlite3.Error as e:
+                self._failed("invalidation", e)
+
+    def size(self):
+        with self._lock:
+            try:
+                return self.connection.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+            except sqlite3.Error as e:
+                self._failed("count", e)
+                return None
+
+
+class PredictionCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0, backend: str = "memory", path=None):
+        """
+        Initialize the cache
+
+        :param max_size: Maximum entries kept in memory (and in the shared backend)
+        :param ttl: Seconds an entry stays valid
+        :param backend: 'memory', or 'sqlite' to share entries between workers through a local file
+        :param path: SQLite file of the shared backend
+        """
+        if backend not in ("memory", "sqlite"):
+            raise ValueError(f"Unknown cache backend: {backend}. Expected 'memory' or 'sqlite'")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.shared = SQLiteBackend(path, max_size) if backend == "sqlite" else None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, version: str, key: tuple):
+        """
+        Cached (prediction, probability, model_version) of a payload, or None
+        """
+        now = time.time()
+
+        with self._lock:
+            entry = self.entries.get((version, key))
+            if entry is not None:
+                if entry[1] > now:
+                    self.entries.move_to_end((version, key))
+                    self.hits += 1
+                    return entry[0]
+                del self.entries[(version, key)]
+
+        if self.shared is not None:
+            row = self.shared.get(json.dumps([version, *key]), now)
+            if row is not None:
+                # the local copy expires with the shared entry, not a full TTL after this hit
+                value, expires = tuple(row[:3]), row[3]
+                self._store(version, key, value, expires)
+                with self._lock:
+                    self.shared_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, version: str, key: tuple, value: tuple):
+        """
+        Cache the (prediction, probability, model_version) of a payload
+        """
+        now = time.time()
+        value = (int(value[0]), float(value[1]), value[2])
+
+        self._store(version, key, value, now + self.ttl)
+        if self.shared is not None:
+            self.shared.put(json.dumps([version, *key]), version, value[0], value[1], now + self.ttl, now)
+
+    def _store(self, version, key, value, expires):
+        with self._lock:
+            self.entries[(version, key)] = (value, expires)
+            self.entries.move_to_end((version, key))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, version: str = None):
+        """
+        Drop every entry (of the shared backend: every entry of another version than the new one)
+        """
+        with self._lock:
+            self.entries.clear()
+            self.invalidations += 1
+
+        if self.shared is not None and version is not None:
+            self.shared.invalidate(version)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "backend": "sqlite" if self.shared is not None else "memory",
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "size": len(self.entries),
+            "shared_size": self.shared.size() if self.shared is not None else None,
+            "shared_errors": self.shared.errors if self.shared is not None else None,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,156 @@
+"""
+codec.py
+============
+
+Binary request/response formats for high-volume scoring clients.
+
+Besides JSON, /predict/batch accepts and returns (chosen by the Content-Type and Accept headers):
+
+- application/x-numpy-records: a packed NumPy record buffer with the fixed layout of
+  record_dtype (float64 numerical fields, fixed-width ASCII categorical fields). It is read with
+  np.frombuffer, so every field is already a column without a Python object per student.
+- application/vnd.apache.arrow.stream: an Arrow IPC stream with one column per feature
+  (only when pyarrow is installed).
+
+Responses in either format carry academic_risk and probability columns; the model version is
+sent in the X-Model-Version header.
+"""
+
+
+# libraries
+import io
+from functools import lru_cache
+from importlib.util import find_spec
+
+import numpy as np
+
+
+JSON = "application/json"
+NUMPY_RECORDS = "application/x-numpy-records"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+# width of the categorical fields of a record; longer categories are rejected by the client's encoder
+CATEGORY_WIDTH = 32
+
+# layout of a binary response row
+RESPONSE_DTYPE = np.dtype([("academic_risk", "<i1"), ("probability", "<f8")])
+
+
+@lru_cache(maxsize=None)
+def binary_formats():
+    """
+    Binary content types available in this environment. pyarrow is only looked up here and
+    imported by the Arrow encoder and decoder, so importing the API does not load it.
+    """
+    return (NUMPY_RECORDS, ARROW_STREAM) if find_spec("pyarrow") is not None else (NUMPY_RECORDS,)
+
+
+def record_dtype(model_features, categorical_columns):
+    """
+    Fixed record layout of a binary request, fields in model_features order (little-endian, packed)
+    """
+    return np.dtype([
+        (col, f"S{CATEGORY_WIDTH}" if col in categorical_columns else "<f8")
+        for col in model_features
+    ])
+
+
+def media_type(header: str) -> str:
+    """
+    Media type of a Content-Type header, without parameters
+    """
+    return (header or JSON).split(";")[0].strip().lower()
+
+
+def negotiate(accept: str) -> str:
+    """
+    Response format for an Accept header: the first supported binary type listed, JSON otherwise
+    """
+    accepted = [media_type(value) for value in (accept or "").split(",")]
+    return next((value for value in accepted if value in binary_formats()), JSON)
+
+
+def check_finite_columns(columns: dict, categorical_columns) -> dict:
+    """
+    Reject NaN and infinite numerical fields (Arrow nulls decode to NaN), as the JSON schema does
+
+    :raises ValueError: On a non-finite numerical field
+    """
+    for col, values in columns.items():
+        if col not in categorical_columns and not np.isfinite(values).all():
+            raise ValueError(f"Numerical field '{col}' must hold finite numbers")
+    return columns
+
+
+def decode_columns(body: bytes, content_type: str, model_features, categorical_columns) -> dict:
+    """
+    Decode a binary request body into columns {feature: array}
+
+    :raises ValueError: On a malformed body, a missing feature or a null or non-finite value
+    """
+    if content_type == NUMPY_RECORDS:
+        dtype = record_dtype(model_features, categorical_columns)
+        if len(body) % dtype.itemsize:
+            raise ValueError(f"Body of {len(body)} bytes is not a whole number of {dtype.itemsize}-byte records")
+
+        records = np.frombuffer(body, dtype=dtype)
+        columns = {col: records[col] for col in model_features}
+
+        # decode the categorical fields here so non-ASCII bytes are a bad request, not a scoring error
+        for col in categorical_columns:
+            if col in columns:
+                try:
+                    columns[col] = columns[col].astype(str)
+                except UnicodeDecodeError:
+                    raise ValueError(f"Categorical field '{col}' is not ASCII")
+        return check_finite_columns(columns, categorical_columns)
+
+    if content_type == ARROW_STREAM and ARROW_STREAM in binary_formats():
+        import pyarrow as pa
+
+        try:
+            table = pa.ipc.open_stream(body).read_all()
+        except pa.ArrowInvalid as e:
+            raise ValueError(f"Invalid Arrow stream: {e}")
+
+        missing = [col for col in model_features if col not in table.column_names]
+        if missing:
+            raise ValueError(f"Missing features: {missing}")
+
+        nulls = [col for col in model_features if table.column(col).null_count]
+        if nulls:
+            raise ValueError(f"Null values in features: {nulls}")
+
+        try:
+            columns = {
+                col: table.column(col).to_numpy() if col in categorical_columns
+                else table.column(col).cast(pa.float64()).to_numpy()
+                for col in model_features
+            }
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            raise ValueError(f"Invalid Arrow column: {e}")
+        return check_finite_columns(columns, categorical_columns)
+
+    raise ValueError(f"Unsupported content type '{content_type}'. Supported: {[JSON, *binary_formats()]}")
+
+
+def encode_predictions(predictions, probabilities, content_type: str) -> bytes:
+    """
+    Encode batch predictions in a binary response format
+    """
+    if content_type == NUMPY_RECORDS:
+        records = np.empty(len(predictions), dtype=RESPONSE_DTYPE)
+        records["academic_risk"] = predictions
+        records["probability"] = probabilities
+        return records.tobytes()
+
+    import pyarrow as pa
+
+    table = pa.table({
+        "academic_risk": pa.array(np.asarray(predictions, dtype=np.int8)),
+        "probability": pa.array(np.asarray(probabilities, dtype=np.float64)),
+    })
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
@@ -0,0 +1,228 @@
+"""
+explain.py
+============
+
+Per-feature contributions (SHAP values) for the prediction API.
+
+- Linear models (the fused plan, LogisticRegression, SGDClassifier): the exact SHAP value of a
+  feature is its weight times the deviation from the background mean, in log-odds. It is one
+  vectorized subtraction and multiply for the whole batch.
+- Other models: interventional Shapley values over a small cached background sample. When
+  every coalition times every background row fits in the per-student budget of model
+  evaluations, they are enumerated exactly. Otherwise (more features or background rows) they
+  are estimated from a fixed set of sampled (permutation, background row) pairs, whose cost
+  grows linearly with the number of features. Either way all coalitions of a batch are scored
+  with one predict_proba call and combined with precomputed weights.
+"""
+
+
+# libraries
+import math
+from itertools import product
+
+import numpy as np
+
+from api.utils import LinearInferencePlan, predict_batch
+
+
+def linear_parameters(model):
+    """
+    Weight vector and bias of a binary linear model, in the space of its input features
+
+    :return: (weights, bias), or None if the model is not linear
+    """
+    if isinstance(model, LinearInferencePlan):
+        return model.weights, model.bias
+
+    coef = getattr(model, "coef_", None)
+    if coef is None or np.ndim(coef) != 2 or coef.shape[0] != 1:
+        return None
+    return np.asarray(coef, dtype=np.float64).ravel(), float(np.ravel(model.intercept_)[0])
+
+
+class LinearExplainer:
+    """
+    Exact SHAP values of a linear model: weights * (x - background mean), in log-odds
+    """
+
+    output = "log_odds"
+
+    def __init__(self, weights, bias, background):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.baseline = np.asarray(background, dtype=np.float64).mean(axis=0)
+        self.base_value = float(self.baseline @ self.weights + bias)
+
+    def explain(self, features_array):
+        """
+        :param features_array: The batch, prepared exactly like the scoring features
+        :return: Contributions with the same shape as the batch
+        """
+        return (features_array - self.baseline) * self.weights
+
+
+class ShapleyExplainer:
+    """
+    Interventional Shapley values of any model over a background sample, in probability.
+
+    A Shapley value is a weighted sum of the expected model output over coalitions, so both
+    variants are a (coalitions x features) weight matrix applied to the coalition values:
+    - exact: every coalition, each valued against every background row (2^features x background
+      model evaluations per student)
+    - sampled: n_samples random feature orderings, each paired with one background row. Along an
+      ordering the features are switched from the background row to the student one at a time,
+      and each switch credits the change of output to that feature ((features + 1) x n_samples
+      evaluations per student). The orderings are drawn once, so a student always gets the same
+      explanation.
+    """
+
+    output = "probability"
+
+    def __init__(self, model, background, max_evaluations=512, max_rows=200_000, random_state=42):
+        """
+        :param model: The scoring model
+        :param background: Background rows, prepared exactly like the scoring features
+        :param max_evaluations: Model evaluations per explained student; exact enumeration is used
+            only when it fits, otherwise the sampled estimate uses this many evaluations
+        :param max_rows: Upper bound on the rows scored in one predict call
+        :param random_state: Seed of the sampled orderings and background rows
+        """
+        self.model = model
+        self.background = np.asarray(background, dtype=np.float64)
+        self.max_rows = max_rows
+
+        n_features = self.background.shape[1]
+        n_background = len(self.background)
+
+        self.exact = 2 ** n_features * n_background <= max_evaluations
+        if self.exact:
+            self.masks, self.coalition_weights = self.exact_coalitions(n_features)
+            # every coalition against every background row
+            self.coalition_background = self.background[None, :, :]
+        else:
+            n_samples = max(1, max_evaluations // (n_features + 1))
+            rng = np.random.default_rng(random_state)
+            self.masks, self.coalition_weights = self.sampled_coalitions(n_features, n_samples, rng)
+            # one background row per ordering, shared by its n_features + 1 coalitions
+            rows = rng.integers(0, n_background, size=n_samples)
+            self.coalition_background = np.repeat(self.background[rows], n_features + 1, axis=0)[:, None, :]
+
+        _, probabilities = predict_batch(self.model, self.background)
+        self.base_value = float(np.mean(probabilities))
+
+    @staticmethod
+    def exact_coalitions(n_features):
+        """
+        Every coalition as a boolean mask over the features, and the Shapley weights
+        phi_j = sum_S w(|S|) * (v(S + j) - v(S)) written as one (coalitions x features) matrix
+        """
+        masks = np.array(list(product([False, True], repeat=n_features)))
+
+        sizes = masks.sum(axis=1)
+        weight = np.array([
+            math.factorial(k) * math.factorial(n_features - k - 1) / math.factorial(n_features)
+            for k in range(n_features)
+        ])
+        weights = np.where(
+            masks,
+            weight[np.clip(sizes[:, None] - 1, 0, n_features - 1)],
+            -weight[np.clip(sizes[:, None], 0, n_features - 1)]
+        )
+        return masks, weights
+
+    @staticmethod
+    def sampled_coalitions(n_features, n_samples, rng):
+        """
+        The n_features + 1 nested coalitions along each sampled ordering, and the weights that
+        average the output change of every switch into the switched feature
+        """
+        masks = np.zeros((n_samples, n_features + 1, n_features), dtype=bool)
+        weights = np.zeros((n_samples, n_features + 1, n_features))
+
+        for s in range(n_samples):
+            order = rng.permutation(n_features)
+            for k, j in enumerate(order):
+                masks[s, k + 1:, j] = True
+                weights[s, k + 1, j] += 1.0 / n_samples
+                weights[s, k, j] -= 1.0 / n_samples
+
+        return masks.reshape(-1, n_features), weights.reshape(-1, n_features)
+
+    def coalition_values(self, features_array):
+        """
+        Expected model output for every student and coalition: features in the coalition come
+        from the student, the others from the coalition's background rows
+        """
+        n_students, n_features = features_array.shape
+        n_coalitions, n_background = len(self.masks), self.coalition_background.shape[1]
+
+        values = np.empty((n_students, n_coalitions))
+        step = max(1, self.max_rows // (n_coalitions * n_background))
+
+        for start in range(0, n_students, step):
+            batch = features_array[start:start + step]
+            rows = np.where(
+                self.masks[None, :, None, :],
+                batch[:, None, None, :],
+                self.coalition_background[None, :, :, :]
+            ).reshape(-1, n_features)
+
+            _, probabilities = predict_batch(self.model, rows)
+            values[start:start + step] = probabilities.reshape(len(batch), n_coalitions, n_background).mean(axis=2)
+
+        return values
+
+    def explain(self, features_array):
+        return self.coalition_values(features_array) @ self.coalition_weights
+
+
+def build_explainer(model, background, max_background=20, max_evaluations=512, random_state=42):
+    """
+    Build the explainer of a scoring model
+
+    :param model: The scoring model (fused plan or sklearn estimator)
+    :param background: Background rows, prepared exactly like the scoring features
+    :param max_background: Background rows kept for non-linear models
+    :param max_evaluations: Model evaluations per explained student for non-linear models
+        (see ShapleyExplainer)
+    :return: LinearExplainer or ShapleyExplainer
+    """
+    parameters = linear_parameters(model)
+    if parameters is not None:
+        return LinearExplainer(*parameters, background)
+
+    if len(background) > max_background:
+        rows = np.random.default_rng(random_state).choice(len(background), max_background, replace=False)
+        background = background[np.sort(rows)]
+    return ShapleyExplainer(model, background, max_evaluations=max_evaluations, random_state=random_state)
+
+
+def top_risk_factors(contributions, feature_names, k=3):
+    """
+    Names of the features pushing each student's risk up the most (positive contributions only)
+
+    :param contributions: (students x features) contributions
+    :return: One list of at most k feature names per student
+    """
+    order = np.argsort(-contributions, axis=1)[:, :k]
+    return [
+        [feature_names[j] for j in row if contributions[i, j] > 0]
+        for i, row in enumerate(order)
+    ]
+
+
+def explain_batch(explainer, features_array, feature_names, k=3):
+    """
+    Explanations of a batch, one dict per student (see api.schema.Explanation)
+    """
+    contributions = explainer.explain(features_array)
+    factors = top_risk_factors(contributions, feature_names, k)
+
+    return [
+        {
+            "output": explainer.output,
+            "base_value": explainer.base_value,
+            "contributions": dict(zip(feature_names, row.tolist())),
+            "top_risk_factors": risk_factors,
+        }
+        for row, risk_factors in zip(contributions, factors)
+    ]
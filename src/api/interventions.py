@@ -0,0 +1,181 @@
+"""
+interventions.py
+================
+
+What-if simulator for targeted interventions.
+
+A scenario is a list of feature perturbations (e.g. AttendanceRate +0.05, StudyHours +1,
+SchoolType = Private) applied to every student of a cohort. Perturbations are given in raw
+units and mapped into the model input space with the fitted scaler statistics and encoder
+vocabularies, then every scenario of a request is stacked into one matrix and rescored with
+a single vectorized predict call.
+"""
+
+
+# libraries
+import numpy as np
+
+from api.analytics import Population
+from api.utils import predict_batch
+
+
+OPERATIONS = ("add", "set")
+
+
+class InterventionSimulator:
+    def __init__(self, population: Population, max_rows: int = 2_000_000):
+        """
+        Initialize the simulator
+
+        :param population: The scored population (its bundle provides the scaler and vocabularies)
+        :param max_rows: Upper bound on the rows scored in one predict call
+        """
+        self.population = population
+        self.max_rows = max_rows
+
+        bundle = population.bundle
+        positions = {col: i for i, col in enumerate(population.feature_names)}
+
+        # raw value = scaled value * scale + mean, for the scaled model features
+        self.numeric = {}
+        numerical_columns = list(bundle.metadata["numerical_columns"])
+        for j, col in enumerate(numerical_columns):
+            if col in positions:
+                mean = bundle.scaler.mean_[j] if bundle.scaler.with_mean else 0.0
+                scale = bundle.scaler.scale_[j] if bundle.scaler.with_std else 1.0
+                self.numeric[col] = (positions[col], float(mean), float(scale))
+
+        self.categorical = {
+            col: (positions[col], {str(value): code for code, value in enumerate(bundle.vocabularies[col])})
+            for col in bundle.metadata["categorical_columns"] if col in positions
+        }
+
+    @staticmethod
+    def finite(col, name, value) -> float:
+        """
+        A numeric perturbation field as a finite float
+
+        :raises ValueError: If it is not a number, or is NaN or infinite
+        """
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"The {name} of {col} must be a number, got '{value}'")
+        if not np.isfinite(value):
+            raise ValueError(f"The {name} of {col} must be a finite number, got {value}")
+        return value
+
+    def apply(self, features, perturbations):
+        """
+        Apply one scenario's perturbations to a copy of the cohort's model inputs
+
+        :param features: (students x features) model inputs of the cohort
+        :param perturbations: Dicts with feature, op ('add' or 'set'), value and optional min/max
+            bounds in raw units
+        :return: The perturbed inputs and the perturbed features the model does not use
+        :raises ValueError: On an unknown feature, operation or category, a NaN or infinite
+            numeric value or bound, or a min bound above the max bound
+        """
+        features = features.copy()
+        ignored = []
+
+        for perturbation in perturbations:
+            col, op, value = perturbation["feature"], perturbation.get("op", "add"), perturbation["value"]
+
+            if op not in OPERATIONS:
+                raise ValueError(f"Unknown operation '{op}' for {col}. Expected one of {OPERATIONS}")
+
+            if col in self.numeric:
+                value = self.finite(col, "value", value)
+                low, high = perturbation.get("min"), perturbation.get("max")
+                low = None if low is None else self.finite(col, "min", low)
+                high = None if high is None else self.finite(col, "max", high)
+                if low is not None and high is not None and low > high:
+                    raise ValueError(f"Bounds of {col} are inverted: min {low} is above max {high}")
+
+                position, mean, scale = self.numeric[col]
+                raw = features[:, position] * scale + mean
+                raw = raw + value if op == "add" else np.full_like(raw, value)
+                if low is not None or high is not None:
+                    raw = np.clip(raw, low, high)
+                features[:, position] = (raw - mean) / scale
+
+            elif col in self.categorical:
+                position, lookup = self.categorical[col]
+                if op != "set":
+                    raise ValueError(f"Categorical feature {col} only supports the 'set' operation")
+                if str(value) not in lookup:
+                    raise ValueError(f"Unknown category '{value}' for {col}. Available: {list(lookup)}")
+                features[:, position] = lookup[str(value)]
+
+            elif col in self.population.codes or col in self.population.bundle.metadata["numerical_columns"]:
+                # a valid column that the model does not use cannot change its predictions
+                ignored.append(col)
+
+            else:
+                raise ValueError(f"Unknown feature '{col}'")
+
+        return features, ignored
+
+    def simulate(self, scenarios, filters: dict = None) -> dict:
+        """
+        Rescore the cohort under every scenario
+
+        :param scenarios: Dicts with a name and a list of perturbations
+        :param filters: Cohort filter {column: categories}, the whole population if empty
+        :return: Baseline and per-scenario predicted risk rate and mean probability, with the
+            change from the baseline and the number of students moving in or out of risk
+        :rtype: dict
+        """
+        population = self.population
+        selected = population.mask(filters)
+
+        base_features = population.features[selected]
+        base_predictions = population.predictions[selected] == 1
+        base_probabilities = population.probabilities[selected]
+        n_students = len(base_features)
+
+        perturbed, ignored = [], []
+        for scenario in scenarios:
+            features, ignored_features = self.apply(base_features, scenario["perturbations"])
+            perturbed.append(features)
+            ignored.append(ignored_features)
+
+        # every scenario stacked into one matrix, scored in as few predict calls as max_rows allows
+        predictions = np.empty((len(scenarios), n_students), dtype=bool)
+        probabilities = np.empty((len(scenarios), n_students))
+
+        if n_students and scenarios:
+            step = max(1, self.max_rows // n_students)
+            for start in range(0, len(scenarios), step):
+                stacked = np.concatenate(perturbed[start:start + step])
+                labels, scores = predict_batch(population.bundle.model, stacked)
+                count = len(perturbed[start:start + step])
+                predictions[start:start + count] = (np.asarray(labels) == 1).reshape(count, n_students)
+                probabilities[start:start + count] = np.asarray(scores).reshape(count, n_students)
+
+        baseline_rate = float(base_predictions.mean()) if n_students else 0.0
+        baseline_probability = float(base_probabilities.mean()) if n_students else 0.0
+
+        results = []
+        for i, scenario in enumerate(scenarios):
+            rate = float(predictions[i].mean()) if n_students else 0.0
+            probability = float(probabilities[i].mean()) if n_students else 0.0
+            results.append({
+                "name": scenario["name"],
+                "predicted_risk_rate": rate,
+                "risk_rate_change": rate - baseline_rate,
+                "mean_probability": probability,
+                "mean_probability_change": probability - baseline_probability,
+                "students_out_of_risk": int(np.count_nonzero(base_predictions & ~predictions[i])),
+                "students_into_risk": int(np.count_nonzero(~base_predictions & predictions[i])),
+                "ignored_features": ignored[i],
+            })
+
+        return {
+            "model_version": population.version,
+            "count": n_students,
+            "baseline_risk_rate": baseline_rate,
+            "baseline_mean_probability": baseline_probability,
+            "scenarios": results,
+        }
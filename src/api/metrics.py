@@ -0,0 +1,101 @@
+"""
+metrics.py
+============
+
+Request metrics and on-demand profiling for the prediction API.
+
+MetricsMiddleware is a plain ASGI middleware (no per-request task or body buffering). It counts
+requests by route and status, records their latency, and stamps the arrival time into the
+request state, so handlers can time the parse phase. When profiling is enabled, requests sent
+with an `X-Profile: 1` header (and a random sample of the others) run under a StackSampler that
+only samples the threads working for the request: the event loop thread and the worker threads
+that enter a span on its behalf. Coroutines of other requests interleaved on the event loop can
+still appear. The folded stacks are saved to the profile directory (off the event loop), and the
+file is named in the X-Profile-Path response header. Server errors, and a sample of the other requests
+(RISK_LOG_REQUEST_SAMPLE_RATE), are logged by the request logger.
+"""
+
+
+# libraries
+import logging
+import random
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from instrumentation import PROFILE_DIR, StackSampler, metrics, profiled_threads
+from logger import REQUEST_SAMPLE_RATE, request_logger
+
+
+http_requests = metrics.counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status")
+)
+http_request_duration = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route")
+)
+
+
+class MetricsMiddleware:
+    def __init__(self, app, profiling: bool = False, sample_rate: float = 0.0, interval: float = 0.001):
+        """
+        :param app: The ASGI app
+        :param profiling: Allow profiling requests (X-Profile header or sampling)
+        :param sample_rate: Fraction of requests profiled without the header
+        :param interval: Seconds between stack samples of a profiled request
+        """
+        self.app = app
+        self.profiling = profiling
+        self.sample_rate = sample_rate
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        scope.setdefault("state", {})["received"] = started
+        status = 500
+
+        sampler = token = None
+        if self.profiling and ((b"x-profile", b"1") in scope["headers"] or random.random() < self.sample_rate):
+            sampler = StackSampler(self.interval, thread_ids={threading.get_ident()}).start()
+            token = profiled_threads.set(sampler.thread_ids)
+            profile_path = PROFILE_DIR / f"request-{time.strftime('%Y%m%d-%H%M%S')}-{random.getrandbits(32):08x}.folded"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if sampler is not None:
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-path", str(profile_path).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            duration = time.perf_counter() - started
+            http_requests.inc(scope["method"], route, status)
+            http_request_duration.observe(duration, scope["method"], route)
+
+            # server errors are always logged, other requests only when sampling is on. The fields are
+            # in the message for the text format and also passed as extra for the JSON format
+            if status >= 500 or REQUEST_SAMPLE_RATE > 0:
+                duration_ms = round(duration * 1000, 3)
+                request_logger.log(
+                    logging.WARNING if status >= 500 else logging.INFO, "request %s %s %s %.3f ms",
+                    scope["method"], route, status, duration_ms,
+                    extra={"method": scope["method"], "route": route, "status": status, "duration_ms": duration_ms}
+                )
+
+            if sampler is not None:
+                sampler.stop()
+                profiled_threads.reset(token)
+                await run_in_threadpool(save_profile, profile_path, sampler.folded())
+
+
+def save_profile(path, folded: str):
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    path.write_text(folded)
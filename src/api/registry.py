@@ -0,0 +1,303 @@
+"""
+registry.py
+============
+
+Versioned artifact registry for the prediction API.
+
+The model, scaler, label encoders and feature metadata are loaded together as one immutable
+bundle. Request handlers take a reference to the active bundle once, so a background reload can
+swap in a new version atomically without affecting requests that are already in flight.
+By default the bundle is served from the memory-mapped artifact store (see artifact_store.py),
+so every worker on a host shares one copy of the arrays.
+"""
+
+
+# libraries
+import hashlib
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import joblib
+
+from logger import logger
+from api.artifact_store import open_store
+from api.utils import (
+    MODEL_PATH, SCALER_PATH, ENCODERS_PATH, METADATA_PATH, INFERENCE_PLAN_PATH, BACKGROUND_PATH, ARRAY_STORE_DIR,
+    compile_encoders, load_inference_plan, verify_inference_plan,
+    prepare_features_batch, predict_batch
+)
+from api.explain import build_explainer
+
+
+@dataclass
+class ArtifactBundle:
+    version: str
+    model: object
+    scaler: object
+    encoders: dict
+    metadata: dict
+    # category names by code of every encoded column, not only the model features
+    vocabularies: dict = field(default_factory=dict)
+    plan: object = None
+    explainer: object = None
+    # class name of the trained model (the served model may be its array-backed equivalent)
+    model_type: str = None
+    memory_mapped: bool = False
+    loaded_at: float = field(default_factory=time.time)
+
+    @property
+    def scoring_model(self):
+        # the fused plan works on raw numeric values, so no separate scaling step is needed
+        return self.plan if self.plan is not None else self.model
+
+    @property
+    def scoring_scaler(self):
+        return None if self.plan is not None else self.scaler
+
+
+class ArtifactRegistry:
+    def __init__(self, model_features, categorical_columns, numerical_columns,
+                 use_inference_plan=True, verify_inference_plan=False, paths=None,
+                 background_path=BACKGROUND_PATH, explain_background=20, explain_evaluations=512,
+                 store_dir=ARRAY_STORE_DIR):
+        """
+        Initialize the registry (nothing is loaded until the first get() or refresh())
+
+        :param paths: Mapping with model, scaler, encoders and metadata artifact paths
+        :param store_dir: Root of the memory-mapped artifact store (None unpickles the artifacts
+            in every worker instead)
+        :param background_path: Optional background sample for explanations (written by the
+            data transformation stage); explanations are unavailable without it
+        :param explain_background: Background rows used to explain non-linear models
+        :param explain_evaluations: Model evaluations per student explained for non-linear models
+        """
+        self.model_features = list(model_features)
+        self.categorical_columns = list(categorical_columns)
+        self.numerical_columns = list(numerical_columns)
+        self.use_inference_plan = use_inference_plan
+        self.verify_inference_plan = verify_inference_plan
+        self.background_path = Path(background_path) if background_path else None
+        self.explain_background = explain_background
+        self.explain_evaluations = explain_evaluations
+        self.store_dir = Path(store_dir) if store_dir else None
+
+        self.paths = paths or {
+            "model": MODEL_PATH,
+            "scaler": SCALER_PATH,
+            "encoders": ENCODERS_PATH,
+            "metadata": METADATA_PATH,
+        }
+
+        self._bundle = None
+        self._signature = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        self._listeners = []
+
+    # ------------------ Versioning ------------------ #
+    def _file_signature(self):
+        """
+        Cheap change detector: size and modification time of every artifact
+        """
+        signature = []
+        for name, path in sorted(self.paths.items()):
+            stat = Path(path).stat()
+            signature.append((name, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def _content_version(self):
+        """
+        Version identifier: short content hash over all artifacts of the bundle
+        """
+        digest = hashlib.sha256()
+        for _, path in sorted(self.paths.items()):
+            with open(path, "rb") as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()[:12]
+
+    # ------------------ Loading ------------------ #
+    def load(self) -> ArtifactBundle:
+        """
+        Load all artifacts as one bundle and warm it up. The files are re-checked after loading
+        so a bundle is never assembled from a half-written set of artifacts.
+
+        :raises RuntimeError: If the artifacts changed while they were being loaded
+        """
+        signature = self._file_signature()
+        version = self._content_version()
+
+        if self.store_dir is not None:
+            # the store serves array-backed objects, so it checks the plan against the sklearn model itself
+            artifacts = open_store(self.store_dir, version, self.paths, self.model_features, self.numerical_columns,
+                                   unchanged=lambda: self._file_signature() == signature,
+                                   verify=self.use_inference_plan and self.verify_inference_plan)
+        else:
+            artifacts = self.load_pickled()
+
+        if self._file_signature() != signature:
+            raise RuntimeError("Artifacts changed while loading, retrying on the next poll")
+
+        encoders = {col: artifacts["encoders"][col] for col in self.categorical_columns}
+        model, scaler = artifacts["model"], artifacts["scaler"]
+
+        plan = artifacts["plan"] if self.use_inference_plan else None
+        if plan is not None and self.verify_inference_plan and self.store_dir is None:
+            verify_inference_plan(plan, model, scaler, encoders, self.model_features, self.numerical_columns)
+
+        bundle = ArtifactBundle(version=version, model=model, scaler=scaler, encoders=encoders,
+                                metadata=artifacts["metadata"], vocabularies=artifacts["vocabularies"], plan=plan,
+                                model_type=artifacts["model_type"], memory_mapped=artifacts["memory_mapped"])
+        bundle.explainer = self.load_explainer(bundle)
+        self.warm_up(bundle)
+
+        self._signature = signature
+        return bundle
+
+    def load_pickled(self) -> dict:
+        """
+        Unpickle the joblib artifacts (a private copy per worker process)
+
+        :return: The serving objects, as returned by artifact_store.open_store
+        :rtype: dict
+        """
+        model = joblib.load(self.paths["model"])
+        scaler = joblib.load(self.paths["scaler"])
+        all_encoders = joblib.load(self.paths["encoders"])
+        metadata = joblib.load(self.paths["metadata"])
+
+        plan = None
+        if self.use_inference_plan:
+            plan = load_inference_plan(
+                model, scaler, self.model_features, self.numerical_columns,
+                path=Path(self.paths["model"]).parent / INFERENCE_PLAN_PATH.name,
+                sources=(self.paths["model"], self.paths["scaler"])
+            )
+
+        return {
+            "model": model, "plan": plan, "scaler": scaler, "encoders": compile_encoders(all_encoders),
+            "vocabularies": {col: encoder.classes_ for col, encoder in all_encoders.items()},
+            "metadata": metadata, "model_type": type(model).__name__, "memory_mapped": False,
+        }
+
+    def load_explainer(self, bundle: ArtifactBundle):
+        """
+        Build the explainer from the background sample, prepared exactly like request features
+
+        :return: The explainer, or None if no background sample is available
+        """
+        if self.background_path is None or not self.background_path.exists():
+            logger.info("No background sample found, explanations are disabled")
+            return None
+
+        background = joblib.load(self.background_path)
+        features_array = prepare_features_batch(
+            {col: background[col].tolist() for col in self.model_features},
+            self.model_features, self.categorical_columns, self.numerical_columns,
+            bundle.encoders, bundle.scoring_scaler
+        )
+        return build_explainer(bundle.scoring_model, features_array, max_background=self.explain_background,
+                               max_evaluations=self.explain_evaluations)
+
+    def warm_up(self, bundle: ArtifactBundle):
+        """
+        Score one synthetic row so the first real request does not pay one-off initialisation costs
+        """
+        columns = {col: [0.0] for col in self.numerical_columns}
+        columns.update({col: [bundle.encoders[col].classes_[0]] for col in self.categorical_columns})
+
+        features_array = prepare_features_batch(
+            columns, self.model_features, self.categorical_columns, self.numerical_columns,
+            bundle.encoders, bundle.scoring_scaler
+        )
+        predict_batch(bundle.scoring_model, features_array)
+
+    def get(self) -> ArtifactBundle:
+        """
+        Return the active bundle, loading it on first use
+        """
+        bundle = self._bundle
+        if bundle is None:
+            with self._lock:
+                if self._bundle is None:
+                    self._activate(self.load())
+                bundle = self._bundle
+        return bundle
+
+    def _activate(self, bundle: ArtifactBundle):
+        previous = self._bundle
+        self._bundle = bundle
+        logger.info(f"Serving model version {bundle.version}")
+
+        for listener in self._listeners:
+            listener(previous, bundle)
+
+    def on_swap(self, listener):
+        """
+        Register a callback(previous_bundle, new_bundle) invoked after every version swap
+        """
+        self._listeners.append(listener)
+
+    # ------------------ Hot reload ------------------ #
+    def refresh(self) -> bool:
+        """
+        Load and swap in a new bundle if the artifact files changed
+
+        :return: True if a new version was activated
+        :rtype: bool
+        """
+        try:
+            if self._bundle is not None and self._file_signature() == self._signature:
+                return False
+
+            with self._lock:
+                bundle = self.load()
+                if self._bundle is not None and bundle.version == self._bundle.version:
+                    return False
+                self._activate(bundle)
+                return True
+
+        except Exception as e:
+            # keep serving the current version
+            logger.exception(f"Artifact reload failed: {e}")
+            return False
+
+    def start_watching(self, interval: float = 30.0):
+        """
+        Poll the artifact files in a background thread and hot-swap new versions
+        """
+        if self._watcher is not None:
+            return
+
+        self._stop.clear()
+
+        def watch():
+            while not self._stop.wait(interval):
+                self.refresh()
+
+        self._watcher = threading.Thread(target=watch, name="artifact-registry-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def info(self) -> dict:
+        bundle = self._bundle
+        if bundle is None:
+            return {"loaded": False}
+
+        return {
+            "loaded": True,
+            "model_version": bundle.version,
+            "model_type": bundle.model_type or type(bundle.model).__name__,
+            "fused_inference_plan": bundle.plan is not None,
+            "memory_mapped": bundle.memory_mapped,
+            "explanations": bundle.explainer is not None,
+            "loaded_at": bundle.loaded_at,
+        }
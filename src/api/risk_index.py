@@ -0,0 +1,292 @@
+"""
+risk_index.py
+=============
+
+Precomputed risk-score index for top-N and threshold queries.
+
+The whole population is scored once per model version and stored sorted by predicted
+probability, globally and per segment (Grade, SchoolType, Locale and combinations of them).
+Within a segment index the students of one segment value are a contiguous, descending run,
+so a top-N page is a slice and a threshold query is a binary search. The index is persisted
+with the model version it was built with and rebuilt when the version changes.
+
+Usage (rebuild the persisted index for the current artifacts):
+    python -m api.risk_index
+"""
+
+
+# libraries
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from logger import logger
+from api.utils import RISK_INDEX_PATH
+
+
+# segments with a precomputed index; other filter combinations fall back to a scan of the global order
+DEFAULT_SEGMENTS = (
+    ("Grade",),
+    ("SchoolType",),
+    ("Locale",),
+    ("Grade", "SchoolType"),
+    ("Grade", "Locale"),
+)
+
+
+class RiskIndex:
+    def __init__(self, version, probabilities, predictions, split_names, splits, rows, codes, vocabularies,
+                 segments, order=None, segment_orders=None, segment_offsets=None):
+        """
+        Initialize the index (sorted orders are computed unless given, e.g. when loading)
+
+        :param version: The model version the probabilities come from
+        :param probabilities: Predicted risk probability per student
+        :param predictions: Predicted label per student
+        :param split_names: Splits the students were loaded from
+        :param splits: Index into split_names per student
+        :param rows: Row number of each student within its split
+        :param codes: Encoded segment columns {column: codes}
+        :param vocabularies: Category names per segment column, indexed by code
+        :param segments: Column tuples to index
+        """
+        self.version = version
+        self.probabilities = probabilities
+        self.predictions = predictions
+        self.split_names = list(split_names)
+        self.splits = splits
+        self.rows = rows
+        self.codes = codes
+        self.vocabularies = vocabularies
+        self.segments = [tuple(segment) for segment in segments]
+
+        self.order = order if order is not None else np.argsort(-probabilities, kind="stable")
+        self.segment_orders = segment_orders or {}
+        self.segment_offsets = segment_offsets or {}
+
+        for segment in self.segments:
+            if segment not in self.segment_orders:
+                keys, dims = self.segment_keys(segment, self.codes)
+                # grouped by segment value, each group by descending probability
+                self.segment_orders[segment] = np.lexsort((-probabilities, keys))
+                counts = np.bincount(keys, minlength=int(np.prod(dims)))
+                self.segment_offsets[segment] = np.concatenate([[0], np.cumsum(counts)])
+
+    def __len__(self):
+        return len(self.probabilities)
+
+    def segment_keys(self, segment, codes):
+        """
+        One integer key per student combining the segment codes (slot 0 holds unseen categories)
+        """
+        dims = [len(self.vocabularies[col]) + 1 for col in segment]
+        keys = np.zeros(len(next(iter(codes.values()))), dtype=np.int64)
+        for col, size in zip(segment, dims):
+            keys = keys * size + (np.asarray(codes[col], dtype=np.int64) + 1)
+        return keys, dims
+
+    # ------------------ Building ------------------ #
+    @classmethod
+    def build(cls, population, segments=DEFAULT_SEGMENTS):
+        """
+        Build the index from a scored population
+
+        :param population: api.analytics.Population
+        :param segments: Column tuples to index (columns missing from the data are skipped)
+        """
+        segments = [tuple(segment) for segment in segments if all(col in population.codes for col in segment)]
+        columns = sorted({col for segment in segments for col in segment})
+
+        index = cls(
+            version=population.version,
+            probabilities=population.probabilities,
+            predictions=np.asarray(population.predictions),
+            split_names=population.split_names,
+            splits=population.splits,
+            rows=population.rows,
+            codes={col: population.codes[col] for col in columns},
+            vocabularies={col: np.asarray(population.vocabularies[col]).astype(str) for col in columns},
+            segments=segments,
+        )
+
+        logger.info(f"Risk index of {len(index)} students built for model version {index.version} "
+                    f"with segments {index.segments}")
+        return index
+
+    def save(self, path: Path = RISK_INDEX_PATH):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        arrays = {
+            "meta": np.array(json.dumps({
+                "version": self.version,
+                "split_names": self.split_names,
+                "columns": list(self.codes),
+                "segments": [list(segment) for segment in self.segments],
+            })),
+            "probabilities": self.probabilities,
+            "predictions": self.predictions,
+            "splits": self.splits,
+            "rows": self.rows,
+            "order": self.order,
+        }
+        for col in self.codes:
+            arrays[f"codes/{col}"] = self.codes[col]
+            arrays[f"vocabulary/{col}"] = self.vocabularies[col]
+        for i, segment in enumerate(self.segments):
+            arrays[f"segment/{i}/order"] = self.segment_orders[segment]
+            arrays[f"segment/{i}/offsets"] = self.segment_offsets[segment]
+
+        # written next to the target and renamed, so readers never see a partial file
+        tmp_path = path.with_name(path.name + ".tmp.npz")
+        np.savez(tmp_path, **arrays)
+        tmp_path.replace(path)
+
+        logger.info(f"Risk index saved - {path}")
+
+    @classmethod
+    def load(cls, path: Path = RISK_INDEX_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            segments = [tuple(segment) for segment in meta["segments"]]
+
+            return cls(
+                version=meta["version"],
+                probabilities=data["probabilities"],
+                predictions=data["predictions"],
+                split_names=meta["split_names"],
+                splits=data["splits"],
+                rows=data["rows"],
+                codes={col: data[f"codes/{col}"] for col in meta["columns"]},
+                vocabularies={col: data[f"vocabulary/{col}"] for col in meta["columns"]},
+                segments=segments,
+                order=data["order"],
+                segment_orders={segment: data[f"segment/{i}/order"] for i, segment in enumerate(segments)},
+                segment_offsets={segment: data[f"segment/{i}/offsets"] for i, segment in enumerate(segments)},
+            )
+
+    # ------------------ Queries ------------------ #
+    def candidates(self, filters: dict = None) -> np.ndarray:
+        """
+        Students matching the filters, by descending probability
+
+        :param filters: {column: category or list of categories}
+        :raises ValueError: On an unknown column or category
+        """
+        filters = {col: values if isinstance(values, (list, tuple)) else [values] for col, values in (filters or {}).items()}
+        if not filters:
+            return self.order
+
+        lookups = {}
+        for col, values in filters.items():
+            if col not in self.codes:
+                raise ValueError(f"Column '{col}' is not indexed. Indexed columns: {list(self.codes)}")
+            lookup = {str(value): code for code, value in enumerate(self.vocabularies[col])}
+            unknown = [value for value in values if str(value) not in lookup]
+            if unknown:
+                raise ValueError(f"Unknown categories {unknown} for '{col}'. Available: {list(lookup)}")
+            lookups[col] = [lookup[str(value)] for value in values]
+
+        # one value per column of an indexed segment: the matching students are one contiguous run
+        segment = next((segment for segment in self.segments if set(segment) == set(filters)), None)
+        if segment is not None and all(len(lookups[col]) == 1 for col in segment):
+            key, _ = self.segment_keys(segment, {col: np.array(lookups[col]) for col in segment})
+            offsets = self.segment_offsets[segment]
+            return self.segment_orders[segment][offsets[key[0]]:offsets[key[0] + 1]]
+
+        # otherwise scan the global order, which keeps it sorted
+        selected = np.ones(len(self), dtype=bool)
+        for col, codes in lookups.items():
+            selected &= np.isin(self.codes[col], codes)
+        return self.order[selected[self.order]]
+
+    def query(self, filters: dict = None, limit: int = 200, offset: int = 0, min_probability: float = None) -> dict:
+        """
+        One page of the highest-risk students matching the filters
+
+        :param filters: {column: category or list of categories}
+        :param limit: Page size
+        :param offset: Number of students to skip
+        :param min_probability: Only students at or above this predicted probability
+        :return: The total number of matching students and the requested page
+        :rtype: dict
+        """
+        candidates = self.candidates(filters)
+        total = len(candidates)
+
+        if min_probability is not None:
+            # probabilities along the candidates are descending, so the matches are a prefix
+            total = int(np.searchsorted(-self.probabilities[candidates], -min_probability, side="right"))
+
+        page = candidates[offset:max(offset, min(offset + limit, total))]
+
+        students = [
+            {
+                "split": self.split_names[self.splits[i]],
+                "row": int(self.rows[i]),
+                "probability": float(self.probabilities[i]),
+                "academic_risk": int(self.predictions[i]),
+                "segments": {col: str(self.vocabularies[col][self.codes[col][i]]) if self.codes[col][i] >= 0 else "unknown"
+                             for col in self.codes},
+            }
+            for i in page
+        ]
+
+        return {
+            "model_version": self.version,
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "students": students,
+        }
+
+
+class RiskIndexStore:
+    """
+    Holds the risk index of the active model version, loading the persisted index when its
+    version matches and rebuilding (and persisting) it otherwise
+    """
+
+    def __init__(self, population_store, path: Path = RISK_INDEX_PATH, segments=DEFAULT_SEGMENTS):
+        self.population_store = population_store
+        self.path = Path(path)
+        self.segments = [tuple(segment) for segment in segments]
+
+        self._index = None
+        self._lock = threading.Lock()
+
+    def get(self) -> RiskIndex:
+        version = self.population_store.registry.get().version
+        index = self._index
+        if index is not None and index.version == version:
+            return index
+
+        with self._lock:
+            if self._index is None or self._index.version != version:
+                self._index = self.load_or_build(version)
+            return self._index
+
+    def load_or_build(self, version: str) -> RiskIndex:
+        if self.path.exists():
+            try:
+                index = RiskIndex.load(self.path)
+                if index.version == version:
+                    logger.info(f"Risk index loaded for model version {version}")
+                    return index
+            except Exception as e:
+                logger.warning(f"Could not load the risk index, rebuilding it: {e}")
+
+        return self.rebuild()
+
+    def rebuild(self) -> RiskIndex:
+        index = RiskIndex.build(self.population_store.population(), self.segments)
+        index.save(self.path)
+        return index
+
+
+if __name__ == "__main__":
+    from api.app import risk_index_store
+
+    risk_index_store.rebuild()
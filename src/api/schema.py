@@ -1,11 +1,14 @@
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, ConfigDict
+from typing import Dict, List, Optional, Union
 
 
 class StudentFeatures(BaseModel):
     """
-    Input schema for academic risk prediction
+    Input schema for academic risk prediction (NaN and infinite numbers are rejected, since
+    neither the fused plan nor the scaler can score them)
     """
+    model_config = ConfigDict(allow_inf_nan=False)
+
     GPA: float
     AttendanceRate: float
     TestScore_Math: float
@@ -16,9 +19,163 @@ class StudentFeatures(BaseModel):
 
 
 
+class Explanation(BaseModel):
+    """
+    Per-feature contributions to one prediction, relative to the background baseline
+    (in log-odds for linear models, in probability otherwise)
+    """
+    output: str
+    base_value: float
+    contributions: Dict[str, float]
+    top_risk_factors: List[str]
+
+
 class PredictionResponse(BaseModel):
     """
     Output schema for prediction response
     """
     academic_risk: int
     probability: float
+    model_version: str
+    explanation: Optional[Explanation] = None
+
+
+class BatchPredictionRequest(BaseModel):
+    """
+    Input schema for batch academic risk prediction
+    """
+    students: List[StudentFeatures]
+
+
+class BatchPredictionResponse(BaseModel):
+    """
+    Output schema for batch prediction response (columnar, one entry per student)
+    """
+    academic_risk: List[int]
+    probability: List[float]
+    model_version: str
+    explanations: Optional[List[Explanation]] = None
+
+
+class CohortQuery(BaseModel):
+    """
+    Input schema for cohort analytics, e.g. {"group_by": ["Race", "SES_Quartile"]}
+    """
+    group_by: List[str]
+    filters: Dict[str, List[str]] = {}
+    confidence: float = 0.95
+    min_count: int = 1
+
+
+class CohortStatistics(BaseModel):
+    """
+    Risk statistics of one cohort, with confidence intervals
+    """
+    cohort: Dict[str, str]
+    count: int
+    risk_rate: float
+    risk_rate_ci: List[float]
+    predicted_risk_rate: float
+    predicted_risk_rate_ci: List[float]
+    mean_probability: float
+    mean_probability_ci: List[float]
+
+
+class CohortResponse(BaseModel):
+    """
+    Output schema for cohort analytics (overall statistics and one entry per non-empty cohort)
+    """
+    model_version: str
+    group_by: List[str]
+    confidence: float
+    count: int
+    risk_rate: float
+    predicted_risk_rate: float
+    mean_probability: float
+    cohorts: List[CohortStatistics]
+
+
+class Perturbation(BaseModel):
+    """
+    One feature change in raw units: op 'add' shifts a numeric feature by value, op 'set'
+    replaces it (numeric value or category). min/max optionally clip the new numeric value.
+    """
+    feature: str
+    op: str = "add"
+    value: Union[float, str]
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+
+class Scenario(BaseModel):
+    """
+    A named intervention: perturbations applied together to every student of the cohort
+    """
+    name: str
+    perturbations: List[Perturbation]
+
+
+class InterventionRequest(BaseModel):
+    """
+    Input schema for the what-if simulator (cohort filter and scenarios)
+    """
+    filters: Dict[str, List[str]] = {}
+    scenarios: List[Scenario]
+
+
+class ScenarioResult(BaseModel):
+    """
+    Predicted risk of the cohort under one scenario and its change from the baseline
+    """
+    name: str
+    predicted_risk_rate: float
+    risk_rate_change: float
+    mean_probability: float
+    mean_probability_change: float
+    students_out_of_risk: int
+    students_into_risk: int
+    ignored_features: List[str]
+
+
+class InterventionResponse(BaseModel):
+    """
+    Output schema for the what-if simulator
+    """
+    model_version: str
+    count: int
+    baseline_risk_rate: float
+    baseline_mean_probability: float
+    scenarios: List[ScenarioResult]
+
+
+class RiskQuery(BaseModel):
+    """
+    Input schema for top-N and threshold queries against the risk index,
+    e.g. {"filters": {"Grade": ["12"], "SchoolType": ["Public"]}, "limit": 200}
+    """
+    filters: Dict[str, List[str]] = {}
+    limit: int = 200
+    offset: int = 0
+    min_probability: Optional[float] = None
+
+
+class RankedStudent(BaseModel):
+    """
+    One student of the risk index, pointing back at its row in the transformed split
+    """
+    split: str
+    row: int
+    probability: float
+    academic_risk: int
+    segments: Dict[str, str]
+
+
+class RiskQueryResponse(BaseModel):
+    """
+    Output schema for risk index queries (one page, highest risk first)
+    """
+    model_version: str
+    total: int
+    offset: int
+    limit: int
+    students: List[RankedStudent]
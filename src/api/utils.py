@@ -1,7 +1,8 @@
 import joblib
 import numpy as np
 from pathlib import Path
-from sklearn.preprocessing import StandardScaler, LabelEncoder
+
+from instrumentation import span
 
 # Paths
 BASE_DIR = Path(__file__).resolve().parents[1]
@@ -9,6 +10,12 @@ BASE_DIR = Path(__file__).resolve().parents[1]
 MODEL_PATH = BASE_DIR / "artifacts" / "model_training" / "model.joblib"
 SCALER_PATH = BASE_DIR / "artifacts" / "data_transformation" / "scaler.joblib"
 ENCODERS_PATH = BASE_DIR / "artifacts" / "data_transformation" / "label_encoders.joblib" 
+METADATA_PATH = BASE_DIR / "artifacts" / "data_transformation" / "feature_metadata.joblib"
+INFERENCE_PLAN_PATH = BASE_DIR / "artifacts" / "model_training" / "inference_plan.joblib"
+BACKGROUND_PATH = BASE_DIR / "artifacts" / "data_transformation" / "background.joblib"
+TRANSFORMED_DATA_DIR = BASE_DIR / "artifacts" / "data_transformation"
+RISK_INDEX_PATH = BASE_DIR / "artifacts" / "risk_index" / "risk_index.npz"
+ARRAY_STORE_DIR = BASE_DIR / "artifacts" / "serving"
 
 
 # ------------------ Load artifacts ------------------ #
@@ -32,28 +39,100 @@ def load_encoders(categorical_columns):
     return encoders
 
 
+# ------------------ Encoding ------------------ #
+class LookupEncoder:
+    """
+    Inference-time replacement for a fitted LabelEncoder.
+
+    Built once from the encoder vocabulary (classes_). Single values are encoded with a plain
+    dict lookup and arrays with one searchsorted pass over a pre-sorted copy of the vocabulary.
+    Unseen categories map to -1, exactly like DataTransformation.encode_categorical_columns.
+    """
+
+    UNKNOWN = -1
+
+    def __init__(self, classes, order=None, sorted_classes=None):
+        """
+        :param classes: The encoder vocabulary, indexed by code
+        :param order: Precomputed stable argsort of the vocabulary (e.g. memory-mapped)
+        :param sorted_classes: Precomputed classes[order]
+        """
+        self.classes_ = np.asarray(classes)
+        if self.classes_.dtype.kind != "U":
+            self.classes_ = self.classes_.astype(str)
+        self.lookup = {value: code for code, value in enumerate(self.classes_.tolist())}
+
+        # sorted view of the vocabulary plus the original code of each sorted entry
+        self._order = np.argsort(self.classes_, kind="stable") if order is None else order
+        self._sorted_classes = self.classes_[self._order] if sorted_classes is None else sorted_classes
+
+    def encode(self, value):
+        """
+        Encode a single value
+        """
+        return self.lookup.get(str(value), self.UNKNOWN)
+
+    def transform(self, values):
+        """
+        Encode an array of values in one vectorized pass
+
+        :return: Integer codes, -1 for unseen categories
+        :rtype: np.ndarray
+        """
+        values = np.asarray(values).astype(str)
+
+        if len(self._sorted_classes) == 0:
+            return np.full(values.shape, self.UNKNOWN, dtype=np.int64)
+
+        positions = np.searchsorted(self._sorted_classes, values)
+        positions = np.minimum(positions, len(self._sorted_classes) - 1)
+        known = self._sorted_classes[positions] == values
+
+        return np.where(known, self._order[positions], self.UNKNOWN)
+
+
+def compile_encoders(encoders):
+    """
+    Compile fitted LabelEncoders into LookupEncoders once at startup
+    """
+    return {col: LookupEncoder(encoder.classes_) for col, encoder in encoders.items()}
+
+
 # ------------------ Feature preprocessing ------------------ #
+def check_finite(values):
+    """
+    Reject NaN and infinite numerical inputs, which sklearn's input validation used to catch
+
+    :raises ValueError: If any value is not finite
+    """
+    if not np.isfinite(values).all():
+        raise ValueError("Numerical features must be finite numbers")
+
+
 def prepare_features(data, model_features, categorical_columns, numerical_columns, encoders, scaler):
     """
     Prepare input array for prediction:
-    - Encode categorical features
-    - Scale numerical features
+    - Encode categorical features (unseen categories map to -1)
+    - Scale numerical features (skipped when scaler is None, e.g. for a fused inference plan)
     - Arrange in correct order for model_features
     """
 
     feature_dict = data.dict()  # assume pydantic input
 
     # Encode categorical columns
-    for col in categorical_columns:
-        if col in feature_dict:
-            feature_dict[col] = encoders[col].transform([str(feature_dict[col])])[0]
+    with span("predict", "encode"):
+        for col in categorical_columns:
+            if col in feature_dict:
+                feature_dict[col] = encoders[col].encode(feature_dict[col])
 
     # Scale numerical columns
-    num_values = [feature_dict[col] for col in numerical_columns if col in feature_dict]
-    if num_values:
-        scaled_values = scaler.transform([num_values])[0]
-        for i, col in enumerate([col for col in numerical_columns if col in feature_dict]):
-            feature_dict[col] = scaled_values[i]
+    with span("predict", "scale"):
+        num_values = [feature_dict[col] for col in numerical_columns if col in feature_dict]
+        check_finite(np.asarray(num_values, dtype=np.float64))
+        if num_values and scaler is not None:
+            scaled_values = scaler.transform([num_values])[0]
+            for i, col in enumerate([col for col in numerical_columns if col in feature_dict]):
+                feature_dict[col] = scaled_values[i]
 
     # Create final array in order of model_features
     final_features = np.array([[feature_dict[col] for col in model_features]])
@@ -61,12 +140,235 @@ def prepare_features(data, model_features, categorical_columns, numerical_column
     return final_features
 
 
+def students_to_columns(students, feature_names):
+    """
+    Convert a list of pydantic inputs into a columnar mapping {feature: values}
+    """
+    return {col: [getattr(student, col) for student in students] for col in feature_names}
+
+
+def prepare_features_batch(columns, model_features, categorical_columns, numerical_columns, encoders, scaler):
+    """
+    Prepare input matrix for a batch of students in one vectorized pass:
+    - Encode each categorical column over the whole batch
+    - Scale all numerical columns with a single scaler call (skipped when scaler is None)
+    - Write everything straight into a preallocated matrix in model_features order
+
+    :param columns: Mapping of feature name to a sequence of values (one per student)
+    """
+
+    positions = {col: i for i, col in enumerate(model_features)}
+    n_rows = len(columns[model_features[0]])
+
+    final_features = np.empty((n_rows, len(model_features)), dtype=np.float64)
+
+    # Encode categorical columns
+    with span("predict_batch", "encode"):
+        for col in categorical_columns:
+            if col in positions:
+                final_features[:, positions[col]] = encoders[col].transform(columns[col])
+
+    # Scale numerical columns
+    with span("predict_batch", "scale"):
+        num_columns = [col for col in numerical_columns if col in positions]
+        if num_columns:
+            num_values = np.column_stack([np.asarray(columns[col], dtype=np.float64) for col in num_columns])
+            check_finite(num_values)
+            if scaler is not None:
+                num_values = scaler.transform(num_values)
+            final_features[:, [positions[col] for col in num_columns]] = num_values
+
+    return final_features
+
+
 # ------------------ Prediction ------------------ #
+def predict_batch(model, features_array):
+    """
+    Generate predictions and probabilities for a batch with a single predict_proba call.
+    Class labels are derived from the probabilities instead of a second model.predict pass.
+    """
+    # array-backed plans (LinearInferencePlan, TreeEnsemblePlan) return labels and probabilities directly
+    if not hasattr(model, "predict_proba"):
+        return model.predict(features_array)
+
+    probabilities = model.predict_proba(features_array)
+    predictions = model.classes_[np.argmax(probabilities, axis=1)]
+
+    return predictions, probabilities[:, 1]
+
+
 def predict(model, features_array):
     """
     Generate prediction and probability
     """
-    prediction = model.predict(features_array)[0]
-    probability = model.predict_proba(features_array)[0][1]
+    predictions, probabilities = predict_batch(model, features_array)
+
+    return predictions[0], probabilities[0]
+
+
+# ------------------ Fused inference plan ------------------ #
+# model types whose predict_proba is sigmoid(X @ coef_.T + intercept_) for binary targets
+FUSABLE_MODELS = ("LogisticRegression", "SGDClassifier")
+
+
+def is_fusable(model) -> bool:
+    """
+    Whether the model is a binary linear classifier with a sigmoid predict_proba
+    """
+    if type(model).__name__ not in FUSABLE_MODELS or len(model.classes_) != 2:
+        return False
+    return type(model).__name__ != "SGDClassifier" or model.loss == "log_loss"
+
+
+class LinearInferencePlan:
+    """
+    StandardScaler and a binary linear classifier folded into one weight vector and bias.
+
+    For a scaled numeric column, w * (x - mean) / scale == (w / scale) * x - w * mean / scale,
+    so the whole preprocessing + model chain becomes sigmoid(X_raw @ weights + bias) on raw
+    numeric values and encoded categorical codes.
+    """
+
+    def __init__(self, feature_names, weights, bias, classes):
+        self.feature_names = list(feature_names)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.bias = float(bias)
+        self.classes_ = np.asarray(classes)
+
+    @classmethod
+    def from_model(cls, model, scaler, model_features, numerical_columns):
+        """
+        Fold the scaler into the model coefficients
+
+        :return: The fused plan, or None if the model type cannot be fused
+        :rtype: LinearInferencePlan | None
+        """
+        if not is_fusable(model):
+            return None
+
+        weights = np.asarray(model.coef_, dtype=np.float64).ravel().copy()
+        bias = float(np.ravel(model.intercept_)[0])
+
+        mean = scaler.mean_ if scaler.mean_ is not None and scaler.with_mean else np.zeros(len(numerical_columns))
+        scale = scaler.scale_ if scaler.scale_ is not None and scaler.with_std else np.ones(len(numerical_columns))
+
+        positions = {col: i for i, col in enumerate(model_features)}
+        for j, col in enumerate(numerical_columns):
+            if col in positions:
+                i = positions[col]
+                weights[i] = weights[i] / scale[j]
+                bias -= weights[i] * mean[j]
+
+        return cls(model_features, weights, bias, model.classes_)
+
+    def decision_function(self, features_array):
+        return features_array @ self.weights + self.bias
+
+    def predict(self, features_array):
+        """
+        Generate predictions and positive-class probabilities from raw (unscaled) features
+
+        :raises ValueError: On NaN or infinite features, like the sklearn model's input validation
+        """
+        check_finite(features_array)
+        decision = self.decision_function(features_array)
+
+        # numerically stable sigmoid
+        probabilities = np.exp(-np.logaddexp(0.0, -decision))
+        predictions = self.classes_[(decision > 0).astype(np.intp)]
+
+        return predictions, probabilities
+
+    def to_dict(self):
+        return {
+            "feature_names": self.feature_names,
+            "weights": self.weights,
+            "bias": self.bias,
+            "classes": self.classes_,
+        }
+
+    @classmethod
+    def from_dict(cls, plan):
+        return cls(plan["feature_names"], plan["weights"], plan["bias"], plan["classes"])
+
+
+def verify_inference_plan(plan, model, scaler, encoders, model_features, numerical_columns,
+                          n_samples=1000, atol=1e-9, random_state=42):
+    """
+    Check numerical parity of the fused plan against the sklearn scaler + model path
+    on synthetic rows drawn around the scaler statistics and the encoder vocabularies,
+    and check that rows with NaN or infinite numerical features are rejected
+
+    :return: Maximum absolute probability difference
+    :rtype: float
+    :raises ValueError: If the difference exceeds atol or any label disagrees
+    """
+    rng = np.random.default_rng(random_state)
+    positions = {col: i for i, col in enumerate(model_features)}
+    num_positions = [positions[col] for col in numerical_columns if col in positions]
+
+    raw = np.empty((n_samples, len(model_features)), dtype=np.float64)
+    for col, encoder in encoders.items():
+        if col in positions:
+            raw[:, positions[col]] = rng.integers(-1, len(encoder.classes_), size=n_samples)
+
+    num_stats = [j for j, col in enumerate(numerical_columns) if col in positions]
+    raw[:, num_positions] = rng.normal(scaler.mean_[num_stats], 2 * scaler.scale_[num_stats], size=(n_samples, len(num_stats)))
+
+    scaled = raw.copy()
+    scaled[:, num_positions] = scaler.transform(raw[:, num_positions])
+
+    expected_labels, expected = predict_batch(model, scaled)
+    labels, probabilities = plan.predict(raw)
+
+    max_diff = float(np.max(np.abs(probabilities - expected)))
+    if max_diff > atol or not np.array_equal(labels, expected_labels):
+        raise ValueError(f"Inference plan diverges from the sklearn path (max abs diff {max_diff:.3e})")
+
+    # like the sklearn model, the plan must refuse rows with non-finite numerical features
+    for value in (np.nan, np.inf) if num_positions else ():
+        row = raw[:1].copy()
+        row[0, num_positions[0]] = value
+        try:
+            plan.predict(row)
+        except ValueError:
+            continue
+        raise ValueError(f"Inference plan scores a row containing {value}")
+
+    return max_diff
+
+
+def export_inference_plan(plan, path=INFERENCE_PLAN_PATH):
+    """
+    Save the fused plan as plain numpy arrays so it can be loaded without sklearn
+    """
+    joblib.dump(plan.to_dict(), path)
+    return path
+
+
+def load_inference_plan(model, scaler, model_features, numerical_columns, path=INFERENCE_PLAN_PATH,
+                        sources=(MODEL_PATH, SCALER_PATH)):
+    """
+    Load the fused inference plan, rebuilding (and re-exporting) it when the artifact is
+    missing or older than the model or scaler it was folded from
+
+    :param sources: Artifact paths the plan is derived from
+    :return: The fused plan, or None if the model type cannot be fused
+    :rtype: LinearInferencePlan | None
+    """
+    path = Path(path)
+    sources = [Path(src) for src in sources]
+
+    if path.exists() and all(path.stat().st_mtime >= src.stat().st_mtime for src in sources if src.exists()):
+        plan = LinearInferencePlan.from_dict(joblib.load(path))
+        if plan.feature_names == list(model_features):
+            return plan
+
+    plan = LinearInferencePlan.from_model(model, scaler, model_features, numerical_columns)
+    if plan is not None:
+        try:
+            export_inference_plan(plan, path)
+        except OSError:
+            pass  # read-only artifact directory: keep the in-memory plan
 
-    return prediction, probability
+    return plan
@@ -0,0 +1,238 @@
+"""
+imports.py
+============
+
+Import-time (cold start) benchmark of the serving and pipeline entry points.
+
+Every target module is imported in a fresh interpreter under `python -X importtime`, a few
+times after one warm-up run. The benchmark reports the median import time of the module, the
+median wall time of the whole process (interpreter start included), and the packages that
+contribute most to the import. The serving startup (importing api.app and loading the model
+bundle, as a new worker does) is measured too, when trained artifacts exist.
+
+The serving targets must not import the training stack (serve.TRAINING_MODULES). The run fails
+(exit code 1) when they do, or when a time regresses past a threshold against a baseline.
+
+Usage:
+    python -m benchmarks.imports --output benchmarks/results/imports.json
+    python -m benchmarks.imports --baseline old.json --threshold 0.2   # exit code 1 on regression
+"""
+
+
+# libraries
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from logger import logger
+from benchmarks.serving import environment
+from serve import TRAINING_MODULES
+
+
+SOURCE_ROOT = Path(__file__).resolve().parents[1]
+
+# benchmark name: module imported
+TARGETS = {
+    "serving": "api.app",
+    "pipeline": "main",
+    "config": "config",
+    "data_ingestion": "components.data_ingestion",
+    "data_transformation": "components.data_transformation",
+    "model_training": "components.model_training",
+    "model_evaluation": "components.model_evaluation",
+}
+
+# targets (and the startup measurement) that must stay clear of the training stack
+SERVING_TARGETS = ("serving", "serving_startup")
+
+# metrics compared against a baseline (lower is better)
+COMPARED_METRICS = ("import_ms", "process_ms", "startup_ms")
+
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import api.app
+imported = time.perf_counter()
+api.app.registry.get()
+loaded = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "startup_ms": (loaded - started) * 1000,
+                  "modules": sorted(sys.modules)}))
+"""
+
+
+def parse_importtime(output: str) -> list:
+    """
+    Entries of a `-X importtime` report
+
+    :return: (module, self microseconds, cumulative microseconds, nesting depth) per import
+    :rtype: list
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def training_modules(modules) -> list:
+    """
+    Training stack packages among the imported modules
+    """
+    return sorted({name.split(".")[0] for name in modules} & set(TRAINING_MODULES))
+
+
+def run_python(args: list, env: dict) -> tuple:
+    """
+    Run a fresh interpreter in src/ and return its wall time (seconds) and output
+    """
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, *args], cwd=SOURCE_ROOT, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed:\n{process.stderr[-2000:]}")
+    return elapsed, process
+
+
+def measure_import(module: str, repeats: int, top: int, env: dict) -> dict:
+    """
+    Median import and process time of one module, with its heaviest packages
+    """
+    runs = []
+    for i in range(repeats + 1):
+        elapsed, process = run_python(["-X", "importtime", "-c", f"import {module}"], env)
+        entries = parse_importtime(process.stderr)
+        import_us = next(cumulative for name, _, cumulative, depth in entries if name == module and depth == 0)
+        if i > 0:  # the first run warms the file system cache
+            runs.append((import_us, elapsed, entries))
+
+    runs.sort(key=lambda run: run[0])
+    import_us, _, entries = runs[len(runs) // 2]
+
+    # self time of every module, summed per top-level package
+    packages = defaultdict(int)
+    for name, self_us, _, _ in entries:
+        packages[name.split(".")[0]] += self_us
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+    return {
+        "module": module,
+        "import_ms": statistics.median(run[0] for run in runs) / 1000,
+        "process_ms": statistics.median(run[1] for run in runs) * 1000,
+        "modules_imported": len(entries),
+        "heaviest_packages_ms": {name: self_us / 1000 for name, self_us in heaviest},
+        "training_modules": training_modules(name for name, _, _, _ in entries),
+    }
+
+
+def measure_startup(repeats: int, env: dict) -> dict:
+    """
+    Median time for a new serving process to import the API and load the model bundle
+    """
+    runs = []
+    for i in range(repeats + 1):
+        elapsed, process = run_python(["-c", STARTUP_SCRIPT], env)
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        result["process_ms"] = elapsed * 1000
+        if i > 0:
+            runs.append(result)
+
+    return {
+        "import_ms": statistics.median(run["import_ms"] for run in runs),
+        "startup_ms": statistics.median(run["startup_ms"] for run in runs),
+        "process_ms": statistics.median(run["process_ms"] for run in runs),
+        "modules_imported": len(runs[-1]["modules"]),
+        "training_modules": training_modules(runs[-1]["modules"]),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta_ms: float) -> list:
+    """
+    Times that are worse than the baseline by more than the threshold (a fraction) and by more
+    than min_delta_ms, so small modules do not fail the run on noise
+
+    :return: One message per regression
+    """
+    regressions = []
+    for name, metrics in results["imports"].items():
+        reference = baseline.get("imports", {}).get(name, {})
+        for metric in COMPARED_METRICS:
+            if metric not in metrics or not reference.get(metric):
+                continue
+            change = metrics[metric] / reference[metric] - 1
+            if change > threshold and metrics[metric] - reference[metric] > min_delta_ms:
+                regressions.append(f"{name}.{metric}: {reference[metric]:.1f} ms -> {metrics[metric]:.1f} ms "
+                                   f"({change:+.1%})")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import-time benchmark of the entry points")
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), default=list(TARGETS))
+    parser.add_argument("--repeats", type=int, default=5, help="measured runs per target")
+    parser.add_argument("--top", type=int, default=8, help="heaviest packages reported per target")
+    parser.add_argument("--skip-startup", action="store_true", help="do not load the model bundle")
+    parser.add_argument("--output", type=Path, help="write the results to this JSON file")
+    parser.add_argument("--baseline", type=Path, help="results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.20,
+                        help="fail when a time is worse than the baseline by more than this fraction")
+    parser.add_argument("--min-delta-ms", type=float, default=25.0,
+                        help="ignore regressions smaller than this many milliseconds")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # the measured processes must not start polling the artifacts
+    env = {**os.environ, "RISK_API_RELOAD_INTERVAL": "0"}
+
+    results = {"environment": environment(), "settings": {"repeats": args.repeats}, "imports": {}}
+
+    for name in args.targets:
+        results["imports"][name] = measure_import(TARGETS[name], args.repeats, args.top, env)
+        logger.info(f"[imports] {name:<20} import {results['imports'][name]['import_ms']:8.1f} ms | "
+                    f"process {results['imports'][name]['process_ms']:8.1f} ms")
+
+    from api.utils import MODEL_PATH
+    if not args.skip_startup and MODEL_PATH.exists():
+        results["imports"]["serving_startup"] = startup = measure_startup(args.repeats, env)
+        logger.info(f"[imports] serving_startup      import {startup['import_ms']:8.1f} ms | "
+                    f"loaded {startup['startup_ms']:8.1f} ms")
+
+    failed = False
+    for name in SERVING_TARGETS:
+        loaded = results["imports"].get(name, {}).get("training_modules")
+        if loaded:
+            logger.error(f"{name} imports the training stack: {', '.join(loaded)}")
+            failed = True
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(results, indent=2))
+        logger.info(f"Benchmark results saved - {args.output}")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.threshold, args.min_delta_ms)
+        for regression in regressions:
+            logger.error(f"Regression: {regression}")
+        if regressions:
+            failed = True
+        else:
+            logger.info(f"No regression beyond {args.threshold:.0%} against {args.baseline}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
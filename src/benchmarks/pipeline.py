@@ -0,0 +1,238 @@
+"""
+pipeline.py
+============
+
+End-to-end pipeline benchmark at several data scales.
+
+For each scale, synthetic splits are generated and the pipeline runs on them in a fresh
+process, with every path pointing into a scratch directory. For each stage (ingestion,
+transformation, training, evaluation) the benchmark records:
+
+- wall time
+- peak resident memory (the VmHWM high-water mark, reset through /proc/self/clear_refs before
+  the stage) and the resident memory the stage started from
+- bytes read and written (/proc/self/io; rchar/wchar count all reads and writes, read_bytes/
+  write_bytes only those reaching the storage layer)
+
+Peak memory covers this process only, not worker processes started by a stage.
+
+Usage:
+    python -m benchmarks.pipeline --scales 10000 100000 1000000 --output benchmarks/results/pipeline.json
+    python -m benchmarks.pipeline --scales 1000000 --streaming    # chunked transformation
+"""
+
+
+# libraries
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import yaml
+
+from logger import logger
+from benchmarks.synthetic_data import write_splits
+
+
+SOURCE_ROOT = Path(__file__).resolve().parents[1]
+IO_FIELDS = ("rchar", "wchar", "read_bytes", "write_bytes")
+
+
+# ------------------ Process counters ------------------ #
+def reset_peak_rss() -> bool:
+    """
+    Reset the VmHWM high-water mark to the current resident memory (Linux 4.0+)
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def memory_status() -> dict:
+    """
+    Current (VmRSS) and peak (VmHWM) resident memory in bytes
+    """
+    status = {}
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    status[key] = int(value.split()[0]) * 1024
+    except OSError:
+        import resource
+        # no /proc: only the peak since the process started is available
+        status["VmHWM"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return status
+
+
+def io_counters() -> dict:
+    """
+    I/O counters of this process (empty where /proc/self/io is unavailable)
+    """
+    counters = {}
+    try:
+        with open("/proc/self/io") as file:
+            for line in file:
+                key, _, value = line.partition(":")
+                if key in IO_FIELDS:
+                    counters[key] = int(value)
+    except OSError:
+        pass
+    return counters
+
+
+def measure(name: str, fn, report: list):
+    """
+    Run one stage and append its wall time, memory and I/O to the report
+    """
+    peak_reset = reset_peak_rss()
+    start_memory, start_io = memory_status(), io_counters()
+    start = time.perf_counter()
+
+    result = fn()
+
+    elapsed = time.perf_counter() - start
+    end_memory, end_io = memory_status(), io_counters()
+
+    entry = {
+        "stage": name,
+        "wall_seconds": elapsed,
+        "start_rss_bytes": start_memory.get("VmRSS"),
+        "peak_rss_bytes": end_memory.get("VmHWM"),
+        "peak_is_per_stage": peak_reset,
+        **{key: end_io[key] - start_io[key] for key in end_io if key in start_io},
+    }
+    report.append(entry)
+
+    logger.info(f"[benchmark] {name}: {elapsed:.2f}s, peak RSS {(entry['peak_rss_bytes'] or 0) / 1e6:.1f} MB")
+    return result
+
+
+# ------------------ Pipeline run ------------------ #
+def write_config(work_dir: Path, data_paths: dict, streaming: bool) -> tuple:
+    """
+    Copy config.yaml and params.yaml with every path pointing into the scratch directory
+    """
+    config = yaml.safe_load((SOURCE_ROOT / "config.yaml").read_text())
+    artifacts = work_dir / "artifacts"
+
+    raw = {
+        "train_data_file_path": str(data_paths["train"]),
+        "val_data_file_path": str(data_paths["validation"]),
+        "test_data_file_path": str(data_paths["test"]),
+    }
+    extension = ".parquet" if config.get("data_format", "csv") == "parquet" else ".csv"
+    transformed = {
+        f"{split}_data_file_path": str(artifacts / "data_transformation" / f"{split}{extension}")
+        for split in ("train", "val", "test")
+    }
+
+    config["artifacts_root"] = str(artifacts)
+    config["data_ingestion"].update(root_dir=str(artifacts / "data_ingestion"), **raw)
+    config["data_transformation"].update(root_dir=str(artifacts / "data_transformation"), streaming=streaming, **raw)
+    config["model_training"].update(root_dir=str(artifacts / "model_training"), **transformed)
+    config["model_evaluation"].update(
+        root_dir=str(artifacts / "model_evaluation"),
+        model_path=str(artifacts / "model_training" / config["model_training"]["model_name"]),
+        eval_data_file_path=transformed["test_data_file_path"],
+        encoders_path=str(artifacts / "data_transformation" / "label_encoders.joblib"),
+    )
+
+    config_path, params_path = work_dir / "config.yaml", work_dir / "params.yaml"
+    config_path.write_text(yaml.safe_dump(config, sort_keys=False))
+    shutil.copyfile(SOURCE_ROOT / "params.yaml", params_path)
+
+    return config_path, params_path
+
+
+def run_scale(n_rows: int, work_dir: str, streaming: bool = False, seed: int = 42) -> dict:
+    """
+    Generate n_rows of data and run every pipeline stage on it (in a fresh process)
+    """
+    work_dir = Path(work_dir)
+    # keep the evaluation runs out of the project's MLflow store
+    os.environ["MLFLOW_TRACKING_URI"] = f"sqlite:///{work_dir / 'mlflow.db'}"
+
+    from config import ConfigurationManager
+    from pipeline.data_ingestion_pipeline import DataIngestionPipeline
+    from pipeline.data_transform_pipeline import DataTransformationPipeline
+    from pipeline.model_training_pipeline import ModelTrainingPipeline
+    from pipeline.model_evaluation_ppipeline import ModelEvaluationPipeline
+
+    report = []
+    data_paths = measure("generate_data", lambda: write_splits(work_dir / "data", n_rows, seed), report)
+    config = ConfigurationManager(*write_config(work_dir, data_paths, streaming))
+
+    if streaming:
+        transformation = DataTransformationPipeline(config)
+        measure("data_transformation", transformation.initialize_streaming_transformation, report)
+    else:
+        train_df, val_df, test_df = measure(
+            "data_ingestion", DataIngestionPipeline(config).initialize_data_ingestion, report
+        )
+        transformation = DataTransformationPipeline(config)
+        measure("data_transformation",
+                lambda: transformation.initialize_data_transformation(train_df, val_df, test_df), report)
+        del train_df, val_df, test_df
+
+    measure("model_training", ModelTrainingPipeline(config).initiate_model_training, report)
+    measure("model_evaluation", ModelEvaluationPipeline(config).initiate_model_evaluation, report)
+
+    return {"rows": n_rows, "streaming": streaming, "stages": report}
+
+
+def run_benchmark(scales, streaming: bool = False, work_root: Path = None, keep: bool = False, seed: int = 42) -> list:
+    """
+    Run the pipeline at every scale, each in its own process so peak memory is not carried over
+    """
+    results = []
+    for n_rows in scales:
+        work_dir = Path(tempfile.mkdtemp(prefix=f"pipeline_{n_rows}_", dir=work_root))
+        logger.info(f"[benchmark] {n_rows} rows in {work_dir}")
+
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results.append(pool.submit(run_scale, n_rows, str(work_dir), streaming, seed).result())
+        finally:
+            if not keep:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark on synthetic data")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="total rows of each run")
+    parser.add_argument("--streaming", action="store_true", help="transform the raw files in chunks")
+    parser.add_argument("--work-dir", type=Path, help="where the scratch directories are created")
+    parser.add_argument("--keep", action="store_true", help="keep the generated data and artifacts")
+    parser.add_argument("--output", type=Path, help="write the results to this JSON file")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    results = run_benchmark(args.scales, args.streaming, args.work_dir, args.keep, args.seed)
+
+    for result in results:
+        for stage in result["stages"]:
+            logger.info(f"{result['rows']:>10} rows | {stage['stage']:<20} | {stage['wall_seconds']:8.2f}s | "
+                        f"peak RSS {(stage['peak_rss_bytes'] or 0) / 1e6:9.1f} MB | "
+                        f"read {stage.get('rchar', 0) / 1e6:9.1f} MB | written {stage.get('wchar', 0) / 1e6:9.1f} MB")
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(results, indent=2))
+        logger.info(f"Benchmark results saved - {args.output}")
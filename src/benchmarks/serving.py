@@ -0,0 +1,336 @@
+"""
+serving.py
+============
+
+Latency and load benchmark of the prediction API.
+
+Drives /predict and /predict/batch (JSON and NumPy record payloads) with synthetic
+StudentFeatures at a configurable concurrency, either in-process through an ASGI transport or
+against a running server, and reports p50/p95/p99 latency, throughput and CPU time per request.
+prepare_features and predict are also timed in isolation. Results are saved as JSON. Given the
+results of an earlier run as a baseline, the run fails when a metric regresses past a threshold.
+
+CPU time is the CPU of this process, so in-process runs include the server and runs against
+a URL only measure the client.
+
+Usage:
+    python -m benchmarks.serving --output benchmarks/results/serving.json
+    python -m benchmarks.serving --url http://127.0.0.1:8000 --concurrency 64 --requests 5000
+    python -m benchmarks.serving --baseline old.json --threshold 0.15   # exit code 1 on regression
+"""
+
+
+# libraries
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import numpy as np
+
+from logger import logger
+
+
+# value ranges and categories of the model features (see the dataset schema in the README)
+NUMERICAL_RANGES = {
+    "GPA": (0.0, 4.0),
+    "AttendanceRate": (0.70, 1.00),
+    "TestScore_Math": (0.0, 100.0),
+    "StudyHours": (0.0, 4.0),
+}
+CATEGORIES = {
+    "ParentalEducation": ["<HS", "HS", "SomeCollege", "Bachelors+"],
+    "SchoolType": ["Public", "Private"],
+    "Gender": ["Female", "Male"],
+}
+
+# metrics compared against a baseline, and whether higher values are better
+COMPARED_METRICS = {
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "throughput_rps": True,
+    "cpu_ms_per_request": False,
+    "mean_us": False,
+}
+
+
+def synthetic_students(n: int, seed: int = 0) -> list:
+    """
+    Random StudentFeatures payloads within the documented ranges
+    """
+    rng = np.random.default_rng(seed)
+
+    columns = {col: rng.uniform(low, high, n).round(3) for col, (low, high) in NUMERICAL_RANGES.items()}
+    columns.update({col: rng.choice(values, n) for col, values in CATEGORIES.items()})
+
+    return [{col: values[i].item() for col, values in columns.items()} for i in range(n)]
+
+
+def latency_summary(latencies, elapsed: float, cpu: float) -> dict:
+    """
+    Percentiles (ms), throughput and CPU time per request of one load run
+    """
+    latencies = np.asarray(latencies) * 1000
+    n = len(latencies)
+
+    return {
+        "requests": n,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+        "throughput_rps": n / elapsed,
+        "cpu_ms_per_request": cpu * 1000 / n,
+    }
+
+
+# ------------------ Load test ------------------ #
+async def drive(client, requests, concurrency: int) -> dict:
+    """
+    Send the requests with at most `concurrency` in flight
+
+    :param requests: List of (path, kwargs for client.post)
+    :raises RuntimeError: If a request fails
+    """
+    latencies = np.empty(len(requests))
+    cursor = iter(range(len(requests)))
+
+    async def worker():
+        for i in cursor:
+            path, kwargs = requests[i]
+            start = time.perf_counter()
+            response = await client.post(path, **kwargs)
+            latencies[i] = time.perf_counter() - start
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}: {response.text[:200]}")
+
+    cpu, start = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return latency_summary(latencies, time.perf_counter() - start, time.process_time() - cpu)
+
+
+def scenarios(n_requests: int, n_batch_requests: int, batch_size: int, seed: int) -> dict:
+    """
+    Request lists of every load scenario (batches are overlapping windows over one pool of students)
+    """
+    from api.app import MODEL_FEATURES, CATEGORICAL_FEATURES
+    from api.codec import NUMPY_RECORDS, record_dtype
+
+    students = synthetic_students(max(n_requests, 8 * batch_size), seed)
+    windows = len(students) - batch_size + 1
+    batches = [students[start:start + batch_size]
+               for start in (i * batch_size % windows for i in range(n_batch_requests))]
+
+    def records(batch):
+        buffer = np.empty(len(batch), dtype=record_dtype(MODEL_FEATURES, CATEGORICAL_FEATURES))
+        for col in MODEL_FEATURES:
+            buffer[col] = [student[col] for student in batch]
+        return buffer.tobytes()
+
+    binary = {"Content-Type": NUMPY_RECORDS, "Accept": NUMPY_RECORDS}
+
+    return {
+        "predict": [("/predict", {"json": student}) for student in students[:n_requests]],
+        "predict_batch_json": [("/predict/batch", {"json": {"students": batch}}) for batch in batches],
+        "predict_batch_records": [("/predict/batch", {"content": records(batch), "headers": binary})
+                                  for batch in batches],
+    }
+
+
+@asynccontextmanager
+async def api_client(url: str = None):
+    """
+    HTTP client for a running server, or for api.app:app in-process (lifespan included)
+    """
+    import httpx
+
+    if url:
+        async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+            yield client
+        return
+
+    from api.app import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60) as client:
+            yield client
+
+
+async def load_test(url: str = None, n_requests: int = 2000, n_batch_requests: int = 200, concurrency: int = 16,
+                    batch_size: int = 256, warmup: int = 20, seed: int = 0) -> dict:
+    """
+    Run every load scenario and summarize its latencies
+    """
+    results = {}
+    async with api_client(url) as client:
+        for name, requests in scenarios(n_requests, n_batch_requests, batch_size, seed).items():
+            await drive(client, requests[:warmup], min(concurrency, warmup))
+            results[name] = await drive(client, requests, concurrency)
+            if name != "predict":
+                results[name]["batch_size"] = batch_size
+            logger.info(f"{name}: {results[name]}")
+
+    return results
+
+
+# ------------------ Micro-benchmarks ------------------ #
+def time_call(fn, min_time: float = 0.2, repeat: int = 5) -> dict:
+    """
+    Mean and best time of a call (us), from `repeat` rounds of at least min_time seconds each
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10:
+            break
+        number *= 10
+    number = max(1, int(number * min_time / elapsed))
+
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - start) / number * 1e6)
+
+    return {"mean_us": float(np.median(rounds)), "best_us": float(min(rounds)), "calls_per_round": number}
+
+
+def micro_benchmarks(batch_size: int = 256, seed: int = 0) -> dict:
+    """
+    Time prepare_features and predict (single student and batch) against the active bundle
+    """
+    from api.app import registry, MODEL_FEATURES, CATEGORICAL_FEATURES, NUMERICAL_FEATURES
+    from api.schema import StudentFeatures
+    from api.utils import prepare_features, predict, students_to_columns, prepare_features_batch, predict_batch
+
+    bundle = registry.get()
+    students = [StudentFeatures(**student) for student in synthetic_students(batch_size, seed)]
+    features = dict(model_features=MODEL_FEATURES, categorical_columns=CATEGORICAL_FEATURES,
+                    numerical_columns=NUMERICAL_FEATURES, encoders=bundle.encoders, scaler=bundle.scoring_scaler)
+
+    single = prepare_features(data=students[0], **features)
+    columns = students_to_columns(students, MODEL_FEATURES)
+    batch = prepare_features_batch(columns=columns, **features)
+
+    results = {
+        "prepare_features": time_call(lambda: prepare_features(data=students[0], **features)),
+        "predict": time_call(lambda: predict(bundle.scoring_model, single)),
+        "prepare_features_batch": time_call(lambda: prepare_features_batch(columns=columns, **features)),
+        "predict_batch": time_call(lambda: predict_batch(bundle.scoring_model, batch)),
+    }
+    results["prepare_features_batch"]["batch_size"] = batch_size
+    results["predict_batch"]["batch_size"] = batch_size
+
+    for name, result in results.items():
+        logger.info(f"{name}: {result}")
+
+    return results
+
+
+# ------------------ Results ------------------ #
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Metrics that are worse than the baseline by more than the threshold (a fraction)
+
+    :return: One message per regression
+    """
+    regressions = []
+    for section in ("load", "micro"):
+        for name, metrics in results.get(section, {}).items():
+            reference = baseline.get(section, {}).get(name, {})
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                if metric not in metrics or not reference.get(metric):
+                    continue
+                change = metrics[metric] / reference[metric] - 1
+                if (-change if higher_is_better else change) > threshold:
+                    regressions.append(f"{section}.{name}.{metric}: {reference[metric]:.4g} -> "
+                                       f"{metrics[metric]:.4g} ({change:+.1%})")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Prediction API latency benchmark")
+    parser.add_argument("--url", help="benchmark a running server instead of api.app:app in-process")
+    parser.add_argument("--requests", type=int, default=2000, help="/predict requests")
+    parser.add_argument("--batch-requests", type=int, default=200, help="requests per /predict/batch scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight")
+    parser.add_argument("--batch-size", type=int, default=256, help="students per batch request")
+    parser.add_argument("--skip-load", action="store_true", help="only run the micro-benchmarks")
+    parser.add_argument("--skip-micro", action="store_true", help="only run the load test")
+    parser.add_argument("--cache", action="store_true",
+                        help="keep the /predict response cache on (in-process runs)")
+    parser.add_argument("--output", type=Path, help="write the results to this JSON file")
+    parser.add_argument("--baseline", type=Path, help="results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="fail when a metric is worse than the baseline by more than this fraction")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # repeated payloads would otherwise measure the response cache, not the scoring path
+    if not args.cache:
+        os.environ.setdefault("RISK_API_CACHE", "0")
+    # keep the in-process app from polling the artifacts during the run
+    os.environ.setdefault("RISK_API_RELOAD_INTERVAL", "0")
+
+    results = {
+        "environment": environment(),
+        "settings": {"target": args.url or "in-process", "requests": args.requests,
+                     "batch_requests": args.batch_requests,
+                     "concurrency": args.concurrency, "batch_size": args.batch_size},
+    }
+
+    if not args.skip_load:
+        results["load"] = asyncio.run(load_test(args.url, args.requests, args.batch_requests, args.concurrency,
+                                                args.batch_size, seed=args.seed))
+    if not args.skip_micro:
+        results["micro"] = micro_benchmarks(args.batch_size, args.seed)
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(results, indent=2))
+        logger.info(f"Benchmark results saved - {args.output}")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.threshold)
+        for regression in regressions:
+            logger.error(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        logger.info(f"No regression beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+synthetic_data.py
+==================
+
+Synthetic student datasets at any scale, following the dataset schema in the README.
+
+Numerical columns are drawn from clipped normal distributions with the ranges, means and
+spreads of the original data; categorical columns use its category frequencies, and Grade is
+derived from Age. Splits are written in chunks, so 10M-row files never have to fit in memory.
+
+Usage:
+    python -m benchmarks.synthetic_data --rows 1000000 --output ../data/synthetic
+"""
+
+
+# libraries
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from logger import logger
+
+
+# column order of the raw CSVs
+COLUMNS = [
+    "Age", "Grade", "Gender", "Race", "SES_Quartile", "ParentalEducation", "SchoolType", "Locale",
+    "TestScore_Math", "TestScore_Reading", "TestScore_Science", "GPA", "AttendanceRate", "StudyHours",
+    "InternetAccess", "Extracurricular", "PartTimeJob", "ParentSupport", "Romantic", "FreeTime", "GoOut",
+]
+
+# (mean, standard deviation, min, max)
+NUMERICAL = {
+    "TestScore_Math": (75.0, 10.0, 0.0, 100.0),
+    "TestScore_Reading": (75.0, 10.0, 0.0, 100.0),
+    "TestScore_Science": (75.0, 10.0, 0.0, 100.0),
+    "GPA": (3.0, 0.46, 0.0, 4.0),
+    "AttendanceRate": (0.90, 0.05, 0.70, 1.00),
+    "StudyHours": (1.0, 0.35, 0.0, 4.0),
+}
+
+# {category: frequency}
+CATEGORICAL = {
+    "Age": {14: 0.20, 15: 0.20, 16: 0.20, 17: 0.19, 18: 0.21},
+    "Gender": {"Female": 0.50, "Male": 0.50},
+    "Race": {"White": 0.50, "Hispanic": 0.20, "Black": 0.14, "Asian": 0.08, "Two-or-more": 0.05, "Other": 0.03},
+    "SES_Quartile": {1: 0.25, 2: 0.25, 3: 0.25, 4: 0.25},
+    "ParentalEducation": {"<HS": 0.24, "HS": 0.26, "SomeCollege": 0.25, "Bachelors+": 0.25},
+    "SchoolType": {"Public": 0.85, "Private": 0.15},
+    "Locale": {"Suburban": 0.25, "City": 0.25, "Rural": 0.25, "Town": 0.25},
+    "InternetAccess": {0: 0.50, 1: 0.50},
+    "Extracurricular": {0: 0.50, 1: 0.50},
+    "PartTimeJob": {0: 0.50, 1: 0.50},
+    "ParentSupport": {0: 0.50, 1: 0.50},
+    "Romantic": {0: 0.50, 1: 0.50},
+    "FreeTime": {1: 0.20, 2: 0.20, 3: 0.20, 4: 0.20, 5: 0.20},
+    "GoOut": {1: 0.20, 2: 0.20, 3: 0.20, 4: 0.20, 5: 0.20},
+}
+
+# grade level by age
+GRADES = {14: 9, 15: 10, 16: 11, 17: 12, 18: 12}
+
+# share of the rows written to each split, with the file names of the original data
+SPLITS = {"train": 5 / 7, "validation": 1 / 7, "test": 1 / 7}
+
+
+def generate(n_rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Generate n_rows raw student records
+    """
+    data = {}
+
+    for col, frequencies in CATEGORICAL.items():
+        categories = np.array(list(frequencies))
+        probabilities = np.array(list(frequencies.values()), dtype=np.float64)
+        data[col] = categories[rng.choice(len(categories), n_rows, p=probabilities / probabilities.sum())]
+
+    for col, (mean, std, low, high) in NUMERICAL.items():
+        data[col] = np.clip(rng.normal(mean, std, n_rows), low, high)
+
+    ages = np.array(list(GRADES))
+    data["Grade"] = np.array(list(GRADES.values()))[np.searchsorted(ages, data["Age"])]
+
+    return pd.DataFrame({col: data[col] for col in COLUMNS})
+
+
+def write_csv(path: Path, n_rows: int, rng: np.random.Generator, chunk_size: int = 500_000):
+    """
+    Write n_rows records to a CSV, one chunk at a time
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(path, "w", newline="") as file:
+        for start in range(0, n_rows, chunk_size):
+            chunk = generate(min(chunk_size, n_rows - start), rng)
+            chunk.to_csv(file, index=False, header=start == 0)
+
+    if n_rows == 0:
+        path.write_text(",".join(COLUMNS) + "\n")
+
+
+def write_splits(output_dir: Path, n_rows: int, seed: int = 42, chunk_size: int = 500_000) -> dict:
+    """
+    Write train/validation/test CSVs with n_rows records in total
+
+    :return: Path of each split
+    :rtype: dict
+    """
+    rng = np.random.default_rng(seed)
+    output_dir = Path(output_dir)
+
+    paths = {}
+    remaining = n_rows
+    for i, (split, share) in enumerate(SPLITS.items()):
+        split_rows = remaining if i == len(SPLITS) - 1 else int(round(n_rows * share))
+        remaining -= split_rows
+
+        paths[split] = output_dir / f"{split}.csv"
+        write_csv(paths[split], split_rows, rng, chunk_size)
+        logger.info(f"Synthetic {split} split of {split_rows} rows written - {paths[split]}")
+
+    return paths
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate synthetic student data")
+    parser.add_argument("--rows", type=int, required=True, help="total rows over the three splits")
+    parser.add_argument("--output", type=Path, required=True, help="directory of the split CSVs")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-size", type=int, default=500_000, help="rows generated at a time")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    write_splits(args.output, args.rows, args.seed, args.chunk_size)
@@ -9,6 +9,7 @@ Implements the data ingestion components
 # libraries
 from logger import logger
 from entity import DataIngestionConfig
+from utils import raw_csv_dtypes
 import pandas as pd
 import io
 
@@ -19,9 +20,11 @@ class DataIngestion:
     
     # method to laod the data
     def load_data(self):
-        train_data = pd.read_csv(self.config.train_data_file_path)
-        val_data = pd.read_csv(self.config.val_data_file_path)
-        test_data = pd.read_csv(self.config.test_data_file_path)
+        # explicit dtypes, shared with the chunked readers, instead of per-file inference
+        dtypes = raw_csv_dtypes(self.config.categorical_columns)
+        train_data = pd.read_csv(self.config.train_data_file_path, dtype=dtypes)
+        val_data = pd.read_csv(self.config.val_data_file_path, dtype=dtypes)
+        test_data = pd.read_csv(self.config.test_data_file_path, dtype=dtypes)
 
         logger.info(f"Loading the Data from the local directory")
 
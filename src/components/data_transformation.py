@@ -7,19 +7,56 @@ Implements the data transformation components
 
 
 
-import scipy as sp
 from logger import logger
 from entity import DataTransformationConfig
+from utils import (
+    dataset_path, save_dataframe, iter_dataframe_chunks, ChunkedDatasetWriter, CategoryEncoder, track_memory,
+    raw_csv_dtypes
+)
+from instrumentation import instrument
 import pandas as pd
+import numpy as np
+import json
+import threading
+from functools import wraps
 from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.compose import ColumnTransformer
 # from sklearn.pipeline import Pipeline
 from pathlib import Path
 import joblib
 
 
+# whether the current thread is inside a measured step (stages can share a component across threads)
+_step_state = threading.local()
 
+
+def memory_step(method):
+    """
+    Records peak and resident memory of a transformation step when config.track_memory is set.
+    Only the outermost step of each thread is measured so nested steps do not reset its peak.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.config.track_memory or getattr(_step_state, "tracking", False):
+            return method(self, *args, **kwargs)
+
+        _step_state.tracking = True
+        try:
+            with track_memory(method.__name__, self.memory_report):
+                return method(self, *args, **kwargs)
+        finally:
+            _step_state.tracking = False
+
+    return wrapper
+
+
+@instrument()
 class DataTransformation:
+    """
+    Ownership contract: the transform methods take ownership of the dataframe they are given.
+    They modify it in place and return the same object, and never copy the frame or build
+    per-row string columns. Callers that still need the raw data must pass a copy.
+    """
+
     def __init__(self, config: DataTransformationConfig):
         """
         Initialize DataTransformation component
@@ -30,7 +67,32 @@ class DataTransformation:
         self.config = config
         self.encoders = {} 
         self.scaler = None
+        self.memory_report = []
+        self.background = None
+        self._background_rng = np.random.default_rng(42)
+
+    def fork(self) -> "DataTransformation":
+        """
+        A component for another stage: it shares the fitted scaler and encoders (only read by the
+        transform methods) and has its own memory report, so concurrent stages do not mix their
+        measurements
+        """
+        other = DataTransformation(self.config)
+        other.scaler = self.scaler
+        other.encoders = self.encoders
+        return other
 
+    @staticmethod
+    def code_dtype(n_classes: int):
+        """
+        Smallest signed integer dtype holding every class code and the -1 unseen marker
+        """
+        for dtype in (np.int8, np.int16, np.int32):
+            if n_classes <= np.iinfo(dtype).max:
+                return dtype
+        return np.int64
+
+    @memory_step
     def cast_categorical_columns(self, dataframe: pd.DataFrame) -> pd.DataFrame:
         """
         Convert categorical columns to the correct data type - category
@@ -46,6 +108,7 @@ class DataTransformation:
         logger.info("Data Type Conversion Complete")
         return dataframe
 
+    @memory_step
     def create_target_feature(self, dataframe: pd.DataFrame) -> pd.DataFrame:
         """
         Create the target feature 'academic_risk' based on GPA, AttendanceRate, and TestScore_Math
@@ -59,10 +122,11 @@ class DataTransformation:
             (dataframe['GPA'] < 2.5) |
             (dataframe['AttendanceRate'] < 0.85) |
             (dataframe['TestScore_Math'] < 50)
-        ).astype(int)
+        ).astype(np.int8)
         logger.info(f"Target Feature Created Successfully")
         return dataframe
 
+    @memory_step
     def fit_scaler(self, dataframe: pd.DataFrame):
         """
         Fit a StandardScaler on the numerical columns
@@ -74,9 +138,11 @@ class DataTransformation:
         self.scaler.fit(dataframe[self.config.numerical_columns])
         logger.info("Scaler Fitting Complete")
 
+    @memory_step
     def scale_numeric_features(self, dataframe: pd.DataFrame) -> pd.DataFrame:
         """
-        Scale the numerical features using the fitted StandardScaler
+        Scale the numerical features in place using the fitted StandardScaler
+        (as float32 when config.downcast_numeric is set)
         
         :param dataframe: The dataframe to scale
         :type dataframe: pd.DataFrame
@@ -84,27 +150,251 @@ class DataTransformation:
         :rtype: pd.DataFrame
         """
 
-        dataframe = dataframe.copy()
-        dataframe[self.config.numerical_columns] = self.scaler.transform(dataframe[self.config.numerical_columns])
+        dtype = np.float32 if self.config.downcast_numeric else np.float64
+        scaled = self.scaler.transform(dataframe[self.config.numerical_columns])
+
+        for i, col in enumerate(self.config.numerical_columns):
+            dataframe[col] = scaled[:, i].astype(dtype, copy=False)
+
         logger.info("Numeric Features Scaled Successfully!")
         return dataframe
 
+    @memory_step
+    def downcast_numeric_columns(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        """
+        Downcast the remaining float64 columns to float32 in place (when config.downcast_numeric is set).
+        Integer columns are left alone so chunks of the same split always share one schema.
+
+        :param dataframe: The dataframe to downcast
+        :type dataframe: pd.DataFrame
+        :return: Dataframe with compact numeric columns
+        :rtype: pd.DataFrame
+        """
+
+        if self.config.downcast_numeric:
+            for col in dataframe.columns:
+                if dataframe[col].dtype == np.float64:
+                    dataframe[col] = dataframe[col].astype(np.float32)
+
+        return dataframe
+
+    @memory_step
     def fit_encoder(self, dataframe: pd.DataFrame):
         """
-        Fit LabelEncoders on all categorical columns and store them
+        Fit LabelEncoders on all categorical columns and store them.
+        The vocabulary is read from the category values, so the dataframe is not modified
+        and no per-row strings are built.
         
         :param dataframe: The dataframe to fit the encoders
         :type dataframe: pd.DataFrame
         """
         for col in self.config.categorical_columns:
             le = LabelEncoder()
-            dataframe[col] = dataframe[col].astype(str)
-            le.fit(dataframe[col])
+            le.fit(sorted(self.column_classes(dataframe[col])))
             self.encoders[col] = le
         logger.info("Label Encoders Fitted Successfully!")
+
+    @staticmethod
+    def column_classes(column: pd.Series) -> set:
+        """
+        Vocabulary of a column, read from the category values when the column is categorical.
+        Same as the values of the column cast to str, where missing values become 'nan'.
+        """
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes = column.cat.codes.to_numpy()
+            values = column.cat.categories[np.unique(codes[codes >= 0])]
+        else:
+            values = pd.unique(column.dropna())
+
+        classes = {str(value) for value in values}
+        if column.isna().any():
+            classes.add("nan")
+        return classes
+
+    @memory_step
+    def extend_encoders(self, dataframe: pd.DataFrame):
+        """
+        Add the categories of new data to the fitted encoders without renumbering.
+        Unseen categories are appended after the existing classes, so every existing code keeps
+        its value and models trained on the old codes stay valid. The classes are then no longer
+        sorted, which LabelEncoder requires, so an extended encoder becomes a CategoryEncoder.
+
+        :param dataframe: The new data
+        :type dataframe: pd.DataFrame
+        :return: The appended categories per column
+        :rtype: dict
+        """
+        added = {}
+        for col, le in self.encoders.items():
+            new_classes = sorted(self.column_classes(dataframe[col]) - set(le.classes_))
+            if new_classes:
+                self.encoders[col] = CategoryEncoder(np.concatenate([le.classes_, np.array(new_classes)]))
+                added[col] = new_classes
+
+        logger.info(f"Label Encoders Extended with New Categories: {added}")
+        return added
+
+    @memory_step
+    def update_scaler(self, dataframe: pd.DataFrame):
+        """
+        Update the fitted scaler statistics with new data (running mean and variance over
+        every row seen so far, without revisiting the old rows)
+
+        :param dataframe: The new data
+        :type dataframe: pd.DataFrame
+        """
+        self.scaler.partial_fit(dataframe[self.config.numerical_columns])
+        logger.info(f"Scaler Updated, {int(np.max(self.scaler.n_samples_seen_))} Rows Seen in Total")
     
 
 
+    def sample_background(self, dataframe: pd.DataFrame):
+        """
+        Keep a uniform random sample of raw feature rows, used by the API as the background
+        (baseline) dataset for explanations. Every row gets a random key and the rows with the
+        smallest keys are kept, so calling this once per chunk gives the same kind of sample
+        as one call on the full data.
+
+        :param dataframe: Raw (not yet encoded or scaled) data
+        :type dataframe: pd.DataFrame
+        """
+        size = self.config.background_size
+        keys = self._background_rng.random(len(dataframe))
+        take = np.argsort(keys)[:size]
+
+        columns = self.config.numerical_columns + self.config.categorical_columns
+        sample = dataframe.iloc[take][columns].reset_index(drop=True)
+        # categories are stored as the strings the encoders were fitted on
+        for col in self.config.categorical_columns:
+            sample[col] = sample[col].astype(str)
+        sample["_key"] = keys[take]
+
+        if self.background is not None:
+            sample = pd.concat([self.background, sample], ignore_index=True)
+        self.background = sample.nsmallest(size, "_key").reset_index(drop=True)
+
+
+    def save_background(self):
+        """
+        Saves the sampled background rows to disk
+        """
+        background_path = Path(self.config.root_dir) / "background.joblib"
+        joblib.dump(self.background.drop(columns="_key"), background_path)
+
+        logger.info(f"Background sample of {len(self.background)} rows saved at {background_path}")
+
+
+    def scaling(self) -> tuple:
+        """
+        Per-column (mean, scale) the scaler applies, with 0 and 1 where it does not center or scale
+        """
+        n_columns = len(self.config.numerical_columns)
+        mean = np.array(self.scaler.mean_, dtype=np.float64) if self.scaler.with_mean else np.zeros(n_columns)
+        scale = np.array(self.scaler.scale_, dtype=np.float64) if self.scaler.with_std else np.ones(n_columns)
+        return mean, scale
+
+
+    # ------------------ Training history ------------------ #
+    def incremental_rows_path(self) -> Path:
+        """
+        Raw rows added by incremental updates, kept so they stay part of the training data
+        """
+        return Path(self.config.root_dir) / "incremental_rows.csv"
+
+    def training_data_paths(self) -> list:
+        """
+        Raw files holding the training data: the configured file plus the rows of earlier updates
+        """
+        paths = [Path(self.config.train_data_file_path)]
+        if self.incremental_rows_path().exists():
+            paths.append(self.incremental_rows_path())
+        return paths
+
+    def load_incremental_rows(self):
+        """
+        Loads the raw rows of earlier incremental updates
+
+        :return: The rows, or None if no update has been applied
+        :rtype: pd.DataFrame | None
+        """
+        if not self.incremental_rows_path().exists():
+            return None
+        return pd.read_csv(self.incremental_rows_path(), dtype=self.raw_dtypes())
+
+    def append_incremental_rows(self, dataframe: pd.DataFrame):
+        """
+        Appends the raw rows of an update to the training history, in the column order of the
+        configured training file so every history file streams with one schema
+
+        :param dataframe: Raw (not yet transformed) rows
+        :type dataframe: pd.DataFrame
+        """
+        columns = pd.read_csv(self.config.train_data_file_path, nrows=0).columns
+        path = self.incremental_rows_path()
+        dataframe.reindex(columns=columns).to_csv(path, mode="a", header=not path.exists(), index=False)
+
+        logger.info(f"{len(dataframe)} Rows Added to the Training History - {path}")
+
+    def retained_sample_path(self) -> Path:
+        return Path(self.config.root_dir) / "retained_sample.joblib"
+
+    def load_retained_sample(self, size: int, seed: int = 42) -> dict:
+        """
+        Uniform random sample of the raw training history used by incremental updates. Every row
+        gets a random key and the rows with the smallest keys are kept (as in sample_background),
+        so the sample is maintained across updates without reading the history again. It is
+        built with one chunked pass over the training data the first time it is needed.
+
+        :param size: Rows to keep
+        :param seed: Seed of the random keys
+        :return: {"rows": sampled raw rows with their _key, "history_rows": rows sampled from}
+        :rtype: dict
+        """
+        if self.retained_sample_path().exists():
+            retained = joblib.load(self.retained_sample_path())
+            # still valid unless retained_rows was raised since it was drawn
+            if len(retained["rows"]) >= min(size, retained["history_rows"]):
+                return retained
+
+        rng = np.random.default_rng(seed)
+        sample, history_rows = None, 0
+        for chunk in self.raw_chunks(self.training_data_paths()):
+            history_rows += len(chunk)
+            chunk["_key"] = rng.random(len(chunk))
+            chunk = chunk.nsmallest(size, "_key")
+            sample = chunk if sample is None else pd.concat([sample, chunk], ignore_index=True).nsmallest(size, "_key")
+
+        logger.info(f"Sampled {len(sample)} of {history_rows} Rows of the Training History")
+        return {"rows": sample.reset_index(drop=True), "history_rows": history_rows}
+
+    def save_retained_sample(self, retained: dict, new_rows: pd.DataFrame, size: int, seed: int = 42):
+        """
+        Adds the raw rows of an update to the retained sample and saves it. The new rows get
+        random keys too, so the sample stays uniform over the whole history.
+
+        :param retained: The sample returned by load_retained_sample
+        :param new_rows: Raw rows of the update
+        :param size: Rows to keep
+        :param seed: Seed of the random keys (combined with the history size, so every update draws new keys)
+        """
+        history_rows = retained["history_rows"]
+        new_rows = new_rows.copy()
+        new_rows["_key"] = np.random.default_rng([seed, history_rows]).random(len(new_rows))
+
+        rows = pd.concat([retained["rows"], new_rows], ignore_index=True).nsmallest(size, "_key")
+        joblib.dump({"rows": rows.reset_index(drop=True), "history_rows": history_rows + len(new_rows)},
+                    self.retained_sample_path())
+
+        logger.info(f"Retained Sample of {len(rows)} Rows saved at {self.retained_sample_path()}")
+
+    def clear_retained_sample(self):
+        """
+        Drops the retained sample when the encoders and scaler are refitted from the training data,
+        which may have changed since it was drawn
+        """
+        self.retained_sample_path().unlink(missing_ok=True)
+
+
     def save_scaler(self):
         """
         Saves the fitted scaler to disk
@@ -116,9 +406,12 @@ class DataTransformation:
         logger.info(f"Scaler saved at {scaler_path}")
 
 
+    @memory_step
     def encode_categorical_columns(self, dataframe: pd.DataFrame) -> pd.DataFrame:
         """
-        Encode categorical columns using fitted LabelEncoders
+        Encode categorical columns in place using fitted LabelEncoders.
+        Each category is looked up once and the pandas category codes are mapped through
+        that table into the smallest integer dtype. Unseen categories become -1.
         
         :param dataframe: The dataframe to encode
         :type dataframe: pd.DataFrame
@@ -126,36 +419,143 @@ class DataTransformation:
         :rtype: pd.DataFrame
         """
 
-        dataframe = dataframe.copy()
-
         for col, le in self.encoders.items():
-            dataframe[col] = dataframe[col].astype(str)
+            column = dataframe[col]
+            if not isinstance(column.dtype, pd.CategoricalDtype):
+                column = column.astype('category')
 
-            known = dataframe[col].isin(le.classes_)
-            dataframe.loc[known, col] = le.transform(dataframe.loc[known, col])
-            dataframe.loc[~known, col] = -1
+            lookup = {value: code for code, value in enumerate(le.classes_)}
+            dtype = self.code_dtype(len(le.classes_))
 
-            dataframe[col] = dataframe[col].astype(int)
+            # one entry per category, plus a trailing slot for missing values (category code -1)
+            table = np.array(
+                [lookup.get(str(value), -1) for value in column.cat.categories] + [lookup.get("nan", -1)],
+                dtype=dtype
+            )
+            dataframe[col] = table[column.cat.codes.to_numpy()]
 
         logger.info("Categorical Encoding Complete!")
         return dataframe
     
 
 
+    def transformed_data_path(self, split: str) -> Path:
+        """
+        Path of a transformed split in the configured data format
+
+        :param split: The split name (train, val or test)
+        :type split: str
+        :return: Destination path inside the transformation artifacts directory
+        :rtype: Path
+        """
+        return dataset_path(Path(self.config.root_dir) / split, self.config.data_format)
+
+    @memory_step
     def save_transformed_data(self, dataframe: pd.DataFrame, file_path: Path):
         """
-        Save the transformed dataframe to a CSV file
+        Save the transformed dataframe in the format given by the file extension (parquet or csv)
         
         :param dataframe: The dataframe to save
         :type dataframe: pd.DataFrame
-        :param file_path: Path to save the transformed CSV
+        :param file_path: Path to save the transformed data
         :type file_path: Path
         """
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        dataframe.to_csv(file_path, index=False)
+        save_dataframe(dataframe, file_path)
         logger.info(f"Successfully Saved the Transformed Data - {file_path}")
 
     
+    # ------------------ Streaming mode ------------------ #
+    def raw_dtypes(self) -> dict:
+        """
+        Dtypes used to read the raw CSV files, the same as in data ingestion, so every chunk has
+        the schema of the full dataframe
+
+        :return: Dtype per column
+        :rtype: dict
+        """
+        return raw_csv_dtypes(self.config.categorical_columns)
+
+    def raw_chunks(self, file_paths: list):
+        """
+        Chunks of one or more raw files, read with the raw dtypes
+
+        :param file_paths: The raw files, read one after the other
+        :return: Generator of dataframes
+        """
+        for file_path in file_paths:
+            yield from iter_dataframe_chunks(file_path, self.config.chunk_size, dtypes=self.raw_dtypes())
+
+    @memory_step
+    def fit_streaming(self, file_paths: list):
+        """
+        Fit the scaler and encoders in a single pass over the training data in chunks.
+        The scaler is fitted incrementally with partial_fit and the encoders from the union
+        of the categories observed in every chunk, which gives the same vocabularies
+        as fitting on the full dataframe.
+
+        :param file_paths: Paths to the raw training data (see training_data_paths)
+        :type file_paths: list
+        """
+        self.scaler = StandardScaler()
+        categories = {col: set() for col in self.config.categorical_columns}
+
+        n_rows = 0
+        for chunk in self.raw_chunks(file_paths):
+            self.scaler.partial_fit(chunk[self.config.numerical_columns])
+            self.sample_background(chunk)
+            for col in self.config.categorical_columns:
+                categories[col].update(str(value) for value in chunk[col].unique())
+            n_rows += len(chunk)
+
+        for col in self.config.categorical_columns:
+            le = LabelEncoder()
+            le.fit(sorted(categories[col]))
+            self.encoders[col] = le
+
+        logger.info(f"Scaler and Label Encoders Fitted on {n_rows} Rows in Chunks of {self.config.chunk_size}")
+
+    def transform_chunk(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        """
+        Apply the full transformation to one chunk with the fitted scaler and encoders
+
+        :param dataframe: A chunk of raw data
+        :type dataframe: pd.DataFrame
+        :return: The transformed chunk
+        :rtype: pd.DataFrame
+        """
+        dataframe = self.create_target_feature(dataframe)
+        dataframe = self.encode_categorical_columns(dataframe)
+        dataframe = self.scale_numeric_features(dataframe)
+        dataframe = self.downcast_numeric_columns(dataframe)
+        return dataframe
+
+    @memory_step
+    def transform_streaming(self, source_paths: list, destination_path: Path):
+        """
+        Transform a raw split chunk by chunk, writing each chunk straight to disk
+
+        :param source_paths: Paths to the raw data of the split
+        :type source_paths: list
+        :param destination_path: Path of the transformed dataset
+        :type destination_path: Path
+        """
+        with ChunkedDatasetWriter(destination_path) as writer:
+            for chunk in self.raw_chunks(source_paths):
+                writer.write(self.transform_chunk(chunk))
+
+        logger.info(f"Successfully Streamed {writer.rows_written} Transformed Rows - {destination_path}")
+
+
+    def load_fitted(self):
+        """
+        Loads the scaler and encoders saved by a previous run instead of refitting them
+        """
+        self.scaler = joblib.load(Path(self.config.root_dir) / "scaler.joblib")
+        self.encoders = joblib.load(Path(self.config.root_dir) / "label_encoders.joblib")
+
+        logger.info("Fitted Scaler and Label Encoders Loaded")
+
+
     def save_encoders(self):
         encoders_path = Path(self.config.root_dir) / "label_encoders.joblib"
         joblib.dump(self.encoders, encoders_path)
@@ -163,10 +563,11 @@ class DataTransformation:
 
     
     def save_feature_metadata(self):
+        # plain lists, not the config's BoxLists, so loading the metadata does not need box
         metadata = {
-            "categorical_columns": self.config.categorical_columns,
-            "numerical_columns": self.config.numerical_columns,
-            "target_column": self.config.target_column
+            "categorical_columns": list(self.config.categorical_columns),
+            "numerical_columns": list(self.config.numerical_columns),
+            "target_column": str(self.config.target_column)
         }
 
         metadata_path = Path(self.config.root_dir) / "feature_metadata.joblib"
@@ -174,3 +575,21 @@ class DataTransformation:
 
         logger.info("Feature metadata saved")
 
+
+    def save_memory_report(self, split: str):
+        """
+        Saves the memory measurements collected since the last save (when config.track_memory is
+        set) to memory_report_<split>.json; one file per split, as the splits may be transformed
+        concurrently
+
+        :param split: The split whose transformation was measured (train also holds the fitting steps)
+        """
+        if not self.memory_report:
+            return
+
+        report_path = Path(self.config.root_dir) / f"memory_report_{split}.json"
+        with open(report_path, "w") as file:
+            json.dump(self.memory_report, file, indent=2)
+        self.memory_report = []
+
+        logger.info(f"Memory report saved at {report_path}")
@@ -4,32 +4,144 @@ model_evaluation.py
 
 Orchestrates the model evaluation workflow:
 - Loads trained model
-- Evaluates the model performance
+- Evaluates the model performance, with bootstrap confidence intervals, overall and per segment
 - Logs the results to MLFlow
+
+The test set is scored once (labels are derived from the predicted probabilities). Every
+bootstrap resample is represented by its draw counts per test row, so all metrics of a chunk of
+resamples are computed together from one weight matrix: the confusion counts are matrix-vector
+products and ROC AUC is the weighted Mann-Whitney statistic over the rows sorted by probability.
+Chunks are spread over worker processes.
 """
 
 
 
 # libraries
+import json
+import time
+import warnings
+import numpy as np
 import pandas as pd
 import joblib
-import mlflow
-import mlflow.sklearn
 from pathlib import Path
-from sklearn.metrics import (
-    accuracy_score,
-    precision_score,
-    recall_score,
-    f1_score, roc_auc_score,
-    confusion_matrix
-)
+from joblib import Parallel, delayed
 from logger import logger
 from entity import ModelEvaluationConfig
+from utils import load_dataframe
+from instrumentation import instrument
 
 
 PARENT_ROOT = Path(__file__).resolve().parents[1]
 
+METRICS = ("accuracy", "precision", "recall", "f1_score", "roc_auc")
+
+# weight matrix entries (resamples x test rows) a worker holds at once
+BOOTSTRAP_BLOCK_SIZE = 1 << 22
+# resamples per chunk at most, so small test sets are still spread over the workers
+MAX_CHUNK_RESAMPLES = 100
+
+
+def tie_groups(y_prob):
+    """
+    Start of every run of equal probabilities (y_prob sorted ascending)
+    """
+    return np.flatnonzero(np.r_[True, y_prob[1:] != y_prob[:-1]])
+
+
+def weighted_metrics(weights, y_true, y_pred, groups):
+    """
+    Every metric of every resample, from the number of times each test row was drawn.
+    With weights of one this is the plain test set metric (as computed by sklearn, with
+    zero_division=0 for precision, recall and f1).
+
+    :param weights: (resamples, rows) draw counts, rows sorted by predicted probability
+    :param y_true: 0/1 float labels of the rows
+    :param y_pred: 0/1 float predictions of the rows
+    :param groups: Start of every run of tied probabilities (see tie_groups)
+    :return: (resamples, len(METRICS)) array, nan where a metric is undefined
+    :rtype: np.ndarray
+    """
+    total = weights.sum(axis=1)
+    positives = weights @ y_true
+    predicted = weights @ y_pred
+    true_positives = weights @ (y_true * y_pred)
+    negatives = total - positives
+
+    # Mann-Whitney: weighted share of (positive, negative) pairs in which the positive row has
+    # the higher probability, ties counting half
+    positive_groups = weights * y_true
+    if len(groups) < weights.shape[1]:
+        positive_groups = np.add.reduceat(positive_groups, groups, axis=1)
+        negative_groups = np.add.reduceat(weights, groups, axis=1) - positive_groups
+    else:  # no tied probabilities, every row is its own group
+        negative_groups = weights - positive_groups
+    negatives_below = np.cumsum(negative_groups, axis=1) - negative_groups
+    ranked_pairs = (positive_groups * (negatives_below + 0.5 * negative_groups)).sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        accuracy = (total - positives - predicted + 2 * true_positives) / total
+        precision = np.where(predicted > 0, true_positives / predicted, 0.0)
+        recall = np.where(positives > 0, true_positives / positives, 0.0)
+        f1 = np.where(positives + predicted > 0, 2 * true_positives / (positives + predicted), 0.0)
+        roc_auc = np.where((positives > 0) & (negatives > 0), ranked_pairs / (positives * negatives), np.nan)
+
+    return np.column_stack([accuracy, precision, recall, f1, roc_auc])
+
+
+def bootstrap_chunk(seed, n_resamples, y_true, y_pred, subsets):
+    """
+    Metrics of one chunk of bootstrap resamples, for the whole test set and every segment
+
+    :param seed: SeedSequence of the chunk
+    :param subsets: (rows, groups) per subset; rows None selects every row
+    :return: One (n_resamples, len(METRICS)) array per subset
+    :rtype: list
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = len(y_true)
+
+    # one row of drawn indices per resample, counted into draws per test row
+    indices = rng.integers(0, n_rows, size=(n_resamples, n_rows))
+    indices += np.arange(n_resamples)[:, None] * n_rows
+    weights = np.bincount(indices.ravel(), minlength=n_resamples * n_rows)
+    weights = weights.reshape(n_resamples, n_rows).astype(np.float64)
+    del indices
 
+    results = []
+    for rows, groups in subsets:
+        if rows is None:
+            results.append(weighted_metrics(weights, y_true, y_pred, groups))
+        else:
+            results.append(weighted_metrics(weights[:, rows], y_true[rows], y_pred[rows], groups))
+    return results
+
+
+def summarize(estimate, samples, confidence: float) -> dict:
+    """
+    Point estimate and percentile confidence interval of every metric (None where undefined)
+    """
+    with warnings.catch_warnings():
+        # all resamples nan, e.g. ROC AUC of a segment without positives
+        warnings.simplefilter("ignore", RuntimeWarning)
+        lower, upper = np.nanquantile(samples, [(1 - confidence) / 2, (1 + confidence) / 2], axis=0)
+
+    def value(x):
+        return None if np.isnan(x) else float(x)
+
+    return {
+        metric: {"value": value(estimate[i]), "ci_lower": value(lower[i]), "ci_upper": value(upper[i])}
+        for i, metric in enumerate(METRICS)
+    }
+
+
+def point_estimates(report: dict) -> dict:
+    """
+    Metric values of an evaluation report, without their intervals
+    """
+    return {metric: values["value"] for metric, values in report["metrics"].items()}
+
+
+@instrument()
 class ModelEvaluation:
     def __init__(self, config: ModelEvaluationConfig):
         """
@@ -48,9 +160,15 @@ class ModelEvaluation:
         return model
     
 
-    def load_evaluation_data(self):
+    def load_evaluation_data(self, columns: list = None):
+        """
+        Loads the evaluation dataset
+
+        :param columns: Columns to read (all columns if None)
+        :type columns: list
+        """
         data_path = PARENT_ROOT / self.config.eval_data_file_path
-        data = pd.read_csv(data_path)
+        data = load_dataframe(data_path, columns=columns)
 
         logger.info(f"Evaluation data loaded")
         return data
@@ -77,23 +195,139 @@ class ModelEvaluation:
 
     
 
-    def evaluate(self, model, X, y):
-        y_pred = model.predict(X)
-        y_prob = model.predict_proba(X)[:, 1]
+    def load_segment_labels(self) -> dict:
+        """
+        Category names of the segment columns, indexed by code (codes are kept as names when
+        the label encoders are not available)
+        """
+        if not self.config.encoders_path or not (PARENT_ROOT / self.config.encoders_path).exists():
+            return {}
+
+        encoders = joblib.load(PARENT_ROOT / self.config.encoders_path)
+        return {col: encoders[col].classes_ for col in self.config.segment_columns if col in encoders}
+
+
+    def evaluate(self, model, X, y, segments: pd.DataFrame = None):
+        """
+        Scores the evaluation set once and computes every metric with a bootstrap confidence
+        interval, for the whole set and for every segment
+
+        :param segments: Segment columns of the evaluation rows (encoded, as in the test split)
+        :return: Evaluation report (metrics, segments and bootstrap settings)
+        :rtype: dict
+        """
+        # a single predict_proba pass; labels follow from the probabilities, as in model.predict
+        probabilities = model.predict_proba(X)
+        positive = model.classes_[1]
+        y_pred = model.classes_[probabilities.argmax(axis=1)] == positive
+        y_prob = probabilities[:, 1]
+        y_true = np.asarray(y) == positive
+
+        # sorted by probability once, for the rank-based ROC AUC of every subset and resample
+        order = np.argsort(y_prob, kind="stable")
+        y_prob = y_prob[order]
+        y_true = y_true[order].astype(np.float64)
+        y_pred = y_pred[order].astype(np.float64)
 
-        metrics = {
-            "accuracy": accuracy_score(y, y_pred),
-            "precision": precision_score(y, y_pred),
-            "recall": recall_score(y, y_pred),
-            "f1_score": f1_score(y, y_pred),
-            "roc_auc": roc_auc_score(y, y_prob),
+        subsets = [(None, tie_groups(y_prob))]
+        segment_values = []
+        labels = self.load_segment_labels()
+        for column in ([] if segments is None else segments.columns):
+            codes = segments[column].to_numpy()[order]
+            names = labels.get(column)
+            for code in np.unique(codes):
+                rows = np.flatnonzero(codes == code)
+                subsets.append((rows, tie_groups(y_prob[rows])))
+                name = names[code] if names is not None and 0 <= code < len(names) else code
+                segment_values.append((column, str(name), rows))
+
+        estimates = [
+            weighted_metrics(np.ones((1, len(y_true))), y_true, y_pred, groups)[0] if rows is None
+            else weighted_metrics(np.ones((1, len(rows))), y_true[rows], y_pred[rows], groups)[0]
+            for rows, groups in subsets
+        ]
+
+        started = time.perf_counter()
+        samples = self.bootstrap(y_true, y_pred, subsets)
+        elapsed = time.perf_counter() - started
+
+        confidence = self.config.bootstrap.get("confidence", 0.95)
+        report = {
+            "count": len(y_true),
+            "positives": int(y_true.sum()),
+            "metrics": summarize(estimates[0], samples[0], confidence),
+            "segments": {},
+            "bootstrap": {
+                "n_resamples": len(samples[0]),
+                "confidence": confidence,
+                "random_state": self.config.bootstrap.get("random_state", 42),
+                "seconds": round(elapsed, 3),
+            },
         }
+        for (column, name, rows), estimate, sample in zip(segment_values, estimates[1:], samples[1:]):
+            report["segments"].setdefault(column, []).append({
+                "value": name,
+                "count": len(rows),
+                "positives": int(y_true[rows].sum()),
+                "metrics": summarize(estimate, sample, confidence),
+            })
+
+        logger.info(
+            f"Model evaluation metrics computed: {len(samples[0])} bootstrap resamples of {len(y_true)} rows "
+            f"and {len(segment_values)} segments in {elapsed:.2f}s"
+        )
+        return report
+
+
+    def bootstrap(self, y_true, y_pred, subsets) -> list:
+        """
+        Bootstrap distribution of every metric, computed in chunks of resamples on worker processes.
+        The chunks and their seeds depend only on the data size, so the result does not depend on
+        the number of workers.
 
-        logger.info("Model evaluation metrics computed")
-        return metrics
+        :return: One (resamples, len(METRICS)) array per subset
+        :rtype: list
+        """
+        settings = self.config.bootstrap
+        n_resamples = settings.get("n_resamples", 1000)
+        n_rows = len(y_true)
+
+        chunk = max(1, min(MAX_CHUNK_RESAMPLES, BOOTSTRAP_BLOCK_SIZE // n_rows))
+        sizes = [chunk] * (n_resamples // chunk) + ([n_resamples % chunk] if n_resamples % chunk else [])
+        seeds = np.random.SeedSequence(settings.get("random_state", 42)).spawn(len(sizes))
+
+        with Parallel(n_jobs=settings.get("n_jobs", -1) if len(sizes) > 1 else 1, backend="loky") as parallel:
+            chunks = parallel(
+                delayed(bootstrap_chunk)(seed, size, y_true, y_pred, subsets)
+                for seed, size in zip(seeds, sizes)
+            )
+
+        return [np.concatenate(parts) for parts in zip(*chunks)]
+
+
+    def save_metrics(self, report: dict):
+        """
+        Saves the evaluation metrics (metrics.json) and the full report with confidence intervals
+        and segment metrics (evaluation_report.json) next to the evaluation artifacts
+        """
+        root_dir = PARENT_ROOT / self.config.root_dir
+        metrics_path = root_dir / "metrics.json"
+        with open(metrics_path, "w") as file:
+            json.dump(point_estimates(report), file, indent=2, default=float)
+
+        report_path = root_dir / "evaluation_report.json"
+        with open(report_path, "w") as file:
+            json.dump(report, file, indent=2, default=float)
+
+        logger.info(f"Metrics saved at {metrics_path}, evaluation report at {report_path}")
+        return report_path
     
 
-    def log_to_mlflow(self, model, metrics: dict):
+    def log_to_mlflow(self, model, report: dict):
+        # imported here: mlflow takes seconds to import and is only needed by this step
+        import mlflow
+        import mlflow.sklearn
+
         mlflow.set_experiment(self.config.mlflow_experiment_name)
 
         with mlflow.start_run():
@@ -101,9 +335,18 @@ class ModelEvaluation:
             model_params = model.get_params()
             mlflow.log_params(model_params)
 
-            # Log evaluation metrics
-            mlflow.log_metrics(metrics)
-            mlflow.sklearn.log_model(model, artifact_path="model")
+            # Log evaluation metrics and the bounds of their confidence intervals
+            metrics = point_estimates(report)
+            for name, metric in report["metrics"].items():
+                metrics[f"{name}_ci_lower"] = metric["ci_lower"]
+                metrics[f"{name}_ci_upper"] = metric["ci_upper"]
+            mlflow.log_metrics({name: value for name, value in metrics.items() if value is not None})
+            mlflow.log_dict(report, "evaluation_report.json")
 
-            logger.info("Metrics and model logged to MLflow")
+            # pickled like model.joblib, so every model family of the search can be logged
+            mlflow.sklearn.log_model(
+                model, artifact_path="model",
+                serialization_format=mlflow.sklearn.SERIALIZATION_FORMAT_CLOUDPICKLE
+            )
 
+            logger.info("Metrics and model logged to MLflow")
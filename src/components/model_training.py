@@ -5,16 +5,26 @@ model_training.py
 Implements the model training component responsible for:
 - Loading transformed datasets
 - Splitting features and target
-- Training the model
+- Training the model (or searching over several model families)
 - Saving the trained model
 """
 
 
 # libraries
+import json
+import math
+import tempfile
+import time
+import numpy as np
 import pandas as pd
-# from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
+from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+from joblib import Parallel, delayed
 from entity import ModelTrainingConfig
+from utils import load_dataframe
+from instrumentation import instrument
 from pathlib import Path
 import joblib
 from logger import logger
@@ -22,7 +32,71 @@ from logger import logger
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 
+# model families available to the hyperparameter search (see params.yaml)
+MODEL_FAMILIES = {
+    "LogisticRegression": LogisticRegression,
+    "SGDClassifier": SGDClassifier,
+    "RandomForestClassifier": RandomForestClassifier,
+    "HistGradientBoostingClassifier": HistGradientBoostingClassifier,
+}
 
+
+def build_model(family: str, params: dict, random_state: int = 42):
+    """
+    Instantiates a model of the given family
+
+    :param family: One of MODEL_FAMILIES
+    :param params: Hyperparameters of the candidate
+    :param random_state: Seed applied to families that accept one
+    :return: The unfitted estimator
+    """
+
+    if family not in MODEL_FAMILIES:
+        raise ValueError(f"Unknown model family: {family}. Expected one of {list(MODEL_FAMILIES)}")
+
+    model = MODEL_FAMILIES[family](**params)
+    if "random_state" in model.get_params():
+        model.set_params(random_state=random_state)
+    return model
+
+
+def fit_candidate(family: str, params: dict, data_dir: str, feature_names: list, n_rows: int,
+                  scoring: str, random_state: int = 42, return_model: bool = False):
+    """
+    Fits one search candidate on the first n_rows training rows and scores it on the
+    validation split. Runs in a worker process: the arrays are memory-mapped from data_dir,
+    so the workers share the same pages instead of receiving a pickled copy per task.
+
+    :return: The candidate record, and the fitted model if return_model is set
+    :rtype: tuple[dict, object]
+    """
+
+    data_dir = Path(data_dir)
+    x_train = np.load(data_dir / "x_train.npy", mmap_mode="r")
+    y_train = np.load(data_dir / "y_train.npy", mmap_mode="r")
+    x_val = np.load(data_dir / "x_val.npy", mmap_mode="r")
+    y_val = np.load(data_dir / "y_val.npy", mmap_mode="r")
+
+    record = {"family": family, "params": params, "n_rows": n_rows}
+    started = time.perf_counter()
+
+    try:
+        model = build_model(family, params, random_state)
+        # the frames wrap the memory-mapped arrays, keeping the feature names on the model
+        model.fit(pd.DataFrame(x_train[:n_rows], columns=feature_names), y_train[:n_rows])
+        score = get_scorer(scoring)(model, pd.DataFrame(x_val, columns=feature_names), y_val)
+        record["score"] = float(score)
+    except Exception as e:
+        # a failing candidate (e.g. an invalid combination) is ranked last instead of failing the search
+        model = None
+        record["score"] = float("nan")
+        record["error"] = str(e)
+
+    record["fit_seconds"] = time.perf_counter() - started
+    return record, model if return_model else None
+
+
+@instrument()
 class ModelTraining:
     def __init__(self, config: ModelTrainingConfig):
         """
@@ -34,18 +108,22 @@ class ModelTraining:
 
         self.config = config
         self.model = None
+        self.search_results = None
 
     def load_transformed_data(self):
         """
-        Loads the transformed train, validation, and test datasets
+        Loads the transformed train, validation, and test datasets,
+        reading only the model features and the target column
 
         :return: Train, validation, and test DataFrames
         :rtype: tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]
         """
 
-        train_data = pd.read_csv(PROJECT_ROOT / self.config.train_data_file_path)
-        val_data = pd.read_csv(PROJECT_ROOT / self.config.val_data_file_path)
-        test_data = pd.read_csv(PROJECT_ROOT / self.config.test_data_file_path)
+        columns = list(self.config.model_features) + [self.config.target_column]
+
+        train_data = load_dataframe(PROJECT_ROOT / self.config.train_data_file_path, columns=columns)
+        val_data = load_dataframe(PROJECT_ROOT / self.config.val_data_file_path, columns=columns)
+        test_data = load_dataframe(PROJECT_ROOT / self.config.test_data_file_path, columns=columns)
 
         logger.info("Transformed datasets loaded successfully")
 
@@ -96,6 +174,272 @@ class ModelTraining:
         logger.info("Model Training Completed Successfully")
 
     
+    def generate_candidates(self) -> list:
+        """
+        Expands the configured model families into search candidates
+
+        :return: (family, params) pairs
+        :rtype: list
+        """
+
+        search = self.config.search
+        candidates = []
+
+        for family, grid in search.get("families", {}).items():
+            grid = {name: list(values) for name, values in grid.items()}
+
+            if search.get("strategy", "grid") == "random":
+                sampled = ParameterSampler(grid, n_iter=search.get("n_iter", 10),
+                                           random_state=search.get("random_state", 42))
+                # sampling a small grid without replacement can return duplicates
+                params_list = list({json.dumps(params, sort_keys=True): params for params in sampled}.values())
+            else:
+                params_list = list(ParameterGrid(grid))
+
+            candidates.extend((family, params) for params in params_list)
+
+        if not candidates:
+            raise ValueError("The model search is enabled but no model families are configured")
+
+        return candidates
+
+
+    def search_models(self, x_train: pd.DataFrame, y_train: pd.Series, x_val: pd.DataFrame, y_val: pd.Series):
+        """
+        Searches the configured model families in parallel and keeps the best model on the
+        validation split.
+
+        Poor candidates are stopped early with successive halving: every round fits the remaining
+        candidates on a growing sample of the training rows and keeps the best 1/halving_factor of
+        them. The last round fits the survivors on all training rows.
+
+        :param x_train: Training features
+        :param y_train: Training labels
+        :param x_val: Validation features
+        :param y_val: Validation labels
+        :return: Every candidate record, by round
+        :rtype: list
+        """
+
+        search = self.config.search
+        scoring = search.get("scoring", "roc_auc")
+        factor = search.get("halving_factor", 3)
+        random_state = search.get("random_state", 42)
+        n_jobs = search.get("n_jobs", -1)
+
+        candidates = self.generate_candidates()
+        n_total = len(x_train)
+
+        # number of rounds: until one candidate is left, or the first sample would get too small
+        n_rounds = max(1, min(
+            math.ceil(math.log(len(candidates), factor)) if len(candidates) > 1 else 1,
+            1 + int(math.log(1 / search.get("min_train_fraction", 0.1), factor))
+        ))
+
+        logger.info(f"Searching {len(candidates)} candidates in {n_rounds} rounds, scored by {scoring} on the validation split")
+
+        feature_names = list(x_train.columns)
+        history = []
+
+        with tempfile.TemporaryDirectory(prefix="model_search_") as data_dir:
+            # shuffled once, so every round's prefix of the training rows is a random sample
+            order = np.random.default_rng(random_state).permutation(n_total)
+            np.save(Path(data_dir) / "x_train.npy", x_train.to_numpy(dtype=np.float64)[order])
+            np.save(Path(data_dir) / "y_train.npy", y_train.to_numpy()[order])
+            np.save(Path(data_dir) / "x_val.npy", x_val.to_numpy(dtype=np.float64))
+            np.save(Path(data_dir) / "y_val.npy", y_val.to_numpy())
+
+            with Parallel(n_jobs=n_jobs, backend="loky") as parallel:
+                for round_index in range(n_rounds):
+                    last_round = round_index == n_rounds - 1
+                    n_rows = n_total if last_round else max(1, int(n_total / factor ** (n_rounds - 1 - round_index)))
+
+                    started = time.perf_counter()
+                    results = parallel(
+                        delayed(fit_candidate)(family, params, data_dir, feature_names, n_rows,
+                                               scoring, random_state, last_round)
+                        for family, params in candidates
+                    )
+                    elapsed = time.perf_counter() - started
+
+                    records = [record for record, _ in results]
+                    for record in records:
+                        record["round"] = round_index
+                    history.extend(records)
+
+                    logger.info(
+                        f"Round {round_index + 1}/{n_rounds}: {len(candidates)} candidates on {n_rows} rows "
+                        f"in {elapsed:.2f}s ({60 * len(candidates) / elapsed:.1f} candidates/min)"
+                    )
+
+                    ranking = sorted(range(len(results)), key=lambda i: -np.nan_to_num(records[i]["score"], nan=-np.inf))
+
+                    if last_round:
+                        best_record, best_model = results[ranking[0]]
+                    else:
+                        keep = ranking[:max(1, math.ceil(len(candidates) / factor))]
+                        candidates = [candidates[i] for i in keep]
+
+        if best_model is None:
+            raise RuntimeError(f"Every search candidate failed, last error: {best_record.get('error')}")
+
+        self.model = best_model
+        self.search_results = {"scoring": scoring, "best": best_record, "history": history}
+
+        logger.info(f"Best candidate: {best_record['family']} {best_record['params']} - validation {scoring} {best_record['score']:.4f}")
+
+        return history
+
+
+    def save_search_results(self):
+        """
+        Saves the search leaderboard next to the model
+        """
+
+        results_path = Path(self.config.root_dir) / "search_results.json"
+        with open(results_path, "w") as file:
+            json.dump(self.search_results, file, indent=2)
+
+        logger.info(f"Search results saved - {results_path}")
+        return results_path
+
+
+    def load_model(self):
+        """
+        Loads the previously trained model from disk
+        """
+
+        model_path = Path(self.config.root_dir) / self.config.model_name
+        self.model = joblib.load(model_path)
+
+        logger.info(f"Model Loaded - {model_path}")
+        return self.model
+
+
+    def rescale_model(self, columns: list, old_mean, old_scale, new_mean, new_scale):
+        """
+        Re-expresses the loaded model in the space of an updated scaler, so it scores raw inputs
+        exactly as before the scaler changed: a scaled value x' = (x - new_mean) / new_scale
+        equals (x_old * old_scale + old_mean - new_mean) / new_scale.
+        - linear models: each weight is multiplied by new_scale / old_scale and the intercept
+          absorbs the shift of the means
+        - RandomForestClassifier: the split thresholds are mapped into the new space
+
+        :param columns: The scaled columns, in the order of the scaler statistics
+        :param old_mean: Means the model was trained with (0 where the scaler does not center)
+        :param old_scale: Scales the model was trained with (1 where the scaler does not scale)
+        :param new_mean: Means of the updated scaler
+        :param new_scale: Scales of the updated scaler
+        """
+
+        features = list(self.model.feature_names_in_)
+        # (model feature index, scaler column index) of every scaled feature the model uses
+        pairs = [(features.index(col), k) for k, col in enumerate(columns) if col in features]
+
+        if hasattr(self.model, "coef_"):
+            coef = np.array(self.model.coef_, dtype=np.float64)
+            intercept = np.array(self.model.intercept_, dtype=np.float64)
+            for j, k in pairs:
+                intercept += coef[:, j] * (new_mean[k] - old_mean[k]) / old_scale[k]
+                coef[:, j] *= new_scale[k] / old_scale[k]
+            self.model.coef_, self.model.intercept_ = coef, intercept
+
+        elif isinstance(self.model, RandomForestClassifier):
+            for tree in self.model.estimators_:
+                # writes through to the fitted tree's node array
+                feature, threshold = tree.tree_.feature, tree.tree_.threshold
+                for j, k in pairs:
+                    nodes = feature == j
+                    threshold[nodes] = (threshold[nodes] * old_scale[k] + old_mean[k] - new_mean[k]) / new_scale[k]
+
+        else:
+            raise ValueError(f"{type(self.model).__name__} does not support incremental updates, retrain it from scratch")
+
+        logger.info(f"Model Re-expressed in the Updated Scaler Space for {len(pairs)} Features")
+
+
+    def update_model(self, x_new: pd.DataFrame, y_new: pd.Series, x_retained: pd.DataFrame = None,
+                     y_retained: pd.Series = None, retained_weight: float = 1.0):
+        """
+        Updates the loaded model with new rows, instead of refitting on the full history.
+        The model must already be in the space of the current scaler (see rescale_model):
+        - estimators with partial_fit (e.g. SGDClassifier) take one more pass over the new rows.
+          class_weight='balanced' is replaced by explicit weights estimated from the labels of the
+          retained sample and the new rows, since partial_fit would otherwise balance each update
+          on its own labels
+        - LogisticRegression has no partial_fit: it is refitted on the new rows plus the retained
+          sample of the training history, whose rows are weighted by retained_weight so the fit
+          approximates the objective over the full history. The cost is bounded by the sample size,
+          not by the history. warm_start only seeds the lbfgs solver with the current coefficients
+        - RandomForestClassifier keeps its trees and grows additional ones on the new rows
+
+        :param x_new: Features of the new rows
+        :param y_new: Labels of the new rows
+        :param x_retained: Features of a uniform sample of the training history
+        :param y_retained: Labels of the retained sample
+        :param retained_weight: Training history rows each retained row stands for
+        """
+
+        incremental = self.config.incremental
+        started = time.perf_counter()
+
+        if hasattr(self.model, "partial_fit"):
+            if self.model.get_params().get("class_weight") == "balanced":
+                self.model.set_params(class_weight=self.balanced_class_weight(
+                    [y_new] if y_retained is None else [y_retained, y_new],
+                    [1.0] if y_retained is None else [retained_weight, 1.0]
+                ))
+            self.model.partial_fit(x_new, y_new, classes=self.model.classes_)
+
+        elif isinstance(self.model, LogisticRegression):
+            sample_weight = np.ones(len(x_new))
+            if x_retained is not None:
+                x_new = pd.concat([x_retained, x_new], ignore_index=True)
+                y_new = pd.concat([y_retained, y_new], ignore_index=True)
+                sample_weight = np.concatenate([np.full(len(x_retained), retained_weight), sample_weight])
+            else:
+                logger.warning("No retained training rows: LogisticRegression is refitted on the new rows only")
+
+            if y_new.nunique() < 2:
+                raise ValueError("Refitting LogisticRegression needs both classes in the new data")
+
+            self.model.set_params(warm_start=True, max_iter=incremental.get("max_iter", 100))
+            self.model.fit(x_new, y_new, sample_weight=sample_weight)
+
+        elif isinstance(self.model, RandomForestClassifier):
+            n_estimators = self.model.n_estimators + incremental.get("n_estimators", 50)
+            self.model.set_params(warm_start=True, n_estimators=n_estimators)
+            self.model.fit(x_new, y_new)
+
+        else:
+            raise ValueError(f"{type(self.model).__name__} does not support incremental updates, retrain it from scratch")
+
+        logger.info(f"Model Updated on {len(x_new)} Rows in {time.perf_counter() - started:.2f}s")
+
+
+    def balanced_class_weight(self, label_sets: list, weights: list) -> dict:
+        """
+        Explicit 'balanced' class weights, n_samples / (n_classes * n_samples_of_class), from
+        weighted label counts
+
+        :param label_sets: Label series
+        :param weights: Rows each label of the matching series stands for
+        :return: Weight per class of the model
+        :rtype: dict
+        """
+        counts = {label.item() if isinstance(label, np.generic) else label: 0.0 for label in self.model.classes_}
+        for labels, weight in zip(label_sets, weights):
+            for label, count in labels.value_counts().items():
+                label = label.item() if isinstance(label, np.generic) else label
+                counts[label] = counts.get(label, 0.0) + weight * count
+
+        total = sum(counts.values())
+        class_weight = {label: total / (len(counts) * count) if count else 1.0 for label, count in counts.items()}
+
+        logger.info(f"Balanced Class Weights for the Update: {class_weight}")
+        return class_weight
+
+
     def save_model(self):
         """
         Saves the trained model to disk
@@ -8,7 +8,7 @@ Configs the entities of the pipeline
 
 # importing libraries
 from logging import config
-from utils import create_dictionaries, read_yaml
+from utils import create_dictionaries, read_yaml, dataset_path
 from entity import DataIngestionConfig, DataTransformationConfig, ModelTrainingConfig, ModelEvaluationConfig
 
 from pathlib import Path
@@ -18,15 +18,15 @@ from box import ConfigBox
 
 # defining the constants
 CONFIG_FILE_PATH = Path('config.yaml')
-# PARAM_FILE_PATH = Path('params.yaml')
+PARAM_FILE_PATH = Path('params.yaml')
 # SCHEMA_FILE_PATH = Path('schema.yaml')
 
 
 
 class ConfigurationManager:
-    def __init__(self, config_path=CONFIG_FILE_PATH):
+    def __init__(self, config_path=CONFIG_FILE_PATH, param_path=PARAM_FILE_PATH):
         self.config = read_yaml(config_path)
-        # self.param = read_yaml(param_path)
+        self.params = read_yaml(param_path)
         # self.schema = read_yaml(schema_path)
 
     def get_data_ingestion_config(self) -> ConfigBox:
@@ -45,7 +45,8 @@ class ConfigurationManager:
             root_dir=config.root_dir,
             train_data_file_path=config.train_data_file_path,
             val_data_file_path=config.val_data_file_path,
-            test_data_file_path=config.test_data_file_path
+            test_data_file_path=config.test_data_file_path,
+            categorical_columns=list(self.config.data_transformation.categorical_columns)
         )
 
         return data_ingestion_config
@@ -70,7 +71,13 @@ class ConfigurationManager:
             test_data_file_path=Path(config.test_data_file_path),
             categorical_columns=config.categorical_columns,
             numerical_columns=config.numerical_columns,
-            target_column=config.target_column
+            target_column=config.target_column,
+            data_format=self.config.data_format,
+            streaming=config.get("streaming", False),
+            chunk_size=config.get("chunk_size", 100000),
+            downcast_numeric=config.get("downcast_numeric", True),
+            track_memory=config.get("track_memory", False),
+            background_size=config.get("background_size", 100)
         )
 
         return data_transformation_config
@@ -93,13 +100,15 @@ class ConfigurationManager:
 
         model_training_config = ModelTrainingConfig(
             root_dir=root_dir,
-            train_data_file_path=Path(config.train_data_file_path),
-            val_data_file_path=Path(config.val_data_file_path),
-            test_data_file_path=Path(config.test_data_file_path),
+            train_data_file_path=dataset_path(config.train_data_file_path, self.config.data_format),
+            val_data_file_path=dataset_path(config.val_data_file_path, self.config.data_format),
+            test_data_file_path=dataset_path(config.test_data_file_path, self.config.data_format),
             model_name=config.model_name,
             target_column=config.target_column,
             model_features=config.model_features,
-            scaled_features=config.scaled_features
+            scaled_features=config.scaled_features,
+            search=self.params.get("model_search", {}),
+            incremental=self.params.get("incremental_training", {})
         )
 
         return model_training_config
@@ -116,9 +125,12 @@ class ConfigurationManager:
         model_evaluation_config = ModelEvaluationConfig(
             root_dir=config.root_dir,
             model_path=config.model_path,
-            eval_data_file_path=config.eval_data_file_path,
+            eval_data_file_path=dataset_path(config.eval_data_file_path, self.config.data_format),
             target_column=config.target_column,
-            mlflow_experiment_name=config.mlflow_experiment_name
+            mlflow_experiment_name=config.mlflow_experiment_name,
+            encoders_path=config.get("encoders_path"),
+            segment_columns=config.get("segment_columns", []),
+            bootstrap=self.params.get("model_evaluation", {})
         )
 
         return model_evaluation_config
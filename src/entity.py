@@ -7,7 +7,7 @@ Implements the entities for the various components of the implementation pipelin
 
 
 # libraries
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import List
 
@@ -20,6 +20,7 @@ class DataIngestionConfig:
     train_data_file_path: Path
     val_data_file_path: Path
     test_data_file_path: Path
+    categorical_columns: List[str] = field(default_factory=list)
 
 @dataclass
 class DataTransformationConfig:
@@ -30,6 +31,12 @@ class DataTransformationConfig:
     categorical_columns: List[str]
     numerical_columns: List[str]
     target_column: str
+    data_format: str
+    streaming: bool = False
+    chunk_size: int = 100000
+    downcast_numeric: bool = True
+    track_memory: bool = False
+    background_size: int = 100
 
 
 @dataclass
@@ -42,6 +49,8 @@ class ModelTrainingConfig:
     target_column: str
     model_features: List[str]
     scaled_features: List[str]
+    search: dict = field(default_factory=dict)
+    incremental: dict = field(default_factory=dict)
 
 @dataclass
 class ModelEvaluationConfig:
@@ -50,4 +59,7 @@ class ModelEvaluationConfig:
     eval_data_file_path: Path
     target_column: str
     mlflow_experiment_name: str
+    encoders_path: Path = None
+    segment_columns: List[str] = field(default_factory=list)
+    bootstrap: dict = field(default_factory=dict)
 
@@ -0,0 +1,316 @@
+"""
+instrumentation.py
+===================
+
+Timing spans, Prometheus-format metrics and opt-in profiling.
+
+- span(component, name) times a block into the span_duration_seconds histogram, and
+  instrument(component) wraps every method of a class in a span named after the method.
+- MetricsRegistry holds counters and histograms and renders them in the Prometheus text
+  exposition format (served on the API's /metrics, written to a textfile for pipeline runs).
+- profile_call runs a function under cProfile and saves the stats, and StackSampler samples the
+  stacks of every thread (or of the threads working for one request) to see where a running
+  server spends its time.
+"""
+
+
+# libraries
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+
+from logger import logger
+
+
+PROFILE_DIR = Path(os.getenv("RISK_PROFILE_DIR", Path(__file__).resolve().parent / "logs" / "profiles"))
+
+# thread ids working for the request being profiled; worker threads join it on entering a span
+profiled_threads = ContextVar("profiled_threads", default=None)
+
+# upper bounds (seconds) of the latency histogram buckets, from 50us to 60s
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+# ------------------ Metrics ------------------ #
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value:.17g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket (+Inf last), sum]
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def summary(self) -> dict:
+        """
+        Count and total of every label set
+        """
+        with self._lock:
+            return {label_values: (sum(counts), total) for label_values, (counts, total) in self.values.items()}
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{self.name}_bucket{format_labels(self.labels + ('le',), label_values + (le,))} {cumulative}")
+                labels = format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {total:.17g}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labels, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, labels, **kwargs)
+            elif not isinstance(metric, cls) or metric.labels != tuple(labels):
+                raise ValueError(f"Metric {name} is already registered with another type or labels")
+            return metric
+
+    def counter(self, name: str, documentation: str, labels=()) -> Counter:
+        return self._register(Counter, name, documentation, labels)
+
+    def histogram(self, name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labels, buckets=buckets)
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+    def write_textfile(self, path):
+        """
+        Write the metrics for the node_exporter textfile collector (renamed into place)
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(self.render())
+        tmp_path.replace(path)
+
+
+metrics = MetricsRegistry()
+
+span_duration = metrics.histogram(
+    "span_duration_seconds", "Wall time of instrumented pipeline steps and request phases", ("component", "span")
+)
+
+
+# ------------------ Spans ------------------ #
+@contextmanager
+def span(component: str, name: str):
+    """
+    Time a block into span_duration_seconds{component, span}
+    """
+    join_profiled_threads()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        span_duration.observe(time.perf_counter() - started, component, name)
+
+
+def timed(component: str, name: str = None):
+    """
+    Decorator version of span (the span is named after the function by default)
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            join_profiled_threads()
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                span_duration.observe(time.perf_counter() - started, component, span_name)
+
+        return wrapper
+
+    return decorator
+
+
+def instrument(component: str = None):
+    """
+    Class decorator wrapping every method defined on the class (dunder methods excepted) in a span
+    """
+    def decorator(cls):
+        name = component or cls.__name__
+        for attribute, value in list(vars(cls).items()):
+            if attribute.startswith("__"):
+                continue
+            if isinstance(value, staticmethod):
+                setattr(cls, attribute, staticmethod(timed(name, attribute)(value.__func__)))
+            elif isinstance(value, classmethod):
+                setattr(cls, attribute, classmethod(timed(name, attribute)(value.__func__)))
+            elif callable(value):
+                setattr(cls, attribute, timed(name, attribute)(value))
+        return cls
+
+    return decorator
+
+
+def span_report(component: str = None) -> list:
+    """
+    Calls and total seconds per span, slowest first
+    """
+    rows = [
+        {"component": labels[0], "span": labels[1], "calls": count, "seconds": total}
+        for labels, (count, total) in span_duration.summary().items()
+        if component is None or labels[0] == component
+    ]
+    return sorted(rows, key=lambda row: row["seconds"], reverse=True)
+
+
+def log_span_report(component: str = None, limit: int = 20):
+    rows = span_report(component)
+    if not rows:
+        return
+
+    logger.info("Span timings:")
+    for row in rows[:limit]:
+        logger.info(f"  {row['component'] + '.' + row['span']:<48} {row['calls']:>8} calls {row['seconds']:10.3f}s")
+
+
+# ------------------ Profiling ------------------ #
+def profile_call(name: str, func, *args, **kwargs):
+    """
+    Run a function under cProfile, save the stats to PROFILE_DIR/<name>-<time>.prof and log the
+    hottest functions (module level, so it can be submitted to a process pool)
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        path = PROFILE_DIR / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof"
+        profiler.dump_stats(path)
+
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(15)
+        logger.info(f"Profile of {name} saved - {path}\n{summary.getvalue()}")
+
+
+def join_profiled_threads():
+    """
+    Add the current thread to the threads of the request being profiled, if any. The context is
+    copied into the thread pool, so a worker thread scoring a profiled request joins its profile.
+    """
+    threads = profiled_threads.get()
+    if threads is not None:
+        threads.add(threading.get_ident())
+
+
+class StackSampler:
+    """
+    Samples the Python stacks of every thread at a fixed interval, without tracing overhead.
+    The result is in the folded format of flame graph tools (frames separated by ';', then the
+    number of samples).
+
+    With thread_ids, only those threads are sampled. The set may grow while sampling (see
+    join_profiled_threads).
+    """
+
+    def __init__(self, interval: float = 0.005, thread_ids: set = None):
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.samples = StackCounter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
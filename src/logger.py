@@ -3,30 +3,231 @@ logger.py
 ==========
 
 Custom logging setup
+
+By default records are handed to a queue and written by a background listener thread, so the
+calling thread (e.g. the API request path) never waits on disk or stdout. The listener writes
+in batches: output is flushed every RISK_LOG_BATCH_SIZE records and whenever the queue has been
+idle for RISK_LOG_FLUSH_INTERVAL seconds. The log file rotates at RISK_LOG_MAX_BYTES.
+
+Environment:
+    RISK_LOG_DIR                    log directory (default: src/logs, independent of the working directory)
+    RISK_LOG_LEVEL                  INFO
+    RISK_LOG_FORMAT                 'text' or 'json' (one JSON object per line)
+    RISK_LOG_ASYNC                  '1' (queue and listener thread) or '0' (write on the calling thread)
+    RISK_LOG_MAX_BYTES              size at which logging.log rotates (default 10 MB)
+    RISK_LOG_BACKUPS                rotated files kept (default 5)
+    RISK_LOG_BATCH_SIZE             records written between flushes (default 256)
+    RISK_LOG_FLUSH_INTERVAL         seconds of idleness after which pending records are flushed (default 1)
+    RISK_LOG_REQUEST_SAMPLE_RATE    share of successful API requests logged by request_logger (default 0)
 """
 
 # implementing the relevant libraries
 import os
 import sys
+import json
+import atexit
+import queue
+import random
 import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from multiprocessing.util import Finalize
+from pathlib import Path
 
 
 log_text = "[%(asctime)s: %(levelname)s: %(message)s]"
 
-# defining the logging file
-log_dir = 'logs'
-log_filepath = os.path.join(log_dir, 'logging.log')
+# defining the logging file (next to this module, not relative to the working directory)
+log_dir = Path(os.getenv("RISK_LOG_DIR", Path(__file__).resolve().parent / "logs"))
+log_filepath = log_dir / 'logging.log'
+
+LOG_LEVEL = os.getenv("RISK_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("RISK_LOG_FORMAT", "text")
+LOG_ASYNC = os.getenv("RISK_LOG_ASYNC", "1") == "1"
+LOG_MAX_BYTES = int(os.getenv("RISK_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("RISK_LOG_BACKUPS", "5"))
+LOG_BATCH_SIZE = int(os.getenv("RISK_LOG_BATCH_SIZE", "256"))
+LOG_FLUSH_INTERVAL = float(os.getenv("RISK_LOG_FLUSH_INTERVAL", "1.0"))
+REQUEST_SAMPLE_RATE = float(os.getenv("RISK_LOG_REQUEST_SAMPLE_RATE", "0"))
 
 os.makedirs(log_dir, exist_ok=True)
 
+# attributes every LogRecord has; anything else was passed through `extra`
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record, with any `extra` fields as top-level keys
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class BatchedStreamMixin:
+    """
+    Writes without flushing after every record; the listener calls flush_batch instead
+    """
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+    def close(self):
+        self.flush_batch()
+        super().close()
+
+
+class BatchedFileHandler(BatchedStreamMixin, RotatingFileHandler):
+    pass
+
+
+class BatchedStreamHandler(BatchedStreamMixin, logging.StreamHandler):
+    pass
+
+
+class LocalQueueHandler(QueueHandler):
+    """
+    Hands records to an in-process listener. Only the message is frozen on the calling thread;
+    formatting and I/O happen on the listener thread.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class BatchingQueueListener(QueueListener):
+    """
+    Flushes its handlers every batch_size records and whenever the queue has been idle for
+    flush_interval seconds
+    """
+
+    def __init__(self, log_queue, *handlers, batch_size: int = 256, flush_interval: float = 1.0):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = 0
+        # held while writing, so a fork never copies a half-written buffer
+        self.io_lock = threading.Lock()
+
+    def flush(self):
+        with self.io_lock:
+            self._flush()
+
+    def _flush(self):
+        for handler in self.handlers:
+            handler.flush_batch()
+        self.pending = 0
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_interval if block else None)
+            except queue.Empty:
+                if self.pending:
+                    self.flush()
+                if not block:
+                    raise
+
+    def handle(self, record):
+        with self.io_lock:
+            super().handle(record)
+            self.pending += 1
+            if self.pending >= self.batch_size or record.levelno >= logging.ERROR:
+                self._flush()
+
+    def before_fork(self):
+        # the child must not inherit records that are buffered but not yet written
+        self.io_lock.acquire()
+        self._flush()
+
+    def after_fork_in_parent(self):
+        self.io_lock.release()
+
+    def after_fork_in_child(self):
+        """
+        Give a forked child its own queue and listener thread (threads do not survive a fork)
+        """
+        self.io_lock = threading.Lock()
+        self.queue = queue.SimpleQueue()
+        self._thread = None
+        self.start()
+        Finalize(None, self.stop, exitpriority=100)
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+        self.flush()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes a random share of INFO/DEBUG records and every warning or error
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(log_text)
+
+# setting up the handlers
+file_handler = BatchedFileHandler(log_filepath, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+stream_handler = BatchedStreamHandler(sys.stdout)
+for handler in (file_handler, stream_handler):
+    handler.setFormatter(formatter)
+
+
+def restart_in_child():
+    listener.after_fork_in_child()
+    queue_handler.queue = listener.queue
+
+
+if LOG_ASYNC:
+    listener = BatchingQueueListener(queue.SimpleQueue(), file_handler, stream_handler,
+                                     batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL)
+    queue_handler = LocalQueueHandler(listener.queue)
+    listener.start()
+
+    # pending records are written when the interpreter (or a pool worker process) exits
+    atexit.register(listener.stop)
+    Finalize(None, listener.stop, exitpriority=100)
+    os.register_at_fork(before=listener.before_fork, after_in_parent=listener.after_fork_in_parent,
+                        after_in_child=restart_in_child)
+    handlers = [queue_handler]
+else:
+    # synchronous: flush after every record, as plain FileHandler/StreamHandler do
+    listener = None
+    file_handler.flush = file_handler.flush_batch
+    stream_handler.flush = stream_handler.flush_batch
+    handlers = [file_handler, stream_handler]
+
 # setting up the basic logging
 logging.basicConfig(
-    level=logging.INFO,
-    format=log_text,
-    handlers=[
-        logging.FileHandler(log_filepath),
-        logging.StreamHandler(sys.stdout)
-    ]
+    level=LOG_LEVEL,
+    handlers=handlers
 )
 
 logger = logging.getLogger("student_academic_risk_model_logger")
+
+# per-request API logs, sampled (warnings and errors are always kept)
+request_logger = logging.getLogger("student_academic_risk_model_logger.requests")
+request_logger.addFilter(SamplingFilter(REQUEST_SAMPLE_RATE))
@@ -3,82 +3,68 @@ main.py
 ==========
 
 
-Sets up the entire project pipeline
+Sets up the entire project pipeline.
+
+The stages run on a small DAG executor: independent stages (such as transforming the
+validation and test splits) run concurrently, and the configuration is parsed once.
+Stages whose inputs, configuration and code are unchanged since their last run are skipped.
+
+Usage:
+    python main.py                              # run every stage
+    python main.py --only model_evaluation      # run selected stages
+    python main.py --from model_training        # run a stage and everything downstream
+    python main.py --force                      # ignore the stage fingerprints and re-run everything
+    python main.py --update new_term.csv        # update the trained artifacts with new data only
+    python main.py --profile model_training     # run selected stages (or 'all') under cProfile
 """
 
 
 # importing the libraries
-from logger import logger
-from pipeline.data_ingestion_pipeline import DataIngestionPipeline
-from pipeline.data_transform_pipeline import DataTransformationPipeline
-from pipeline.model_training_pipeline import ModelTrainingPipeline
-from pipeline.model_evaluation_ppipeline import ModelEvaluationPipeline
-
-logger.info("End-to-end Machine Learning Project")
-
-
-# =========================== Data Ingestion ===========================
-
-STAGE_NAME = "Data Ingestion Stage"
-
-try:
-    logger.info(f"------------ {STAGE_NAME} Started ------------")
-    data_ingestion_pipeline = DataIngestionPipeline()
-    train_df, val_df, test_df = data_ingestion_pipeline.initialize_data_ingestion()
-    logger.info(f"------------ {STAGE_NAME} Completed ------------")
-
-except Exception as e:
-    logger.exception(e)
-    raise e
-
-
-# =========================== Data Transformation ===========================
-
-
-STAGE_NAME = "Data Transformation Stage"
-
-try:
-    logger.info(f"------------ {STAGE_NAME} Started ------------")
-    data_transformation_pipeline = DataTransformationPipeline()
-    data_transformation_pipeline.initialize_data_transformation(
-        train_df, val_df, test_df
-    )
-    logger.info(f"------------ {STAGE_NAME} Completed ------------")
-
-except Exception as e:
-    logger.exception(e)
-    raise e
-
-
-
-# ====================== Model Training ======================
-
-STAGE_NAME = "Model Training Stage"
-
-try:
-    logger.info(f"------------ {STAGE_NAME} Started ------------")
-    model_training_pipeline = ModelTrainingPipeline()
-    model_training_pipeline.initiate_model_training()
-    logger.info(f"------------ {STAGE_NAME} Completed ------------")
-
-except Exception as e:
-    logger.exception(e)
-    raise e
-
-
-
-# ====================== Model Evaluation ======================
-
-STAGE_NAME = "Model Evaluation Stage"
-
-try:
-    logger.info(f"------------ {STAGE_NAME} Started ------------")
-    model_evaluation_pipeline = ModelEvaluationPipeline()
-    model_evaluation_pipeline.initiate_model_evaluation()
-    logger.info(f"------------ {STAGE_NAME} Completed ------------")
-
-except Exception as e:
-    logger.exception(e)
-    raise e
-
+import argparse
+from pathlib import Path
 
+from logger import logger
+from instrumentation import log_span_report, metrics
+from config import ConfigurationManager
+from pipeline.dag import DAGRunner
+from pipeline.stages import build_stages
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="End-to-end academic risk pipeline")
+    parser.add_argument("--only", nargs="+", metavar="STAGE",
+                        help="run only these stages (plus producers of their in-memory inputs)")
+    parser.add_argument("--from", dest="from_stage", metavar="STAGE",
+                        help="run this stage and everything downstream of it")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="size of the worker pool for concurrent stages")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread",
+                        help="run concurrent stages on a thread or process pool")
+    parser.add_argument("--force", action="store_true",
+                        help="re-run stages even if their fingerprint is unchanged")
+    parser.add_argument("--update", metavar="NEW_DATA",
+                        help="update the scaler, encoders and model with a new raw data file instead of retraining")
+    parser.add_argument("--profile", nargs="+", metavar="STAGE",
+                        help="run these stages ('all' for every stage) under cProfile, stats go to logs/profiles")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    logger.info("End-to-end Machine Learning Project")
+
+    # the configuration is parsed once and shared by every stage
+    config = ConfigurationManager()
+
+    if args.update:
+        from pipeline.incremental_training_pipeline import IncrementalTrainingPipeline
+        IncrementalTrainingPipeline(config).initiate_incremental_training(args.update)
+    else:
+        runner = DAGRunner(build_stages(config), max_workers=args.workers, executor=args.executor,
+                           use_cache=not args.force, profile=args.profile)
+        runner.run(only=args.only, from_stage=args.from_stage)
+
+    # spans of the component methods (recorded in this process, i.e. with the thread executor)
+    log_span_report()
+    metrics.write_textfile(Path(config.config.artifacts_root) / "pipeline_metrics.prom")
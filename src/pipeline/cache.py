@@ -0,0 +1,130 @@
+"""
+cache.py
+==========
+
+Content-hash fingerprints for pipeline stages.
+
+A stage fingerprint combines the contents of its input files, its section of config.yaml and
+the source code of the modules implementing it. The fingerprint is stored next to the stage
+artifacts; a stage whose fingerprint is unchanged and whose outputs still exist can be skipped.
+"""
+
+
+# libraries
+import hashlib
+import json
+from pathlib import Path
+from typing import List
+
+from logger import logger
+
+
+SOURCE_ROOT = Path(__file__).resolve().parents[1]
+
+
+def file_digest(path: Path, previous: dict = None) -> dict:
+    """
+    Hashes a file, reusing the previous digest if its size and modification time are unchanged
+
+    :param path: The file to hash
+    :param previous: The record from the last fingerprint of this file
+    :return: Record with size, mtime_ns and sha256
+    :rtype: dict
+    """
+    stat = path.stat()
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime_ns") == stat.st_mtime_ns:
+        return previous
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+
+
+class StageCache:
+    def __init__(self, name: str, cache_dir, input_paths: List, config_section, code_paths: List,
+                 output_paths: List = None):
+        """
+        Initialize the stage cache
+
+        :param name: Stage name
+        :param cache_dir: Directory the fingerprint file is written to (the stage artifacts directory)
+        :param input_paths: Files the stage reads
+        :param config_section: The configuration values the stage depends on (JSON-serialisable)
+        :param code_paths: Source files implementing the stage, relative to src/
+        :param output_paths: Files the stage writes; all of them must exist for a cache hit
+        """
+        self.name = name
+        self.path = Path(cache_dir) / f".fingerprint_{name}.json"
+        self.input_paths = [Path(path) for path in input_paths]
+        self.config_section = config_section
+        self.code_paths = [SOURCE_ROOT / path for path in code_paths]
+        self.output_paths = [Path(path) for path in output_paths or []]
+
+    def stored(self) -> dict:
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def compute(self) -> dict:
+        """
+        Computes the current fingerprint of the stage
+
+        :return: Fingerprint record with per-file digests and the combined digest
+        :rtype: dict
+        """
+        previous = self.stored()
+        previous_inputs = previous.get("inputs", {})
+
+        inputs = {}
+        for path in self.input_paths:
+            key = str(path)
+            inputs[key] = file_digest(path, previous_inputs.get(key)) if path.exists() else None
+
+        code = hashlib.sha256()
+        for path in self.code_paths:
+            code.update(path.read_bytes())
+
+        config = json.dumps(self.config_section, sort_keys=True, default=str)
+
+        combined = hashlib.sha256()
+        combined.update(json.dumps({k: v["sha256"] if v else None for k, v in inputs.items()}, sort_keys=True).encode())
+        combined.update(config.encode())
+        combined.update(code.hexdigest().encode())
+
+        return {
+            "stage": self.name,
+            "digest": combined.hexdigest(),
+            "inputs": inputs,
+            "config_sha256": hashlib.sha256(config.encode()).hexdigest(),
+            "code_sha256": code.hexdigest(),
+            "outputs": [str(path) for path in self.output_paths],
+        }
+
+    def is_fresh(self, record: dict = None) -> bool:
+        """
+        True if the stored fingerprint matches the current one and every output still exists
+        """
+        record = record or self.compute()
+        if any(value is None for value in record["inputs"].values()):
+            return False
+        if not all(path.exists() for path in self.output_paths):
+            return False
+        return self.stored().get("digest") == record["digest"]
+
+    def save(self, record: dict):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w") as file:
+            json.dump(record, file, indent=2)
+
+        logger.info(f"Fingerprint saved for stage {self.name} - {self.path}")
+
+    def invalidate(self):
+        """
+        Drop the stored fingerprint, so the stage runs again on the next pipeline run
+        """
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,285 @@
+"""
+dag.py
+==========
+
+Minimal DAG executor for the pipeline stages.
+
+Each stage declares the named inputs it consumes and the named outputs it produces. A stage is
+submitted to the pool as soon as everything it depends on has finished, so independent stages
+(e.g. transforming the validation and test splits) run concurrently.
+"""
+
+
+# libraries
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from logger import logger
+from instrumentation import profile_call, span_duration
+from pipeline.cache import StageCache
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+    # ordering-only dependencies: stages whose artifacts on disk this stage reads
+    after: List[str] = field(default_factory=list)
+    # content-hash fingerprint used to skip the stage when nothing it depends on changed
+    cache: Optional[StageCache] = None
+    # rebuilds the in-memory outputs of a cached stage from its artifacts (instead of re-running it)
+    restore: Optional[Callable] = None
+
+
+@dataclass
+class StageResult:
+    name: str
+    status: str
+    seconds: float = 0.0
+
+
+class DAGRunner:
+    def __init__(self, stages: List[Stage], max_workers: int = None, executor: str = "thread",
+                 use_cache: bool = True, profile: List[str] = None):
+        """
+        Initialize the DAG runner
+
+        :param stages: The pipeline stages
+        :type stages: List[Stage]
+        :param max_workers: Size of the worker pool
+        :type max_workers: int
+        :param executor: 'thread' or 'process'. Stage functions and their inputs/outputs must be
+            picklable (module-level functions) for the process pool.
+        :type executor: str
+        :param use_cache: Skip stages whose fingerprint is unchanged (fingerprints are recorded either way)
+        :type use_cache: bool
+        :param profile: Stages to run under cProfile ('all' for every stage)
+        :type profile: List[str]
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.max_workers = max_workers
+        self.executor = executor
+        self.use_cache = use_cache
+        self.profile = set(profile or [])
+
+        self.producers = {}
+        for stage in stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(f"Output '{output}' is produced by both {self.producers[output]} and {stage.name}")
+                self.producers[output] = stage.name
+
+        for stage in stages:
+            for dependency in self.dependencies(stage.name):
+                if dependency not in self.stages:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dependency}'")
+
+        self.order = self._topological_order()
+
+    # ------------------ Graph ------------------ #
+    def data_dependencies(self, name: str) -> set:
+        """
+        Stages producing the in-memory inputs of a stage
+        """
+        stage = self.stages[name]
+        missing = [item for item in stage.inputs if item not in self.producers]
+        if missing:
+            raise ValueError(f"No stage produces the inputs {missing} of '{name}'")
+        return {self.producers[item] for item in stage.inputs}
+
+    def dependencies(self, name: str) -> set:
+        return self.data_dependencies(name) | set(self.stages[name].after)
+
+    def _topological_order(self) -> List[str]:
+        order, visiting, done = [], set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Cycle detected at stage '{name}'")
+            visiting.add(name)
+            for dependency in sorted(self.dependencies(name)):
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def downstream(self, name: str) -> set:
+        selected = {name}
+        for stage in self.order:
+            if self.dependencies(stage) & selected:
+                selected.add(stage)
+        return selected
+
+    def select(self, only: List[str] = None, from_stage: str = None) -> List[str]:
+        """
+        Resolve the stages to run. Stages producing in-memory inputs of a selected stage are
+        always added; ordering-only dependencies are assumed to be satisfied by artifacts on disk.
+
+        :param only: Run just these stages
+        :param from_stage: Run this stage and everything downstream of it
+        :return: Stage names in execution order
+        """
+        for name in list(only or []) + ([from_stage] if from_stage else []):
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage '{name}'. Available stages: {self.order}")
+
+        if only:
+            selected = set(only)
+        elif from_stage:
+            selected = self.downstream(from_stage)
+        else:
+            selected = set(self.stages)
+
+        # pull in producers of required in-memory inputs
+        pending = list(selected)
+        while pending:
+            for dependency in self.data_dependencies(pending.pop()):
+                if dependency not in selected:
+                    selected.add(dependency)
+                    pending.append(dependency)
+
+        return [name for name in self.order if name in selected]
+
+    # ------------------ Caching ------------------ #
+    def plan_cache(self, selected: List[str]) -> Dict[str, str]:
+        """
+        Decide for every selected stage whether to run it, skip it ('cached') or rebuild its
+        in-memory outputs from its artifacts ('restore').
+
+        A stage is cached when its fingerprint is unchanged and every selected stage it depends
+        on is cached too. Producers of in-memory inputs needed by a running stage are restored
+        (or re-run when they cannot be restored).
+        """
+        status = {}
+        for name in selected:
+            stage = self.stages[name]
+            dependencies = self.dependencies(name) & set(selected)
+
+            if self.use_cache and stage.cache is not None and all(status[d] == "cached" for d in dependencies):
+                status[name] = "cached" if stage.cache.is_fresh() else "run"
+            else:
+                status[name] = "run"
+
+        # consumers come after their producers, so walk backwards
+        for name in reversed(selected):
+            if status[name] != "run":
+                continue
+            for dependency in self.data_dependencies(name):
+                if status.get(dependency) == "cached":
+                    status[dependency] = "restore" if self.stages[dependency].restore is not None else "run"
+
+        return status
+
+    # ------------------ Execution ------------------ #
+    def _pool(self):
+        if self.executor == "process":
+            return ProcessPoolExecutor(max_workers=self.max_workers)
+        return ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def run(self, only: List[str] = None, from_stage: str = None) -> Dict[str, StageResult]:
+        """
+        Run the selected stages, each as soon as its dependencies have finished
+
+        :return: Per-stage status and wall time
+        :rtype: Dict[str, StageResult]
+        """
+        selected = self.select(only=only, from_stage=from_stage)
+        remaining = {name: self.dependencies(name) & set(selected) for name in selected}
+        status = self.plan_cache(selected)
+        # stages whose in-memory outputs a selected stage consumes cannot be skipped late
+        consumed = {dependency for name in selected for dependency in self.data_dependencies(name)}
+
+        values = {}
+        results = {}
+        running = {}
+        started_at = {}
+        records = {}
+        run_started = time.perf_counter()
+
+        with self._pool() as pool:
+            while remaining or running:
+                for name in [name for name, deps in remaining.items() if not deps]:
+                    stage = self.stages[name]
+                    del remaining[name]
+
+                    if status[name] == "run" and stage.cache is not None:
+                        # upstream stages may have rewritten identical artifacts: check again
+                        records[name] = stage.cache.compute()
+                        if self.use_cache and name not in consumed and stage.cache.is_fresh(records[name]):
+                            status[name] = "cached"
+
+                    if status[name] == "cached":
+                        results[name] = StageResult(name, "cached")
+                        logger.info(f"------------ {name} Skipped (unchanged fingerprint) ------------")
+                        for deps in remaining.values():
+                            deps.discard(name)
+                        continue
+
+                    started_at[name] = time.perf_counter()
+                    if status[name] == "restore":
+                        logger.info(f"------------ {name} Restored from cached artifacts ------------")
+                        running[pool.submit(stage.restore)] = name
+                    else:
+                        logger.info(f"------------ {name} Started ------------")
+                        kwargs = {item: values[item] for item in stage.inputs}
+                        if name in self.profile or "all" in self.profile:
+                            running[pool.submit(profile_call, f"stage-{name}", stage.func, **kwargs)] = name
+                        else:
+                            running[pool.submit(stage.func, **kwargs)] = name
+
+                if not running:
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    name = running.pop(future)
+                    seconds = time.perf_counter() - started_at[name]
+
+                    try:
+                        outputs = future.result() or {}
+                    except Exception as e:
+                        results[name] = StageResult(name, "failed", seconds)
+                        logger.exception(e)
+                        for other in running:
+                            other.cancel()
+                        self.log_summary(results, time.perf_counter() - run_started)
+                        raise e
+
+                    missing = set(self.stages[name].outputs) - set(outputs)
+                    if missing:
+                        raise ValueError(f"Stage '{name}' did not return its outputs {missing}")
+
+                    values.update(outputs)
+
+                    if status[name] == "restore":
+                        results[name] = StageResult(name, "restored", seconds)
+                    else:
+                        results[name] = StageResult(name, "completed", seconds)
+                        span_duration.observe(seconds, "pipeline", name)
+                        if name in records:
+                            self.stages[name].cache.save(records[name])
+                        logger.info(f"------------ {name} Completed in {seconds:.2f}s ------------")
+
+                    for deps in remaining.values():
+                        deps.discard(name)
+
+        self.log_summary(results, time.perf_counter() - run_started)
+        return results
+
+    @staticmethod
+    def log_summary(results: Dict[str, StageResult], total_seconds: float):
+        logger.info("Stage timings:")
+        for result in results.values():
+            logger.info(f"  {result.name:<24} {result.status:<10} {result.seconds:8.2f}s")
+        logger.info(f"  {'total (wall)':<24} {'':<10} {total_seconds:8.2f}s")
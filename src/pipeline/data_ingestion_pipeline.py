@@ -17,12 +17,12 @@ STAGE_NAME = "Data Ingestion Stage"
 
 
 class DataIngestionPipeline:
-    def __init__(self):
-        pass
+    def __init__(self, config: ConfigurationManager = None):
+        self.config = config
 
 
     def initialize_data_ingestion(self):
-        config = ConfigurationManager()
+        config = self.config or ConfigurationManager()
 
         data_ingestion_config = config.get_data_ingestion_config()
         data_ingestion = DataIngestion(config=data_ingestion_config)
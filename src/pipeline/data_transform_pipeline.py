@@ -15,56 +15,117 @@ from logger import logger
 
 
 class DataTransformationPipeline:
-    def __init__(self):
-        pass
-    
+    def __init__(self, config: ConfigurationManager = None):
+        self.config = config
+
+    def get_component(self) -> DataTransformation:
+        config = self.config or ConfigurationManager()
+        return DataTransformation(config.get_data_transformation_config())
+
+    # method to rebuild the fitted component from the saved scaler and encoders
+    def load_fitted(self) -> DataTransformation:
+        data_transform = self.get_component()
+        data_transform.load_fitted()
+        return data_transform
+
+    # method to fit the encoders and scaler on the training data and transform it
+    def fit_transform_train(self, train_data: pd.DataFrame) -> DataTransformation:
+        data_transform = self.get_component()
+
+        # rows added by incremental updates are part of the training data
+        incremental_rows = data_transform.load_incremental_rows()
+        if incremental_rows is not None:
+            train_data = pd.concat([train_data, incremental_rows], ignore_index=True)
+        data_transform.clear_retained_sample()
+
+        # the component takes ownership of the frames and transforms them in place
+        # loading the train data frame
+        train_data = data_transform.cast_categorical_columns(train_data)
+        train_data = data_transform.create_target_feature(train_data)
+        data_transform.sample_background(train_data)
+
+        data_transform.fit_encoder(train_data)
+        data_transform.fit_scaler(train_data)
+
+        data_transform.save_scaler()
+        data_transform.save_encoders()
+
+        train_data = data_transform.encode_categorical_columns(train_data)
+        train_data = data_transform.scale_numeric_features(train_data)
+        train_data = data_transform.downcast_numeric_columns(train_data)
+
+        data_transform.save_transformed_data(
+            train_data, data_transform.transformed_data_path("train")
+        )
+        data_transform.save_feature_metadata()
+        data_transform.save_background()
+        data_transform.save_memory_report("train")
+
+        return data_transform
+
+    # method to transform another split with the fitted encoders and scaler
+    def transform_split(self, data_transform: DataTransformation, data: pd.DataFrame, split: str):
+        data = data_transform.cast_categorical_columns(data)
+        data = data_transform.create_target_feature(data)
+        data = data_transform.encode_categorical_columns(data)
+        data = data_transform.scale_numeric_features(data)
+        data = data_transform.downcast_numeric_columns(data)
+
+        data_transform.save_transformed_data(
+            data, data_transform.transformed_data_path(split)
+        )
+        data_transform.save_memory_report(split)
+
     # method to initiate the transformation pipeline
     def initialize_data_transformation(self, train_data: pd.DataFrame, val_data: pd.DataFrame, test_data: pd.DataFrame):
         try:
-            config = ConfigurationManager()
+            data_transform = self.fit_transform_train(train_data)
 
-            data_transformation_config = config.get_data_transformation_config()
-            data_transform = DataTransformation(data_transformation_config)
+            # loading the validation data
+            self.transform_split(data_transform, val_data, "val")
 
-            # loading the train data frame
-            train_data = data_transform.cast_categorical_columns(train_data)
-            train_data = data_transform.create_target_feature(train_data)
+            # loading the test data
+            self.transform_split(data_transform, test_data, "test")
 
-            data_transform.fit_encoder(train_data)
-            data_transform.fit_scaler(train_data)
+        except Exception as e:
+            raise e
 
-            data_transform.save_scaler()
-            data_transform.save_encoders()
+    # method to fit on the raw training file in chunks and stream the transformed train split to disk
+    def fit_streaming(self) -> DataTransformation:
+        data_transform = self.get_component()
 
-            train_data = data_transform.encode_categorical_columns(train_data)
-            train_data = data_transform.scale_numeric_features(train_data)
+        # first pass: fit the encoders and scaler on the training data (and the rows of incremental updates)
+        data_transform.fit_streaming(data_transform.training_data_paths())
+        data_transform.clear_retained_sample()
 
+        data_transform.save_scaler()
+        data_transform.save_encoders()
+        data_transform.save_feature_metadata()
+        data_transform.save_background()
 
-            # loading the validation data
-            val_data = data_transform.cast_categorical_columns(val_data)
-            val_data = data_transform.create_target_feature(val_data)
+        # second pass: transform the training split chunk by chunk
+        self.transform_split_streaming(data_transform, "train")
 
-            val_data = data_transform.encode_categorical_columns(val_data)
-            val_data = data_transform.scale_numeric_features(val_data)
+        return data_transform
+
+    # method to stream one raw split through the fitted encoders and scaler
+    def transform_split_streaming(self, data_transform: DataTransformation, split: str):
+        source_paths = {
+            "train": data_transform.training_data_paths(),
+            "val": [data_transform.config.val_data_file_path],
+            "test": [data_transform.config.test_data_file_path],
+        }
+
+        data_transform.transform_streaming(source_paths[split], data_transform.transformed_data_path(split))
+        data_transform.save_memory_report(split)
+
+    # method to run the transformation in chunks straight from the raw files
+    def initialize_streaming_transformation(self):
+        try:
+            data_transform = self.fit_streaming()
+
+            self.transform_split_streaming(data_transform, "val")
+            self.transform_split_streaming(data_transform, "test")
 
-            # loading the test data
-            test_data = data_transform.cast_categorical_columns(test_data)
-            test_data = data_transform.create_target_feature(test_data)
-            test_data = data_transform.encode_categorical_columns(test_data)
-            test_data = data_transform.scale_numeric_features(test_data)
-
-            # saving the output
-            data_transform.save_transformed_data(
-                train_data, data_transformation_config.root_dir / "train.csv"
-            )
-            data_transform.save_transformed_data(
-                val_data, data_transformation_config.root_dir / "val.csv"
-            )
-            data_transform.save_transformed_data(
-                test_data, data_transformation_config.root_dir / "test.csv"
-            )
-
-            data_transform.save_feature_metadata()
-        
         except Exception as e:
             raise e
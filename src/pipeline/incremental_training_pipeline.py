@@ -0,0 +1,124 @@
+"""
+incremental_training_pipeline.py
+================================
+
+Updates the trained artifacts with a new term of data:
+- Extends the label encoders with new categories (existing codes are kept)
+- Updates the scaler statistics incrementally
+- Re-expresses the model in the updated scaler space, then updates it with the new rows
+  (and a retained uniform sample of the training history, see ModelTraining.update_model)
+- Saves the updated scaler, encoders and model, and adds the new rows to the training history
+  (incremental_rows.csv next to the transformed data) and to the retained sample
+- Re-transforms the splits with the updated scaler and encoders and records the stage
+  fingerprints, so the next pipeline run keeps the updated model instead of retraining it
+"""
+
+
+# libraries
+import pandas as pd
+from pathlib import Path
+from logger import logger
+from config import ConfigurationManager
+from components.model_training import ModelTraining
+from pipeline.data_transform_pipeline import DataTransformationPipeline
+from pipeline.stages import stage_caches
+
+
+class IncrementalTrainingPipeline:
+    def __init__(self, config: ConfigurationManager = None):
+        self.config = config
+
+    def initiate_incremental_training(self, new_data_path: Path):
+        """
+        Runs the incremental update. The model update costs grow with the size of the new data
+        and of the retained sample, not with the size of the training history (re-transforming
+        the splits on disk is one chunked pass without any fitting).
+
+        :param new_data_path: Raw file with the new student records
+        :type new_data_path: Path
+        :return: Path of the updated model
+        """
+
+        try:
+            logger.info("Starting Incremental Training Pipeline")
+
+            config = self.config or ConfigurationManager()
+
+            # stages whose outputs are up to date now are recorded again after the update
+            fresh_stages = [name for name, cache in stage_caches(config).items()
+                            if name != "model_evaluation" and cache.is_fresh()]
+
+            # loading the fitted scaler and encoders, and the model trained with them
+            pipeline = DataTransformationPipeline(config)
+            data_transform = pipeline.load_fitted()
+            old_mean, old_scale = data_transform.scaling()
+
+            model_trainer = ModelTraining(config=config.get_model_training_config())
+            model_trainer.load_model()
+
+            new_raw = pd.read_csv(new_data_path, dtype=data_transform.raw_dtypes())
+            logger.info(f"New data shape: {new_raw.shape}")
+
+            new_data = data_transform.cast_categorical_columns(new_raw.copy())
+            new_data = data_transform.create_target_feature(new_data)
+
+            # updating the encoders and scaler before transforming the new rows with them
+            data_transform.extend_encoders(new_data)
+            data_transform.update_scaler(new_data)
+            new_mean, new_scale = data_transform.scaling()
+
+            new_data = data_transform.encode_categorical_columns(new_data)
+            new_data = data_transform.scale_numeric_features(new_data)
+
+            # the model was trained on inputs scaled with the previous statistics
+            model_trainer.rescale_model(data_transform.config.numerical_columns, old_mean, old_scale,
+                                        new_mean, new_scale)
+
+            x_new, y_new = model_trainer.split_features_and_target(new_data)
+
+            # uniform sample of the training history, transformed with the updated encoders and scaler
+            retained_rows = model_trainer.config.incremental.get("retained_rows", 2000)
+            retained = data_transform.load_retained_sample(retained_rows) if retained_rows > 0 else None
+            x_retained = y_retained = None
+            retained_weight = 1.0
+            if retained is not None and len(retained["rows"]):
+                sample = retained["rows"].drop(columns="_key")
+                sample = data_transform.cast_categorical_columns(sample)
+                sample = data_transform.create_target_feature(sample)
+                sample = data_transform.encode_categorical_columns(sample)
+                sample = data_transform.scale_numeric_features(sample)
+                x_retained, y_retained = model_trainer.split_features_and_target(sample)
+                retained_weight = retained["history_rows"] / len(sample)
+
+            model_trainer.update_model(x_new=x_new, y_new=y_new, x_retained=x_retained, y_retained=y_retained,
+                                       retained_weight=retained_weight)
+
+            # saved together once the model update succeeded
+            data_transform.save_scaler()
+            data_transform.save_encoders()
+            data_transform.save_feature_metadata()
+            model_path = model_trainer.save_model()
+
+            # the new rows stay part of the training data for later updates and full retrains
+            data_transform.append_incremental_rows(new_raw)
+            if retained is not None:
+                data_transform.save_retained_sample(retained, new_raw, retained_rows)
+
+            # the transformed splits on disk were scaled with the previous statistics
+            for split in ("train", "val", "test"):
+                pipeline.transform_split_streaming(data_transform.fork(), split)
+
+            # the updated artifacts are the outputs of these stages now (the training history is an
+            # input of the transformation fingerprint); evaluation runs again for the updated model
+            caches = stage_caches(config)
+            for name in fresh_stages:
+                caches[name].save(caches[name].compute())
+            logger.info(f"Stage fingerprints recorded for the updated artifacts: {fresh_stages}")
+
+            logger.info("Incremental Training Pipeline Completed Successfully")
+
+            return model_path
+
+        except Exception as e:
+            logger.error(f"Error in Incremental Training Pipeline: {e}")
+            raise e
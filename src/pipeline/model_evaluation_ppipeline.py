@@ -13,26 +13,31 @@ from components.model_evaluation import ModelEvaluation
 
 
 class ModelEvaluationPipeline:
-    def __init__(self):
-        pass
+    def __init__(self, config: ConfigurationManager = None):
+        self.config = config
 
     def initiate_model_evaluation(self):
         try:
             logger.info("Model Evaluation Pipeline Started")
 
-            config = ConfigurationManager()
+            config = self.config or ConfigurationManager()
             eval_config = config.get_model_evaluation_config()
 
             evaluator = ModelEvaluation(eval_config)
 
             model = evaluator.load_model()
-            eval_df = evaluator.load_evaluation_data()
+            columns = list(model.feature_names_in_) + [eval_config.target_column]
+            segment_columns = list(eval_config.segment_columns)
+            eval_df = evaluator.load_evaluation_data(
+                columns=columns + [col for col in segment_columns if col not in columns]
+            )
 
             X_eval, y_eval = evaluator.split_features_and_target(eval_df, model)
 
 
-            metrics = evaluator.evaluate(model, X_eval, y_eval)
-            evaluator.log_to_mlflow(model, metrics)
+            report = evaluator.evaluate(model, X_eval, y_eval, segments=eval_df[segment_columns])
+            evaluator.save_metrics(report)
+            evaluator.log_to_mlflow(model, report)
 
             logger.info("Model Evaluation Pipeline Completed")
 
@@ -5,7 +5,7 @@ model_training_pipeline.py
 Orchestrates the model training workflow:
 - Loads transformed data
 - Splits features and target
-- Trains the model
+- Trains the model, or searches several model families on the validation split
 - Saves the trained model
 """
 
@@ -17,8 +17,8 @@ from components.model_training import ModelTraining
 
 
 class ModelTrainingPipeline:
-    def __init__(self):
-        pass
+    def __init__(self, config: ConfigurationManager = None):
+        self.config = config
 
     def initiate_model_training(self):
         """
@@ -30,7 +30,7 @@ class ModelTrainingPipeline:
 
 
             # loading the configuration
-            config = ConfigurationManager()
+            config = self.config or ConfigurationManager()
             model_training_config = config.get_model_training_config()
 
             # initializing component
@@ -43,8 +43,14 @@ class ModelTrainingPipeline:
             # splitting the features and target feature
             x_train, y_train = model_trainer.split_features_and_target(train_data)
 
-            # training the model
-            model_trainer.train_model(x_train=x_train, y_train=y_train)
+            if model_training_config.search.get("enabled", False):
+                # selecting the model family and hyperparameters on the validation split
+                x_val, y_val = model_trainer.split_features_and_target(val_data)
+                model_trainer.search_models(x_train=x_train, y_train=y_train, x_val=x_val, y_val=y_val)
+                model_trainer.save_search_results()
+            else:
+                # training the model
+                model_trainer.train_model(x_train=x_train, y_train=y_train)
 
             # saving the model
             model_path = model_trainer.save_model()
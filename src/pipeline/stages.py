@@ -0,0 +1,204 @@
+"""
+stages.py
+============
+
+Declares the pipeline stages and their inputs and outputs for the DAG runner
+"""
+
+
+# libraries
+from functools import partial
+
+from config import ConfigurationManager
+from utils import dataset_path
+from pipeline.cache import SOURCE_ROOT, StageCache
+from pipeline.dag import Stage
+
+
+# stage functions are module level (and bound with partial) so they can run on a process pool.
+# Each imports its pipeline on first use, so stages that are skipped or cached never load
+# their libraries (sklearn, mlflow)
+def run_data_ingestion(config: ConfigurationManager):
+    from pipeline.data_ingestion_pipeline import DataIngestionPipeline
+    train_df, val_df, test_df = DataIngestionPipeline(config).initialize_data_ingestion()
+    return {"train_df": train_df, "val_df": val_df, "test_df": test_df}
+
+
+def run_fit_transformation(config: ConfigurationManager, train_df):
+    from pipeline.data_transform_pipeline import DataTransformationPipeline
+    data_transform = DataTransformationPipeline(config).fit_transform_train(train_df)
+    return {"data_transform": data_transform}
+
+
+def restore_fit_transformation(config: ConfigurationManager):
+    from pipeline.data_transform_pipeline import DataTransformationPipeline
+    # the scaler and encoders of a cached run are reloaded instead of refitted
+    data_transform = DataTransformationPipeline(config).load_fitted()
+    return {"data_transform": data_transform}
+
+
+# the split stages run concurrently, each on its own fork of the fitted component
+def run_transform_val(config: ConfigurationManager, data_transform, val_df):
+    from pipeline.data_transform_pipeline import DataTransformationPipeline
+    DataTransformationPipeline(config).transform_split(data_transform.fork(), val_df, "val")
+    return {}
+
+
+def run_transform_test(config: ConfigurationManager, data_transform, test_df):
+    from pipeline.data_transform_pipeline import DataTransformationPipeline
+    DataTransformationPipeline(config).transform_split(data_transform.fork(), test_df, "test")
+    return {}
+
+
+def run_fit_transformation_streaming(config: ConfigurationManager):
+    from pipeline.data_transform_pipeline import DataTransformationPipeline
+    data_transform = DataTransformationPipeline(config).fit_streaming()
+    return {"data_transform": data_transform}
+
+
+def run_transform_split_streaming(config: ConfigurationManager, split: str, data_transform):
+    from pipeline.data_transform_pipeline import DataTransformationPipeline
+    DataTransformationPipeline(config).transform_split_streaming(data_transform.fork(), split)
+    return {}
+
+
+def run_model_training(config: ConfigurationManager):
+    from pipeline.model_training_pipeline import ModelTrainingPipeline
+    model_path = ModelTrainingPipeline(config).initiate_model_training()
+    return {"model_path": model_path}
+
+
+def run_model_evaluation(config: ConfigurationManager):
+    from pipeline.model_evaluation_ppipeline import ModelEvaluationPipeline
+    ModelEvaluationPipeline(config).initiate_model_evaluation()
+    return {}
+
+
+# modules every stage depends on
+COMMON_CODE = ["utils.py", "entity.py", "config.py"]
+
+
+def stage_caches(config: ConfigurationManager) -> dict:
+    """
+    Builds the fingerprint of every stage: the files it reads, its configuration section and
+    the source files implementing it. Relative paths are resolved against src/, as the stages do.
+
+    :param config: The parsed configuration
+    :type config: ConfigurationManager
+    :return: StageCache per stage name
+    :rtype: dict
+    """
+
+    ingestion = config.get_data_ingestion_config()
+    transformation = config.get_data_transformation_config()
+    training = config.get_model_training_config()
+    evaluation = config.get_model_evaluation_config()
+
+    transformation_dir = SOURCE_ROOT / transformation.root_dir
+    fitted = [transformation_dir / "scaler.joblib", transformation_dir / "label_encoders.joblib"]
+    transformed = {
+        split: SOURCE_ROOT / dataset_path(transformation_dir / f"{split}.csv", transformation.data_format)
+        for split in ("train", "val", "test")
+    }
+    model_path = SOURCE_ROOT / training.root_dir / training.model_name
+    # raw rows of incremental updates, part of the training data once an update has been applied
+    incremental_rows = [path for path in [transformation_dir / "incremental_rows.csv"] if path.exists()]
+
+    transformation_section = {**config.config.data_transformation.to_dict(), "data_format": transformation.data_format}
+    transformation_code = ["components/data_transformation.py", "pipeline/data_transform_pipeline.py"] + COMMON_CODE
+
+    return {
+        "data_ingestion": StageCache(
+            "data_ingestion", SOURCE_ROOT / ingestion.root_dir,
+            input_paths=[SOURCE_ROOT / ingestion.train_data_file_path, SOURCE_ROOT / ingestion.val_data_file_path,
+                         SOURCE_ROOT / ingestion.test_data_file_path],
+            config_section={**config.config.data_ingestion.to_dict(), "categorical_columns": ingestion.categorical_columns},
+            code_paths=["components/data_ingestion.py", "pipeline/data_ingestion_pipeline.py"] + COMMON_CODE,
+        ),
+        "data_transformation": StageCache(
+            "data_transformation", transformation_dir,
+            input_paths=[SOURCE_ROOT / transformation.train_data_file_path] + incremental_rows,
+            config_section=transformation_section,
+            code_paths=transformation_code,
+            output_paths=fitted + [transformation_dir / "feature_metadata.joblib", transformation_dir / "background.joblib",
+                                   transformed["train"]],
+        ),
+        "transform_val": StageCache(
+            "transform_val", transformation_dir,
+            input_paths=[SOURCE_ROOT / transformation.val_data_file_path] + fitted,
+            config_section=transformation_section,
+            code_paths=transformation_code,
+            output_paths=[transformed["val"]],
+        ),
+        "transform_test": StageCache(
+            "transform_test", transformation_dir,
+            input_paths=[SOURCE_ROOT / transformation.test_data_file_path] + fitted,
+            config_section=transformation_section,
+            code_paths=transformation_code,
+            output_paths=[transformed["test"]],
+        ),
+        "model_training": StageCache(
+            "model_training", SOURCE_ROOT / training.root_dir,
+            input_paths=[SOURCE_ROOT / training.train_data_file_path, SOURCE_ROOT / training.val_data_file_path,
+                         SOURCE_ROOT / training.test_data_file_path],
+            config_section={**config.config.model_training.to_dict(), "data_format": config.config.data_format,
+                            "search": training.search},
+            code_paths=["components/model_training.py", "pipeline/model_training_pipeline.py"] + COMMON_CODE,
+            output_paths=[model_path],
+        ),
+        "model_evaluation": StageCache(
+            "model_evaluation", SOURCE_ROOT / evaluation.root_dir,
+            input_paths=[SOURCE_ROOT / evaluation.model_path, SOURCE_ROOT / evaluation.eval_data_file_path, fitted[1]],
+            config_section={**config.config.model_evaluation.to_dict(), "data_format": config.config.data_format,
+                            "bootstrap": evaluation.bootstrap},
+            code_paths=["components/model_evaluation.py", "pipeline/model_evaluation_ppipeline.py"] + COMMON_CODE,
+            output_paths=[SOURCE_ROOT / evaluation.root_dir / "metrics.json",
+                          SOURCE_ROOT / evaluation.root_dir / "evaluation_report.json"],
+        ),
+    }
+
+
+def build_stages(config: ConfigurationManager):
+    """
+    Builds the stage graph. The encoders and scaler are fitted once on the training split,
+    after which the validation and test splits are transformed in parallel.
+
+    :param config: The parsed configuration, shared by every stage
+    :type config: ConfigurationManager
+    :return: The pipeline stages
+    :rtype: list
+    """
+
+    caches = stage_caches(config)
+    restore = partial(restore_fit_transformation, config)
+
+    if config.get_data_transformation_config().streaming:
+        # the raw files are read in chunks by the transformation stages themselves
+        transformation_stages = [
+            Stage("data_transformation", partial(run_fit_transformation_streaming, config),
+                  outputs=["data_transform"], cache=caches["data_transformation"], restore=restore),
+            Stage("transform_val", partial(run_transform_split_streaming, config, "val"),
+                  inputs=["data_transform"], cache=caches["transform_val"]),
+            Stage("transform_test", partial(run_transform_split_streaming, config, "test"),
+                  inputs=["data_transform"], cache=caches["transform_test"]),
+        ]
+    else:
+        transformation_stages = [
+            Stage("data_ingestion", partial(run_data_ingestion, config),
+                  outputs=["train_df", "val_df", "test_df"], cache=caches["data_ingestion"]),
+            Stage("data_transformation", partial(run_fit_transformation, config),
+                  inputs=["train_df"], outputs=["data_transform"],
+                  cache=caches["data_transformation"], restore=restore),
+            Stage("transform_val", partial(run_transform_val, config),
+                  inputs=["data_transform", "val_df"], cache=caches["transform_val"]),
+            Stage("transform_test", partial(run_transform_test, config),
+                  inputs=["data_transform", "test_df"], cache=caches["transform_test"]),
+        ]
+
+    return transformation_stages + [
+        Stage("model_training", partial(run_model_training, config),
+              outputs=["model_path"], after=["data_transformation", "transform_val", "transform_test"],
+              cache=caches["model_training"]),
+        Stage("model_evaluation", partial(run_model_evaluation, config),
+              after=["model_training"], cache=caches["model_evaluation"]),
+    ]
@@ -0,0 +1,42 @@
+"""
+serve.py
+==========
+
+
+Serving entry point of the prediction API.
+
+Only the API package is imported: fastapi, numpy, joblib and, when the model is unpickled, the
+model's own sklearn classes. Nothing from the training stack (components, pipeline stages, the
+configuration manager, mlflow, box, ensure) is loaded, so new serving processes start quickly.
+benchmarks/imports.py checks that this stays true.
+
+Usage:
+    python serve.py                                  # http://127.0.0.1:8000
+    python serve.py --host 0.0.0.0 --port 8000 --workers 4
+"""
+
+
+# importing the libraries
+import argparse
+
+
+# top-level packages of the training stack, which a serving process must not import
+TRAINING_MODULES = ("components", "pipeline", "config", "utils", "entity", "mlflow", "box", "ensure", "main")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve the academic risk prediction API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    parser.add_argument("--log-level", default="info", help="uvicorn log level")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    import uvicorn
+
+    # several workers re-import the app in each process, so they need the import string
+    uvicorn.run("api.app:app", host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
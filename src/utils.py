@@ -8,16 +8,46 @@ Implements the utility functions needed in the project
 
 # implementing the necessary libraries
 import os, yaml
+from collections import defaultdict
+import threading
+import time
+import tracemalloc
+import typing
+from contextlib import contextmanager
+from functools import wraps
+import numpy as np
+import pandas as pd
 from logger import logger
-from ensure import ensure_annotations
-from box import ConfigBox
-from box.exceptions import BoxValueError
 from pathlib import Path
 
 
+# box and ensure are imported on the first call, not when utils is imported
+def ensure_annotations(func):
+    """
+    ensure.ensure_annotations, applied on the first call of the function
+
+    :param func: Function whose annotations are checked (may use the string annotation 'ConfigBox')
+    """
+
+    checked = None
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        nonlocal checked
+        if checked is None:
+            from box import ConfigBox
+            from ensure import ensure_annotations as ensure
+
+            func.__annotations__ = typing.get_type_hints(func, localns={"ConfigBox": ConfigBox})
+            checked = ensure(func)
+        return checked(*args, **kwargs)
+
+    return wrapper
+
+
 # function to read YAML file
 @ensure_annotations
-def read_yaml(file_path: Path) -> ConfigBox:
+def read_yaml(file_path: Path) -> "ConfigBox":
     """
     Reads the yaml files with the parameters
     
@@ -27,6 +57,9 @@ def read_yaml(file_path: Path) -> ConfigBox:
     :rtype: ConfigBox
     """
 
+    from box import ConfigBox
+    from box.exceptions import BoxValueError
+
     try:
         with open(file_path) as file:
             content = yaml.safe_load(file)
@@ -56,3 +89,281 @@ def create_dictionaries(directory_name: list, verbose=True):
         if verbose:
             logger.info(f"Directory Created Successfully - {path}")
 
+
+
+# supported on-disk formats for the datasets passed between stages
+DATA_FORMATS = ("parquet", "csv")
+
+
+def dataset_path(file_path, data_format: str) -> Path:
+    """
+    Resolves a dataset path to the configured on-disk format
+
+    :param file_path: The configured dataset path
+    :param data_format: One of DATA_FORMATS
+    :type data_format: str
+    :return: The path with the matching file extension
+    :rtype: Path
+    """
+
+    if data_format not in DATA_FORMATS:
+        raise ValueError(f"Unsupported data format: {data_format}. Expected one of {DATA_FORMATS}")
+
+    return Path(file_path).with_suffix(f".{data_format}")
+
+
+def save_dataframe(dataframe: pd.DataFrame, file_path: Path):
+    """
+    Saves a dataframe in the format given by the file extension.
+    Parquet keeps the column dtypes (category, compact integers, floats) as a typed schema.
+
+    :param dataframe: The dataframe to save
+    :type dataframe: pd.DataFrame
+    :param file_path: Destination path (.parquet or .csv)
+    :type file_path: Path
+    """
+
+    file_path = Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if file_path.suffix == ".parquet":
+        dataframe.to_parquet(file_path, engine="pyarrow", index=False)
+    else:
+        dataframe.to_csv(file_path, index=False)
+
+
+def load_dataframe(file_path: Path, columns: list = None) -> pd.DataFrame:
+    """
+    Loads a dataframe saved with save_dataframe, reading only the requested columns
+
+    :param file_path: Source path (.parquet or .csv)
+    :type file_path: Path
+    :param columns: Columns to read (all columns if None)
+    :type columns: list
+    :return: The loaded dataframe
+    :rtype: pd.DataFrame
+    """
+
+    file_path = Path(file_path)
+    columns = list(columns) if columns is not None else None
+
+    if file_path.suffix == ".parquet":
+        return pd.read_parquet(file_path, engine="pyarrow", columns=columns)
+
+    dataframe = pd.read_csv(file_path, usecols=columns)
+    return dataframe[columns] if columns is not None else dataframe
+
+
+def raw_csv_dtypes(categorical_columns) -> dict:
+    """
+    Explicit dtypes for reading the raw CSV files: categorical columns as str, every other column
+    as float64. Every reader of the raw data (whole files, chunks, incremental updates) uses them,
+    so values and encoder vocabularies never depend on per-file or per-chunk dtype inference
+    (e.g. '17' in one chunk and '17.0' in another where that chunk has a missing value).
+
+    :param categorical_columns: The categorical columns
+    :type categorical_columns: list
+    :return: Dtype per column for pd.read_csv (float64 for any column not listed)
+    :rtype: dict
+    """
+
+    return defaultdict(lambda: "float64", {col: str for col in categorical_columns})
+
+
+def iter_dataframe_chunks(file_path: Path, chunk_size: int, columns: list = None, dtypes: dict = None):
+    """
+    Reads a dataset in chunks of at most chunk_size rows so it never has to fit in memory
+
+    :param file_path: Source path (.parquet or .csv)
+    :type file_path: Path
+    :param chunk_size: Number of rows per chunk
+    :type chunk_size: int
+    :param columns: Columns to read (all columns if None)
+    :type columns: list
+    :param dtypes: Column dtypes of a CSV source (see raw_csv_dtypes); parquet files carry their own
+    :type dtypes: dict
+    :return: Generator of dataframes
+    """
+
+    file_path = Path(file_path)
+    columns = list(columns) if columns is not None else None
+
+    if file_path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(file_path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(file_path, chunksize=chunk_size, usecols=columns, dtype=dtypes)
+
+
+class CategoryEncoder:
+    """
+    Label encoder with an explicit code per category, for vocabularies extended after fitting.
+    LabelEncoder looks codes up by binary search, so its classes_ must stay sorted, while an
+    extended vocabulary keeps the existing codes and appends the new categories after them.
+    classes_ lists the categories in code order, like LabelEncoder.classes_.
+    """
+
+    def __init__(self, classes):
+        """
+        :param classes: The vocabulary, indexed by code
+        """
+        self.classes_ = np.asarray(classes)
+        self.codes = {value: code for code, value in enumerate(self.classes_.tolist())}
+
+    def transform(self, values) -> np.ndarray:
+        """
+        Codes of the values (compared as strings)
+
+        :raises ValueError: On a category outside the vocabulary, as LabelEncoder does
+        """
+        values = [str(value) for value in values]
+        unseen = sorted({value for value in values if value not in self.codes})
+        if unseen:
+            raise ValueError(f"y contains previously unseen labels: {unseen}")
+        return np.array([self.codes[value] for value in values], dtype=np.int64)
+
+    def inverse_transform(self, codes) -> np.ndarray:
+        return self.classes_[np.asarray(codes, dtype=np.intp)]
+
+
+class ChunkedDatasetWriter:
+    """
+    Appends dataframe chunks to a single parquet or csv file.
+    All chunks are written with the schema of the first one, which matches the others because
+    the raw chunks are read with explicit dtypes (see raw_csv_dtypes).
+    """
+
+    def __init__(self, file_path: Path):
+        self.file_path = Path(file_path)
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._writer = None
+        self._schema = None
+        self._columns = None
+        self.rows_written = 0
+
+    def write(self, dataframe: pd.DataFrame):
+        if self.file_path.suffix == ".parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            if self._writer is None:
+                table = pa.Table.from_pandas(dataframe, preserve_index=False)
+                self._schema = table.schema
+                self._writer = pq.ParquetWriter(self.file_path, self._schema)
+            else:
+                table = pa.Table.from_pandas(dataframe, schema=self._schema, preserve_index=False)
+            self._writer.write_table(table)
+        else:
+            if self._columns is None:
+                self._columns = list(dataframe.columns)
+                dataframe.to_csv(self.file_path, index=False, mode="w")
+            else:
+                dataframe[self._columns].to_csv(self.file_path, index=False, header=False, mode="a")
+
+        self.rows_written += len(dataframe)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# function to read the resident set size of the current process
+def resident_memory_bytes() -> int:
+    """
+    Returns the current resident set size (RSS) of this process in bytes
+
+    :return: Resident memory in bytes (0 if it cannot be determined)
+    :rtype: int
+    """
+
+    try:
+        with open("/proc/self/statm") as file:
+            resident_pages = int(file.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        try:
+            import resource
+            # peak RSS, in KiB on Linux and bytes on macOS
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except ImportError:
+            return 0
+
+
+# steps being measured by track_memory, per thread (tracemalloc and the RSS are process-wide)
+_measuring = {}
+_measuring_lock = threading.Lock()
+_started_tracing = False
+
+
+@contextmanager
+def track_memory(step: str, report: list = None):
+    """
+    Measures the peak Python/NumPy allocations (tracemalloc) and the resident memory of a step
+
+    tracemalloc counts every thread of the process, so a step that overlaps with a step measured
+    on another thread (e.g. stages on the thread pool) only reports its duration: its memory
+    figures are None and it is flagged as concurrent.
+
+    :param step: Name of the step being measured
+    :type step: str
+    :param report: Optional list the measurement dict is appended to
+    :type report: list
+    """
+
+    global _started_tracing
+
+    state = {"concurrent": False}
+    with _measuring_lock:
+        if _measuring:
+            state["concurrent"] = True
+            for other in _measuring.values():
+                other["concurrent"] = True
+        elif not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _measuring[threading.get_ident()] = state
+
+        tracemalloc.reset_peak()
+        allocated_before, _ = tracemalloc.get_traced_memory()
+    rss_before = resident_memory_bytes()
+    started = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        with _measuring_lock:
+            allocated_after, peak = tracemalloc.get_traced_memory()
+            del _measuring[threading.get_ident()]
+            if not _measuring and _started_tracing:
+                tracemalloc.stop()
+                _started_tracing = False
+
+        measurement = {"step": step, "seconds": round(time.perf_counter() - started, 4)}
+        if state["concurrent"]:
+            measurement.update(peak_mb=None, retained_mb=None, resident_mb=None, resident_delta_mb=None,
+                               concurrent=True)
+            logger.warning(f"Memory - {step}: overlapped with a step on another thread, memory not measured")
+        else:
+            measurement.update(
+                peak_mb=round((peak - allocated_before) / 1e6, 3),
+                retained_mb=round((allocated_after - allocated_before) / 1e6, 3),
+                resident_mb=round(resident_memory_bytes() / 1e6, 3),
+                resident_delta_mb=round((resident_memory_bytes() - rss_before) / 1e6, 3),
+            )
+            logger.info(
+                f"Memory - {step}: peak {measurement['peak_mb']} MB, retained {measurement['retained_mb']} MB, "
+                f"resident {measurement['resident_mb']} MB"
+            )
+        if report is not None:
+            report.append(measurement)